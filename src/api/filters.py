@@ -1,10 +1,19 @@
 import django_filters
 import re
-from django.db.models import Case, ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models import (Case,
+                              ExpressionWrapper,
+                              F,
+                              FloatField,
+                              IntegerField,
+                              OuterRef,
+                              Subquery,
+                              Sum,
+                              Value,
+                              When)
 from django.db.models.functions import Coalesce, Lower
 from rest_framework.filters import OrderingFilter
 
-from bdo.models.character import Character
+from bdo.models.stats import get_stat_window
 from bdo.models.war import War
 
 
@@ -74,14 +83,36 @@ class MemberOrderingFilter(OrderingFilter):
 
         return self.get_default_ordering(view)
 
+    def annotate_window_stat(self, queryset, window, guild_pk, stat):
+        """
+        Annotate a stat summed over the rollup buckets of the window as ``window_<stat>``.
+        """
+        if stat == 'kdr':
+            queryset = self.annotate_window_stat(queryset, window, guild_pk, 'total_kills')
+            queryset = self.annotate_window_stat(queryset, window, guild_pk, 'death')
+
+            return queryset.annotate(window_kdr=Case(When(window_death=0, then=Value(0.0)),
+                                                     default=(F('window_total_kills') * 1.0 / F('window_death')),
+                                                     output_field=FloatField()))
+
+        model, start = window
+        rollup_qs = (model.objects.filter(guild_id=guild_pk, user_profile=OuterRef('user_id'), bucket__gte=start)
+                                  .order_by()
+                                  .values('user_profile')
+                                  .annotate(total=Sum(stat))
+                                  .values('total'))
+
+        return queryset.annotate(**{
+            'window_{0}'.format(stat): Coalesce(Subquery(rollup_qs, output_field=IntegerField()), 0)
+        })
+
     def filter_queryset(self, request, queryset, view):
         params = request.query_params.get(self.ordering_param)
         guild_pk = int(request.parser_context['kwargs']['guild_pk'])
+        window = get_stat_window(request.query_params.get('window'))
 
         if params:
             fields = [param.strip() for param in params.split(',')]
-            char_qs = Character.objects.filter(is_main=True, profile=OuterRef('user_id'))
-            gearscore_expression = (F('ap') + F('aap'))/2 + F('dp') + F('profile__npc_renown')
             ordering = []
 
             # Special Ordering
@@ -89,20 +120,21 @@ class MemberOrderingFilter(OrderingFilter):
                 if re.match('^-?name', field):
                     ordering.append(field.replace("name", "user__family_name"))
                 elif re.match('^-?level$', field):
-                    queryset = queryset.annotate(level=Coalesce(Subquery(char_qs.values('level')[:1]), 0))
-                    ordering.append(field)
+                    # Indexed copies of the main character on the profile
+                    ordering.append(field.replace('level', 'user__main_level'))
                 elif re.match('^-?className', field):
-                    queryset = queryset.annotate(
-                        className=Coalesce(Subquery(char_qs.values('character_class__name')[:1]), Value('')))
-                    ordering.append(field)
+                    ordering.append(field.replace('className', 'user__main_class_name'))
                 elif re.match('^-?gearscore$', field):
-                    queryset = queryset.annotate(gearscore=Coalesce(
-                        Subquery(char_qs.annotate(gearscore=gearscore_expression).values('gearscore')[:1],
-                                 output_field=IntegerField()), 0))
-                    ordering.append(field)
+                    ordering.append(field.replace('gearscore', 'user__main_gearscore'))
                 elif re.match('^-?attendance_rate', field):
-                    # Prefetching is done in viewset
-                    ordering.append(field.replace('attendance_rate', '_prefetched_attendance_rate'))
+                    # Stored on the aggregate and indexed per guild
+                    queryset = queryset.filter(user__aggregatedmemberstats__guild_id=guild_pk)
+                    ordering.append(field.replace('attendance_rate', 'user__aggregatedmemberstats__attendance_rate'))
+                elif re.match(self.stat_ordering_fields_regex, field) and window is not None:
+                    # Sort on the totals of the requested window
+                    stat = self.stat_ordering_fields_regex.match(field).group(1)
+                    queryset = self.annotate_window_stat(queryset, window, guild_pk, stat)
+                    ordering.append(field.replace(stat, 'window_{0}'.format(stat)))
                 elif re.match(self.stat_ordering_fields_regex, field):
                     queryset = queryset.filter(user__aggregatedmemberstats__guild_id=guild_pk)
                     ordering.append(re.sub(r'({0})'.format("|".join(self.stat_ordering_fields)),
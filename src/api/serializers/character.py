@@ -4,6 +4,7 @@ from rest_framework.exceptions import ValidationError
 from api.serializers.guild_content import GuildMembershipSerializer
 from api.serializers.mixin import BaseSerializerMixin
 from api.serializers.stat import AggregatedUserWarStatsSerializer
+from bdo.guild_summary import apply_summary_changes, get_changes, get_contributions, get_guild_ids
 from bdo.models.character import Character, Profile
 from bdo.models.content import CharacterClass
 from bdo.models.region import Region
@@ -27,9 +28,17 @@ class CharacterSerializer(BaseSerializerMixin, serializers.ModelSerializer):
         read_only_fields = ('profile',)
 
     def toggle_off_other_main(self, current_character):
-        (Character.objects.filter(profile=current_character.profile)
-                          .exclude(id=current_character.id)
-                          .update(is_main=False))
+        other_mains = list(Character.objects.filter(profile=current_character.profile_id, is_main=True)
+                                            .exclude(id=current_character.id)
+                                            .values_list('id', flat=True))
+
+        if other_mains:
+            # update() sends no signals, take the demoted mains out of the guild summaries here
+            demoted, _ = get_contributions(id__in=other_mains)
+            Character.objects.filter(id__in=other_mains).update(is_main=False)
+            apply_summary_changes(get_guild_ids(current_character.profile_id), get_changes(demoted, {}))
+
+        Profile.refresh_main([current_character.profile_id])
 
     def create(self, validated_data):
         character = super(CharacterSerializer, self).create(validated_data)
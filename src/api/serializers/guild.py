@@ -1,4 +1,3 @@
-from collections import OrderedDict
 from expander import ExpanderSerializerMixin
 from rest_framework import serializers
 
@@ -21,6 +20,7 @@ class GuildMemberSerializer(BaseSerializerMixin, ExpanderSerializerMixin, serial
     name = serializers.StringRelatedField(source='user', read_only=True)
     main_character = serializers.DictField(read_only=True)
     stats = AggregatedGuildMemberWarStatsSerializer(read_only=True)
+    window_stats = serializers.DictField(read_only=True)
 
     class Meta:
         model = GuildMember
@@ -34,7 +34,8 @@ class GuildMemberSerializer(BaseSerializerMixin, ExpanderSerializerMixin, serial
             'family_name',
             'name',
             'main_character',
-            'stats'
+            'stats',
+            'window_stats'
         )
         expandable_fields = {
             'user': ExtendedProfileSerializer,
@@ -49,36 +50,11 @@ class GuildMemberSerializer(BaseSerializerMixin, ExpanderSerializerMixin, serial
         if 'stats' not in self.context['include']:
             self.fields.pop('stats')
             self.fields.pop('attendance_rate')
+        if 'stats' not in self.context['include'] or self.context.get('window') is None:
+            self.fields.pop('window_stats')
         if 'main_character' not in self.context['include']:
             self.fields.pop('main_character')
 
-    def for_csv(self):
-        """
-        Convert data to CSV.
-
-        Flatten dictionaries when possible.
-        """
-        flattened_data = OrderedDict()
-        fields = ['role', 'family_name', 'name', 'discord_username', 'main_character', 'attendance_rate', 'stats']
-        data = self.data
-
-        for field in fields:
-            value = data.get(field, None)
-
-            if field == "main_character":
-                flattened_data["level"] = value.get("level", "")
-                flattened_data["class"] = value.get("class", "")
-                flattened_data["gearscore"] = value.get("gearscore", "")
-            elif field == "role" and isinstance(value, dict):
-                flattened_data["role"] = value.get("name", "")
-            elif field == "stats" and isinstance(value, dict):
-                for stat_field, stat_value in value.items():
-                    flattened_data[stat_field] = stat_value
-            elif value is not None:
-                flattened_data[field] = value
-
-        return flattened_data
-
 
 class SimpleGuildSerializer(NestedGuildSerializer):
     """
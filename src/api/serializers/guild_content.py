@@ -25,9 +25,14 @@ class NestedGuildSerializer(BaseSerializerMixin, serializers.ModelSerializer):
         fields = ('id', 'logo_url', 'name', 'pending_war')
 
     def get_pending_war(self, instance):
-        membership = instance.get_membership(self.context['request'].user.profile)
-
-        if membership is None or not membership.has_permission('view_war'):
+        if hasattr(instance, '_can_view_war'):
+            # Annotated by Guild.annotate_list
+            can_view_war = instance._can_view_war
+        else:
+            membership = instance.get_membership(self.context['request'].user.profile)
+            can_view_war = membership is not None and membership.has_permission('view_war')
+
+        if not can_view_war:
             return None
 
         return instance.pending_war()
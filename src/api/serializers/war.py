@@ -8,10 +8,18 @@ from rest_framework.compat import unicode_to_repr
 from api.serializers.content import WarNodeSerializer
 from api.serializers.mixin import BaseSerializerMixin
 from api.serializers.profile import ExtendedProfileSerializer
+from bdo.aggregates import (AggregateBatch,
+                            get_attendance_increments,
+                            increment_aggregates,
+                            increment_rollups,
+                            refresh_recent_wars,
+                            triggers_enabled)
+from bdo.ledger import get_ledger_entry, record_ledger_entries
 from bdo.models.character import Profile
 from bdo.models.content import WarNode
 from bdo.models.guild import Guild
-from bdo.models.stats import (AggregatedGuildMemberWarStats,
+from bdo.models.stats import (ROLLUP_MODELS,
+                              AggregatedGuildMemberWarStats,
                               AggregatedGuildWarStats,
                               AggregatedUserWarStats)
 from bdo.models.war import (war_finish,
@@ -106,20 +114,28 @@ class WarAttendanceSerializer(BaseSerializerMixin, ExpanderSerializerMixin, seri
         return attendee.slot.team.name
 
     def get_call_sign(self, attendee):
-        callsign = attendee.warcallsign_set.first()
-        if not callsign:
-            return None
+        # Iterate the prefetched call signs, first() would query per attendee
+        for callsign in attendee.warcallsign_set.all():
+            return callsign.name
 
-        return callsign.name
+        return None
 
     def validate_character(self, character):
         # The character exists, check if it is owned by the current user
-        if self.instance is None or character.profile == self.instance.user_profile:
+        if self.instance is None or character.profile_id == self.instance.user_profile_id:
             return character
 
         raise serializers.ValidationError("The character specified does not belong to the user.")
 
 
+class MyWarAttendanceSerializer(WarAttendanceSerializer):
+    """
+    The caller's own attendance, without the roster fields needing extra queries.
+    """
+    class Meta(WarAttendanceSerializer.Meta):
+        fields = ('war', 'user_profile', 'name', 'character', 'id', 'is_attending', 'note')
+
+
 class NestedWarAttendanceSerializer(WarAttendanceSerializer):
     date = serializers.DateTimeField(source='war.date')
 
@@ -297,8 +313,11 @@ class WarUpdateSerializer(BaseSerializerMixin, serializers.ModelSerializer):
         fields = ('node', 'note', 'outcome', 'stats')
 
     def create(self, validated_data):
-        war = self.context['war']
+        # Aggregates affected by the edits are updated once at the end
+        with AggregateBatch():
+            return self.apply_update(self.context['war'], validated_data)
 
+    def apply_update(self, war, validated_data):
         # Update War
         war.outcome = validated_data.pop('outcome')
         war.node = validated_data.pop('node')
@@ -390,6 +409,37 @@ class WarSubmitSerializer(BaseSerializerMixin, serializers.Serializer):
     outcome = serializers.ChoiceField(choices=list(War.Outcome.choices()))
     stats = NestedWarStatSerializer(many=True)
 
+    def get_member_increments(self, war, war_stats):
+        """
+        Stat and attendance values the war adds to each member's totals.
+        """
+        increments = {}
+        final_attendance = (war.attendance_set.filter(user_profile__isnull=False)
+                                              .values_list('user_profile_id', 'is_attending'))
+
+        for profile_id, is_attending in final_attendance:
+            increments[profile_id] = get_attendance_increments(is_attending)
+
+            if profile_id in war_stats:
+                war_stat = war_stats[profile_id]
+                increments[profile_id].update({field: getattr(war_stat, field) for field in WarStat.STAT_FIELDS})
+
+        return increments
+
+    def update_aggregates(self, war, war_stats, guild_totals, increments):
+        if guild_totals:
+            AggregatedGuildWarStats.increment(guild_totals, guild=war.guild)
+
+        increment_aggregates(AggregatedGuildMemberWarStats, increments, guild_id=war.guild_id)
+        increment_aggregates(AggregatedUserWarStats, increments)
+
+        for model in ROLLUP_MODELS:
+            bucket = model.get_bucket(war.date)
+            increment_rollups(model, {
+                (war.guild_id, profile_id, bucket): {field: getattr(war_stat, field) for field in WarStat.STAT_FIELDS}
+                for profile_id, war_stat in war_stats.items()
+            })
+
     def create(self, validated_data):
         war = self.context['war']
         war_stats = {}
@@ -441,42 +491,27 @@ class WarSubmitSerializer(BaseSerializerMixin, serializers.Serializer):
             (WarAttendance.objects.filter(id__in=no_sign_ups.values())
                                   .update(is_attending=WarAttendance.AttendanceStatus.LATE.value))
 
-        # Update aggregated stats
-        AggregatedGuildWarStats.update(war.guild, guild_totals)
+        increments = self.get_member_increments(war, war_stats)
 
-        # Refresh aggregated stats
-        def get_attending(profile_id):
-            if profile_id in war_stats:
-                return 0
-            elif profile_id in no_shows:
-                return 3
-            else:
-                return 1
-
-        # Update member stats
-        old_member_stats = AggregatedGuildMemberWarStats.objects.filter(guild=war.guild,
-                                                                        user_profile__in=war.attendees.all())
-        new_member_stats = [
-            old_stat.clone_and_increment(war_stat=war_stats.get(old_stat.user_profile_id, None),
-                                         is_attending=get_attending(old_stat.user_profile_id))
-            for old_stat in old_member_stats
-            ]
-        old_member_stats.delete()
-        AggregatedGuildMemberWarStats.objects.bulk_create(new_member_stats)
-
-        # Update user stats
-        old_user_stats = AggregatedUserWarStats.objects.filter(user_profile__in=war.attendees.all())
-        new_user_stats = [
-            old_stat.clone_and_increment(war_stat=war_stats.get(old_stat.user_profile_id, None),
-                                         is_attending=get_attending(old_stat.user_profile_id))
-            for old_stat in old_user_stats
-            ]
-        old_user_stats.delete()
-        AggregatedUserWarStats.objects.bulk_create(new_user_stats)
+        # Update aggregated stats in place
+        if not triggers_enabled():
+            self.update_aggregates(war, war_stats, guild_totals, increments)
+
+        record_ledger_entries([
+            get_ledger_entry(war.guild_id, profile_id, increment, war_id=war.id)
+            for profile_id, increment in increments.items()
+        ])
 
         war.outcome = validated_data['outcome']
         war.save()
 
+        if not triggers_enabled():
+            # The window only counts finished wars
+            refresh_recent_wars(list(increments.keys()))
+
+        # The renege rates on the attendees' other rosters changed
+        War.bump_profile_versions(increments.keys())
+
         war_finish.send(War, instance=war)
 
         return war
@@ -0,0 +1,63 @@
+from django.contrib.auth import get_user_model
+from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED
+from rest_framework.test import APITestCase
+
+from bdo.guild_summary import rebuild_guild_summaries
+from bdo.models.character import Character
+from bdo.models.content import CharacterClass
+from bdo.models.guild import GuildMember, GuildSummary
+from bdo.sample_data import create_sample_guild
+from bdo.tests import CONTENT_FIXTURE
+
+
+class MainCharacterSummaryTests(APITestCase):
+    fixtures = [CONTENT_FIXTURE]
+
+    def setUp(self):
+        self.guild = create_sample_guild(3, seed=5)
+        self.profile = GuildMember.objects.filter(guild=self.guild).order_by('id').first().user
+        self.profile.user = get_user_model().objects.create_user(username='member')
+        self.profile.save()
+        self.client.force_authenticate(self.profile.user)
+
+    def get_summary(self):
+        summary = GuildSummary.objects.values('member_count',
+                                              'main_count',
+                                              'level_total',
+                                              'gearscore_total',
+                                              'class_distribution').get(guild=self.guild)
+        # A rebuild drops the classes that went back to zero
+        summary['class_distribution'] = {name: count for name, count in summary['class_distribution'].items() if count}
+        summary['gearscore_total'] = round(summary['gearscore_total'], 6)
+
+        return summary
+
+    def assertMatchesRebuild(self):
+        maintained = self.get_summary()
+        rebuild_guild_summaries([self.guild.id])
+
+        self.assertEqual(maintained, self.get_summary())
+
+    def test_create_main(self):
+        response = self.client.post('/api/users/characters/', {
+            'name': 'New Main',
+            'character_class': CharacterClass.objects.order_by('id').last().id,
+            'level': 61,
+            'ap': 250,
+            'aap': 260,
+            'dp': 310,
+            'is_main': True,
+        }, format='json')
+
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertEqual(Character.objects.filter(profile=self.profile, is_main=True).count(), 1)
+        self.assertMatchesRebuild()
+
+    def test_switch_main(self):
+        alt = Character.objects.get(profile=self.profile, is_main=False)
+
+        response = self.client.patch('/api/users/characters/{0}/'.format(alt.id), {'is_main': True}, format='json')
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(list(Character.objects.filter(profile=self.profile, is_main=True)), [alt])
+        self.assertMatchesRebuild()
@@ -0,0 +1,65 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.status import HTTP_200_OK
+from rest_framework.test import APITestCase
+
+from bdo.models.character import Profile
+from bdo.models.guild import Guild, GuildMember, GuildRole, GuildSummary
+from bdo.models.region import Region
+from bdo.models.war import War
+from bdo.sample_data import get_sample_name
+from bdo.tests import CONTENT_FIXTURE
+
+
+class GuildListTests(APITestCase):
+    fixtures = [CONTENT_FIXTURE]
+
+    def setUp(self):
+        self.region = Region.objects.order_by('id').first()
+        self.profile = Profile.objects.create(family_name='Viewer',
+                                              region=self.region,
+                                              user=get_user_model().objects.create_user(username='viewer'))
+        self.client.force_authenticate(self.profile.user)
+
+    def add_guilds(self, count):
+        """
+        Guilds with a guild master, a summary and a pending war, the viewer is a member of each.
+        """
+        guilds = Guild.objects.bulk_create([
+            Guild(name=get_sample_name('Guild'), logo_url='https://example.com/logo.png', region=self.region)
+            for _ in range(count)
+        ])
+        guild_masters = Profile.objects.bulk_create([
+            Profile(family_name=get_sample_name('Family'), region=self.region) for _ in guilds
+        ])
+
+        guild_master_role = GuildRole.guild_master()
+        member_role = GuildRole.objects.get(name='Member')
+
+        GuildSummary.objects.bulk_create([GuildSummary(guild=guild, member_count=2) for guild in guilds])
+        GuildMember.objects.bulk_create(
+            [GuildMember(guild=guild, user=profile, role=guild_master_role)
+             for guild, profile in zip(guilds, guild_masters)] +
+            [GuildMember(guild=guild, user=self.profile, role=member_role) for guild in guilds]
+        )
+        War.objects.bulk_create([War(guild=guild, date=War(guild=guild).next_war()) for guild in guilds])
+
+    def count_list_queries(self, page_size):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/guilds/', {'page_size': page_size, 'include': 'stats'})
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), page_size)
+        self.assertTrue(all(guild['pending_war'] for guild in response.data['results']))
+
+        return len(queries)
+
+    def test_query_count_is_independent_of_page_size(self):
+        self.add_guilds(1)
+        single_guild_queries = self.count_list_queries(1)
+
+        self.add_guilds(499)
+
+        with self.assertNumQueries(single_guild_queries):
+            self.count_list_queries(500)
@@ -0,0 +1,54 @@
+from django.contrib.auth import get_user_model
+from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN
+from rest_framework.test import APITestCase
+
+from bdo.models.guild import GuildMember, GuildRole
+from bdo.models.war import WarCallSign
+from bdo.sample_data import create_sample_guild, create_sample_war
+from bdo.tests import CONTENT_FIXTURE
+
+
+class WarCallSignSetMembersTests(APITestCase):
+    fixtures = [CONTENT_FIXTURE]
+
+    def setUp(self):
+        guild = create_sample_guild(5, seed=4)
+        self.war = create_sample_war(guild, attendee_count=4)
+        self.attendee_ids = list(self.war.attendance_set.order_by('id').values_list('id', flat=True))
+        self.call_sign = WarCallSign.objects.create(war=self.war, name='Alpha')
+        self.url = '/api/guilds/{0}/wars/{1}/call-signs/set_members/'.format(guild.id, self.war.id)
+        self.members = GuildMember.objects.filter(guild=guild).select_related('user').order_by('id')
+
+    def login(self, member):
+        member.user.user = get_user_model().objects.create_user(username='member-{0}'.format(member.id))
+        member.user.save()
+        self.client.force_authenticate(member.user.user)
+
+    def set_members(self, members):
+        return self.client.post(self.url, {'members': members}, format='json')
+
+    def test_set_members(self):
+        self.login(self.members.get(role=GuildRole.guild_master()))
+        self.call_sign.members.add(self.attendee_ids[0])
+
+        response = self.set_members({str(self.call_sign.id): self.attendee_ids[1:3]})
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data, {'added': 2, 'removed': 1})
+        self.assertEqual(set(self.call_sign.members.values_list('id', flat=True)), set(self.attendee_ids[1:3]))
+
+    def test_invalid_members(self):
+        self.login(self.members.get(role=GuildRole.guild_master()))
+
+        for members in (['not', 'a', 'mapping'],
+                        {str(self.call_sign.id): [[self.attendee_ids[0]]]},
+                        {str(self.call_sign.id + 1): []}):
+            self.assertEqual(self.set_members(members).status_code, HTTP_400_BAD_REQUEST)
+
+    def test_requires_manage_call_sign(self):
+        self.login(self.members.exclude(role=GuildRole.guild_master()).first())
+
+        response = self.set_members({str(self.call_sign.id): self.attendee_ids[:1]})
+
+        self.assertEqual(response.status_code, HTTP_403_FORBIDDEN)
+        self.assertFalse(self.call_sign.members.exists())
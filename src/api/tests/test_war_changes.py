@@ -0,0 +1,67 @@
+from django.contrib.auth import get_user_model
+from django.test import override_settings
+from rest_framework.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
+from rest_framework.test import APITestCase
+
+from bdo.models.guild import GuildMember, GuildRole
+from bdo.roster_events import broker
+from bdo.sample_data import create_sample_guild, create_sample_war
+from bdo.tests import CONTENT_FIXTURE
+
+
+@override_settings(ROSTER_CHANGES=True)
+class WarChangesTests(APITestCase):
+    fixtures = [CONTENT_FIXTURE]
+
+    def setUp(self):
+        guild = create_sample_guild(3, seed=6)
+        self.war = create_sample_war(guild, attendee_count=2)
+        self.url = '/api/guilds/{0}/wars/{1}/changes/'.format(guild.id, self.war.id)
+        self.roster_url = '/api/guilds/{0}/wars/{1}/roster/'.format(guild.id, self.war.id)
+
+        profile = GuildMember.objects.select_related('user').get(guild=guild, role=GuildRole.guild_master()).user
+        profile.user = get_user_model().objects.create_user(username='guild-master')
+        profile.save()
+        self.client.force_authenticate(profile.user)
+
+    def test_invalid_timeout(self):
+        for timeout in ('soon', 'nan', 'inf', '-inf'):
+            response = self.client.get(self.url, {'timeout': timeout})
+
+            self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST, timeout)
+            self.assertIn('timeout', response.data)
+
+    def test_negative_timeout(self):
+        # Clamped to 0, answers at once
+        response = self.client.get(self.url, {'timeout': '-5', 'cursor': 'unknown:0'})
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertTrue(response.data['reset'])
+
+    def test_events_after_roster_cursor(self):
+        cursor = self.client.get(self.roster_url).data['cursor']
+        # Published directly, test transactions never commit
+        broker.publish(self.war.id, [{'type': 'attendance', 'id': 1}])
+
+        response = self.client.get(self.url, {'cursor': cursor, 'timeout': 0})
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertFalse(response.data['reset'])
+        self.assertEqual([event['id'] for event in response.data['events']], [1])
+        self.assertEqual(response.data['cursor'], broker.get_cursor(self.war.id))
+
+    def test_roster_etag_follows_cursor(self):
+        etag = self.client.get(self.roster_url)['ETag']
+        broker.publish(self.war.id, [{'type': 'attendance', 'id': 1}])
+
+        response = self.client.get(self.roster_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data['cursor'], broker.get_cursor(self.war.id))
+        self.assertEqual(self.client.get(self.roster_url, HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                         HTTP_304_NOT_MODIFIED)
+
+    @override_settings(ROSTER_CHANGES=False)
+    def test_disabled(self):
+        self.assertEqual(self.client.get(self.url, {'timeout': 0}).status_code, HTTP_404_NOT_FOUND)
+        self.assertNotIn('cursor', self.client.get(self.roster_url).data)
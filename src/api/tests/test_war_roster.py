@@ -0,0 +1,101 @@
+from django.contrib.auth import get_user_model
+from rest_framework.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED
+from rest_framework.test import APITestCase
+
+from bdo.models.character import Character
+from bdo.models.guild import GuildMember, GuildRole
+from bdo.models.war import War, WarAttendance
+from bdo.sample_data import create_sample_guild, create_sample_war
+from bdo.tests import CONTENT_FIXTURE
+
+
+class WarRosterETagTests(APITestCase):
+    fixtures = [CONTENT_FIXTURE]
+
+    def setUp(self):
+        guild = create_sample_guild(5, seed=3)
+        self.war = create_sample_war(guild, attendee_count=3)
+        self.attendance = self.war.attendance_set.order_by('id').first()
+        self.url = '/api/guilds/{0}/wars/{1}/roster/'.format(guild.id, self.war.id)
+
+        profile = GuildMember.objects.select_related('user').get(guild=guild, role=GuildRole.guild_master()).user
+        profile.user = get_user_model().objects.create_user(username='guild-master')
+        profile.save()
+        self.client.force_authenticate(profile.user)
+
+    def get_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+        return response['ETag']
+
+    def assertETagChanged(self, etag):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_not_modified(self):
+        etag = self.get_etag()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_roster_change_bumps_version(self):
+        etag = self.get_etag()
+        self.war.refresh_from_db()
+        version = self.war.version
+
+        self.attendance.is_attending = WarAttendance.AttendanceStatus.NOT_ATTENDING.value
+        self.attendance.save()
+
+        self.war.refresh_from_db()
+        self.assertEqual(self.war.version, version + 1)
+        self.assertETagChanged(etag)
+
+    def test_main_character_change(self):
+        etag = self.get_etag()
+        main = Character.objects.get(profile_id=self.attendance.user_profile_id, is_main=True)
+
+        main.level += 1
+        main.save()
+
+        self.assertETagChanged(etag)
+
+    def test_family_name_change(self):
+        etag = self.get_etag()
+        profile = self.attendance.user_profile
+
+        profile.family_name = 'Renamed'
+        profile.save()
+
+        self.assertETagChanged(etag)
+
+    def test_preferred_roles_change(self):
+        etag = self.get_etag()
+
+        self.attendance.user_profile.preferred_roles.clear()
+
+        self.assertETagChanged(etag)
+
+    def test_renege_rate_change(self):
+        finished = create_sample_war(self.war.guild, attendee_count=3)
+        War.objects.filter(id=finished.id).update(outcome=War.Outcome.WIN.value)
+        etag = self.get_etag()
+
+        attendance = finished.attendance_set.get(user_profile_id=self.attendance.user_profile_id)
+        attendance.is_attending = WarAttendance.AttendanceStatus.RENEGED.value
+        attendance.save()
+
+        self.assertETagChanged(etag)
+
+    def test_finished_wars_keep_version(self):
+        War.objects.filter(id=self.war.id).update(outcome=War.Outcome.WIN.value)
+        self.war.refresh_from_db()
+        version = self.war.version
+
+        War.bump_profile_versions([self.attendance.user_profile_id])
+
+        self.war.refresh_from_db()
+        self.assertEqual(self.war.version, version)
@@ -1,4 +1,5 @@
 from django.conf.urls import url
+from django.db import transaction
 
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested import routers
@@ -60,5 +61,10 @@ war_router.register(r'teams', WarTeamViewSet, base_name='war-team')
 war_router.register(r'call-signs', WarCallSignViewSet, base_name='war-call-sign')
 war_router.register(r'stats', WarStatViewSet, base_name='war-stat')
 
-urlpatterns = router.urls + guild_router.urls + profile_router.urls + war_router.urls
+# Long polls run outside of ATOMIC_REQUESTS, ahead of the route generated for the action
+urlpatterns = [
+    url(r'^guilds/(?P<guild_pk>[^/.]+)/wars/(?P<pk>[^/.]+)/changes/$',
+        transaction.non_atomic_requests(WarViewSet.as_view({'get': 'changes'}))),
+]
+urlpatterns += router.urls + guild_router.urls + profile_router.urls + war_router.urls
 urlpatterns += (url(r'^users/me/$', CurrentUserViewSet.as_view(), name='current-user'),)
@@ -1,4 +1,6 @@
-from django.db.models import Case, F, FloatField, Prefetch, Q, Sum, Value, When
+from collections import OrderedDict
+
+from django.db.models import Case, Prefetch, Q, Sum, Value, When, prefetch_related_objects
 from django.db.models.fields import IntegerField
 from django.db.models.functions import Coalesce
 from rest_framework import filters
@@ -15,13 +17,14 @@ from api.serializers.guild import (ExtendedGuildSerializer,
                                    GuildMemberSerializer,
                                    SimpleGuildRoleSerializer)
 from api.serializers.guild_content import WarRoleSerializer
+from api.serializers.stat import AggregatedGuildMemberWarStatsSerializer
 from api.views.mixin import CSVExportMixin, ModelViewSet, ReadOnlyModelViewSet
 from bdo.models.activity import Activity
-from bdo.models.character import Character
 from bdo.models.content import WarNode
 from bdo.models.guild import Guild, GuildMember, GuildRole
 from bdo.models.war import WarAttendance, WarRole
-from bdo.models.stats import AggregatedGuildMemberWarStats
+from bdo.models.stats import AggregatedGuildMemberWarStats, get_stat_window
+from bdo.utils import get_top_prefetch
 
 
 class GuildViewMixin(GenericAPIView):
@@ -39,9 +42,13 @@ class GuildViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated, GuildPermission)
     include_params = ['stats', 'integrations']
 
+    def get_queryset(self):
+        return super(GuildViewSet, self).get_queryset().select_related('summary')
+
     def list(self, request, *args, **kwargs):
         # Use simple serializer to limit information returned
-        queryset = self.filter_queryset(self.get_queryset())
+        queryset = Guild.annotate_list(self.filter_queryset(self.get_queryset()),
+                                       profile=getattr(request.user, 'profile', None))
 
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -105,23 +112,24 @@ class GuildMemberViewSet(ReadOnlyModelViewSet, GuildViewMixin, CSVExportMixin):
     include_params = ['stats', 'attendance', 'main_character']
     CSV_FILE_NAME = 'members.csv'
 
+    def get_serializer_context(self):
+        context = super(GuildMemberViewSet, self).get_serializer_context()
+        # Rollup model and first bucket of the requested stat window
+        context['window'] = get_stat_window(context['request'].query_params.get('window'))
+
+        return context
+
     def get_queryset(self):
         qs = super(GuildMemberViewSet, self).get_queryset()
-        character_qs = Character.objects.select_related('character_class')
-        qs = qs.prefetch_related(Prefetch('user__character_set', character_qs))
         qs = qs.select_related('user__user')
 
         guild_id = self.kwargs['guild_pk']
-        includes = self.get_serializer_context()['include']
-        ordering = self.request.query_params.get(MemberOrderingFilter.ordering_param)
+        context = self.get_serializer_context()
+        includes = context['include']
 
         if 'attendance' in includes:
-            attendance_qs = (WarAttendance.objects.filter(war__guild_id=guild_id, war__outcome__isnull=False)
-                                                  .order_by('-war__date')
-                                                  .select_related('war'))
-            attendance_prefetch = Prefetch('user__attendance_set', attendance_qs, '_prefetched_attendance')
+            # The attendance itself is prefetched for the page, see prefetch_attendance
             qs = qs.select_related('guild', 'role')
-            qs = qs.prefetch_related(attendance_prefetch)
         if 'role' in self.request.query_params.get('expand', []):
             qs = qs.select_related('role')
         if 'user' in self.request.query_params.get('expand', []):
@@ -131,23 +139,83 @@ class GuildMemberViewSet(ReadOnlyModelViewSet, GuildViewMixin, CSVExportMixin):
                                       AggregatedGuildMemberWarStats.objects.filter(guild=guild_id),
                                       'member_stats')
             qs = qs.prefetch_related(stats_prefetch)
-        if 'stats' in includes or ordering and 'attendance_rate' in ordering:
-            attended = F('user__aggregatedmemberstats__wars_attended')
-            unavailable = F('user__aggregatedmemberstats__wars_unavailable')
-            missed = F('user__aggregatedmemberstats__wars_missed')
-            attendance_rate_expr = Case(
-                When(user__aggregatedmemberstats__wars_attended=0,
-                     user__aggregatedmemberstats__wars_unavailable=0,
-                     user__aggregatedmemberstats__wars_missed=0,
-                     then=0.0),
-                default=((attended + unavailable * 0.5) / (attended + unavailable + missed)),
-                output_field=FloatField()
-            )
-            qs = (qs.filter(user__aggregatedmemberstats__guild_id=guild_id)
-                    .annotate(_prefetched_attendance_rate=attendance_rate_expr))
+            qs = qs.filter(user__aggregatedmemberstats__guild_id=guild_id)
+        if 'stats' in includes and context['window'] is not None:
+            window_model, window_start = context['window']
+            window_prefetch = Prefetch('user__{0}'.format(window_model._meta.get_field('user_profile')
+                                                                            .related_query_name()),
+                                       window_model.objects.filter(guild=guild_id, bucket__gte=window_start),
+                                       '_prefetched_window_stats')
+            qs = qs.prefetch_related(window_prefetch)
 
         return qs
 
+    def prefetch_attendance(self, members):
+        """
+        Prefetch the recent attendance of the members, only their attendance is ranked.
+        """
+        if 'attendance' not in self.get_serializer_context()['include']:
+            return members
+
+        attendance_qs = (WarAttendance.objects.filter(war__guild_id=self.kwargs['guild_pk'], war__outcome__isnull=False)
+                                              .select_related('war'))
+        prefetch_related_objects(members, get_top_prefetch('user__attendance_set',
+                                                           attendance_qs,
+                                                           partition_by='user_profile',
+                                                           order_by=('-war__date',),
+                                                           limit=GuildMember.RECENT_ATTENDANCE,
+                                                           to_attr='_prefetched_attendance',
+                                                           partition_values={member.user_id for member in members}))
+
+        return members
+
+    def paginate_queryset(self, queryset):
+        page = super(GuildMemberViewSet, self).paginate_queryset(queryset)
+
+        return page if page is None else self.prefetch_attendance(page)
+
+    def get_object(self):
+        return self.prefetch_attendance([super(GuildMemberViewSet, self).get_object()])[0]
+
+    def get_export_rows(self, queryset):
+        """
+        Project the exported columns from values() instead of serializing every member.
+        """
+        includes = self.get_serializer_context()['include']
+        fields = ['role__name', 'user__family_name', 'user__main_character_id', 'user__main_name',
+                  'user__user__first_name']
+        stat_fields = ['attendance_rate'] + AggregatedGuildMemberWarStatsSerializer.Meta.fields
+
+        if 'main_character' in includes:
+            fields += ['user__main_level', 'user__main_class_name', 'user__main_gearscore']
+        if 'stats' in includes:
+            # Joins the guild's stats filtered in get_queryset
+            fields += ['user__aggregatedmemberstats__{0}'.format(field) for field in stat_fields]
+
+        for member in queryset.prefetch_related(None).values(*fields).iterator():
+            row = OrderedDict()
+            row['role'] = member['role__name']
+            row['family_name'] = member['user__family_name']
+
+            # Same as str(Profile)
+            if member['user__main_character_id'] is None:
+                row['name'] = member['user__family_name']
+            else:
+                row['name'] = u'{0} ({1})'.format(member['user__family_name'], member['user__main_name'])
+
+            row['discord_username'] = member['user__user__first_name']
+
+            if 'main_character' in includes:
+                row['level'] = member['user__main_level']
+                row['class'] = member['user__main_class_name']
+                row['gearscore'] = member['user__main_gearscore']
+            if 'stats' in includes:
+                for field in stat_fields:
+                    value = member['user__aggregatedmemberstats__{0}'.format(field)]
+                    row[field] = round(value, 2) if field in ('attendance_rate', 'kdr') else value
+
+            yield row
+
     @list_route(methods=['get'], permission_classes=[IsAuthenticated, GuildMemberExportPermission])
     def export(self, request, **kwargs):
         """
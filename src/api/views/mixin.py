@@ -1,7 +1,12 @@
 import csv
+import json
+import os
+from enum import Enum
 
+from django.core.serializers.json import DjangoJSONEncoder
 from django.http import StreamingHttpResponse
 from rest_framework.decorators import list_route
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.viewsets import (ModelViewSet as DRFModelViewSet,
                                      ReadOnlyModelViewSet as DRFReadOnlyModelViewSet)
@@ -68,9 +73,15 @@ class ReadOnlyModelViewSet(FilterMixin, UserContextMixin, DRFReadOnlyModelViewSe
 
 class CSVExportMixin(object):
     """
-    Add an export endpoint that returns the data in a CSV format.
+    Add an export endpoint that streams the data in a CSV or JSON Lines format.
+
+    The format is picked with the file_format query param.
     """
     CSV_FILE_NAME = 'export.csv'
+    EXPORT_FORMATS = ('csv', 'jsonl')
+
+    class ExportMessages(Enum):
+        INVALID_FILE_FORMAT = u"file_format must be one of csv, jsonl."
 
     class Echo:
         """An object that implements just the write method of the file-like
@@ -81,47 +92,55 @@ class CSVExportMixin(object):
             """Write the value by returning it, instead of storing in a buffer."""
             return value
 
-    def generate_csv(self, objects):
-        """
-        Return an iterator for csv file.
+    def get_export_rows(self, queryset):
         """
-        buffer = self.Echo()
-        writer = csv.writer(buffer)
-        found_header = False
-        rows = []
-
-        if not objects:
-            return ''
+        Iterator of the exported rows as ordered dicts, every row has the same keys.
 
-        for obj in objects:
-            serializer = self.get_serializer(obj)
+        Defaults to the serialized objects, override to project the rows with values().
+        """
+        # iterator() reads the rows in chunks through a server side cursor
+        for obj in queryset.iterator():
+            yield self.get_serializer(obj).data
 
-            if hasattr(serializer, 'for_csv'):
-                data = serializer.for_csv()
-            else:
-                # Try to serializer the data automatically
-                data = serializer.data
+    def generate_csv(self, rows):
+        """
+        Return an iterator for csv file.
+        """
+        writer = csv.writer(self.Echo())
+        header = None
 
-            if not found_header:
-                rows.append(list(data.keys()))
-                found_header = True
+        for row in rows:
+            if header is None:
+                header = list(row.keys())
+                yield writer.writerow(header)
 
-            rows.append([str(value) for value in data.values()])
+            yield writer.writerow([row.get(field) for field in header])
 
-        return (writer.writerow(row) for row in rows)
+    def generate_json_lines(self, rows):
+        """
+        Return an iterator for a JSON Lines file, one object per row.
+        """
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
 
     @list_route(methods=['get'], permission_classes=[IsAuthenticated])
     def export(self, request, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
+        file_format = request.query_params.get('file_format', 'csv')
+
+        if file_format not in self.EXPORT_FORMATS:
+            raise ValidationError({'file_format': self.ExportMessages.INVALID_FILE_FORMAT.value})
 
-        page = self.paginate_queryset(queryset)
+        rows = self.get_export_rows(self.filter_queryset(self.get_queryset()))
 
-        if page is not None:
-            objects = page
+        if file_format == 'jsonl':
+            content = self.generate_json_lines(rows)
+            content_type = "application/x-ndjson"
         else:
-            objects = queryset
+            content = self.generate_csv(rows)
+            content_type = "text/csv"
 
-        response = StreamingHttpResponse(self.generate_csv(objects), content_type="text/csv")
-        response['Content-Disposition'] = 'attachment; filename={0}'.format(self.CSV_FILE_NAME)
+        file_name = '{0}.{1}'.format(os.path.splitext(self.CSV_FILE_NAME)[0], file_format)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename={0}'.format(file_name)
 
         return response
@@ -1,15 +1,22 @@
+import hashlib
+import math
 from collections import defaultdict
 from datetime import datetime
 from enum import Enum
 
+from django.db import connection
 from django.db.models import Prefetch
+from django.db.transaction import atomic
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
 from django_filters import rest_framework as filters
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
-from rest_framework.status import HTTP_201_CREATED, HTTP_204_NO_CONTENT
+from rest_framework.status import HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_304_NOT_MODIFIED
 
 from api.filters import CaseInsensitiveOrderingFilter
 from api.permissions import (RestrictedUserPermission,
@@ -18,7 +25,8 @@ from api.permissions import (RestrictedUserPermission,
                              WarCallSignPermission,
                              WarPermission,
                              WarTeamPermission)
-from api.serializers.war import (PlayerStatSerializer,
+from api.serializers.war import (MyWarAttendanceSerializer,
+                                 PlayerStatSerializer,
                                  PlayerWarSerializer,
                                  WarSerializer,
                                  WarAttendanceSerializer,
@@ -32,6 +40,44 @@ from api.views.guild import GuildViewMixin
 from api.views.mixin import ModelViewSet, ReadOnlyModelViewSet
 from bdo.models.character import Character
 from bdo.models.war import War, WarAttendance, WarCallSign, WarStat, WarTeam, WarTeamSlot, WarTemplate
+from bdo.roster_events import broker, call_sign_event, changes_enabled, publish_roster_events, slot_event
+from bdo.team_composer import compose_teams
+
+
+def get_roster_etag(request, war_id, cursor=None):
+    """
+    Strong ETag of the war's roster version, the change cursor and the request's query params, None if the war
+    doesn't exist.
+
+    Profile and character changes bump the version of the attendees' unfinished wars, see War.bump_profile_versions.
+    Aggregate rebuilds and repairs don't, their renege rates show once the roster changes again.
+    """
+    version = War.objects.filter(id=war_id).values_list('version', flat=True).first()
+
+    if version is None:
+        return None
+
+    key = u"{0}:{1}:{2}:{3}".format(war_id, version, cursor or '', request.get_full_path())
+
+    return '"{0}"'.format(hashlib.md5(key.encode('utf-8')).hexdigest())
+
+
+def is_id(value):
+    # bool is a subclass of int
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_not_modified(request, etag):
+    if etag is None:
+        return False
+
+    etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+
+    return etag in etags or '*' in etags
+
+
+# Longest a changes poll is held open, in seconds
+CHANGES_TIMEOUT = 25
 
 
 class WarViewSet(ModelViewSet, GuildViewMixin):
@@ -46,8 +92,16 @@ class WarViewSet(ModelViewSet, GuildViewMixin):
     ordering = ('-date',)
     include_params = ['stats']
 
+    class Messages(Enum):
+        INVALID_TIMEOUT = u"timeout must be a finite number."
+
     def get_queryset(self):
-        return super(WarViewSet, self).get_queryset().select_related('node')
+        qs = super(WarViewSet, self).get_queryset().select_related('node')
+
+        if 'stats' in self.get_serializer_context()['include']:
+            qs = War.annotate_stats(qs)
+
+        return qs
 
     def get_serializer_context(self):
         context = super(WarViewSet, self).get_serializer_context()
@@ -55,6 +109,60 @@ class WarViewSet(ModelViewSet, GuildViewMixin):
 
         return context
 
+    @detail_route(methods=['get'])
+    def roster(self, request, *args, **kwargs):
+        instance = self.get_object()
+        # Read before the roster, so changes made meanwhile are streamed again
+        cursor = broker.get_cursor(instance.id) if changes_enabled() else None
+        # A 304 keeps the client's cursor, so it must be from this broker
+        etag = get_roster_etag(request, instance.id, cursor)
+
+        if is_not_modified(request, etag):
+            return Response(status=HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        roster = instance.get_roster()
+
+        if cursor is not None:
+            roster['cursor'] = cursor
+
+        return Response(roster, headers={'ETag': etag})
+
+    @detail_route(methods=['get'])
+    def changes(self, request, *args, **kwargs):
+        """
+        Long-poll the roster change events after the ``cursor`` returned by roster or the previous poll.
+
+        A reset response means events were missed and the roster has to be re-fetched, polling on from its cursor.
+        Routed without ATOMIC_REQUESTS in api.urls, so no transaction or connection is held while waiting.
+        Not found unless ROSTER_CHANGES is set, see bdo.roster_events.
+        """
+        if not changes_enabled():
+            raise Http404
+
+        instance = self.get_object()
+
+        try:
+            timeout = float(request.query_params.get('timeout', CHANGES_TIMEOUT))
+        except ValueError:
+            timeout = None
+
+        # nan and inf parse, but would block forever
+        if timeout is None or not math.isfinite(timeout):
+            raise ValidationError({'timeout': self.Messages.INVALID_TIMEOUT.value})
+
+        timeout = max(0, min(timeout, CHANGES_TIMEOUT))
+
+        if not connection.in_atomic_block:
+            # Reopened on the next query
+            connection.close()
+
+        latest, events = broker.wait(instance.id, request.query_params.get('cursor'), timeout)
+
+        if events is None:
+            return Response({'cursor': latest, 'reset': True, 'events': []})
+
+        return Response({'cursor': latest, 'reset': False, 'events': events})
+
     @detail_route(methods=['post'], permission_classes=[IsAuthenticated])
     def finish(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -82,6 +190,20 @@ class NestedWarViewSet(ModelViewSet):
     def get_queryset(self):
         return super(NestedWarViewSet, self).get_queryset().filter(war=self.kwargs['war_pk'])
 
+    def list(self, request, *args, **kwargs):
+        # Unchanged rosters are answered from the war's version alone
+        etag = get_roster_etag(request, self.kwargs['war_pk'])
+
+        if is_not_modified(request, etag):
+            return Response(status=HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        response = super(NestedWarViewSet, self).list(request, *args, **kwargs)
+
+        if etag is not None:
+            response['ETag'] = etag
+
+        return response
+
 
 class WarAttendanceViewSet(NestedWarViewSet):
     queryset = WarAttendance.objects.all()
@@ -89,14 +211,12 @@ class WarAttendanceViewSet(NestedWarViewSet):
     permission_classes = (IsAuthenticated, WarAttendancePermission)
 
     def get_queryset(self):
-        attendance_qs = WarAttendance.objects.filter(is_attending__in=[0, 4, 5]).order_by('-war__date')
         qs = super(WarAttendanceViewSet, self).get_queryset().order_by('user_profile__family_name')
         qs = (qs.select_related('user_profile', 'character')
                 .prefetch_related(
                     Prefetch('user_profile__character_set', Character.objects.select_related('character_class')),
                     'user_profile__preferred_roles',
                     'user_profile__user_stats',
-                    Prefetch('user_profile__attendance_set', attendance_qs, '_prefetched_recent_wars'),
                     'warcallsign_set',
                     'slot__team'
                 )
@@ -113,10 +233,10 @@ class WarAttendanceViewSet(NestedWarViewSet):
 
     @list_route(methods=['get', 'post'], permission_classes=[IsAuthenticated])
     def me(self, request, **kwargs):
-        try:
-            instance = self.get_queryset().get(user_profile_id=request.user.profile.id)
-        except WarAttendance.DoesNotExist:
-            instance = None
+        # Only the caller's row, without the roster prefetches of get_queryset
+        instance = (WarAttendance.objects.select_related('war', 'user_profile', 'character')
+                                         .filter(war=self.kwargs['war_pk'], user_profile_id=request.user.profile.id)
+                                         .first())
 
         if instance is None and request.method == 'GET':
             return Response({})
@@ -135,7 +255,7 @@ class WarAttendanceViewSet(NestedWarViewSet):
                 'partial': True
             }
 
-        serializer = self.get_serializer(instance, **serializer_kwargs)
+        serializer = MyWarAttendanceSerializer(instance, context=self.get_serializer_context(), **serializer_kwargs)
 
         if request.method == 'POST':
             serializer.is_valid(raise_exception=True)
@@ -162,6 +282,10 @@ class WarTeamViewSet(NestedWarViewSet):
         MISSING_FIELD = u"This field is required."
         INVALID_SLOT = u"Invalid slot."
         INVALID_ATTENDEE = u"Invalid attendee_id"
+        INVALID_TEAM = u"Invalid team_id"
+        DUPLICATE_SLOT = u"Slot is assigned more than once."
+        DUPLICATE_ATTENDEE = u"Attendee is assigned more than once."
+        NOT_A_LIST = u"Expected a list of slot assignments."
 
     def get_queryset(self):
         prefetch_members = Prefetch('members', WarAttendance.objects.select_related('slot'))
@@ -203,6 +327,89 @@ class WarTeamViewSet(NestedWarViewSet):
 
         return Response(status=HTTP_204_NO_CONTENT)
 
+    @list_route(methods=['get'])
+    def compose(self, request, *args, **kwargs):
+        """
+        Proposed assignments of the unassigned attending members to the empty slots, in the set_slots format.
+        """
+        war = get_object_or_404(War, id=self.kwargs['war_pk'], guild=self.kwargs['guild_pk'])
+
+        return Response({'slots': compose_teams(war)})
+
+    @list_route(methods=['post'])
+    def set_slots(self, request, *args, **kwargs):
+        """
+        Apply a list of {team_id, slot, attendee_id} assignments atomically, a null attendee_id clears the slot.
+        """
+        data = request.data.get('slots')
+
+        if not isinstance(data, list):
+            raise ValidationError({'slots': self.Messages.NOT_A_LIST.value})
+
+        war_pk = self.kwargs['war_pk']
+        teams = WarTeam.objects.filter(war=war_pk, war__guild=self.kwargs['guild_pk']).in_bulk()
+        attendee_ids = [item.get('attendee_id') for item in data if isinstance(item, dict)]
+        valid_attendee_ids = set(WarAttendance.objects.filter(war=war_pk, id__in=set(filter(is_id, attendee_ids)))
+                                                      .values_list('id', flat=True))
+        seen_slots = set()
+        seen_attendees = set()
+        assignments = []
+        errors = []
+
+        for item in data:
+            item_errors = defaultdict(list)
+
+            if not isinstance(item, dict):
+                item = {}
+
+            for field in ['team_id', 'slot', 'attendee_id']:
+                if field not in item:
+                    item_errors[field].append(self.Messages.MISSING_FIELD.value)
+
+            if not item_errors:
+                # Ids are checked before they are used as keys, a list or a dict isn't hashable
+                team = teams.get(item['team_id']) if is_id(item['team_id']) else None
+                slot = item['slot']
+                attendee_id = item['attendee_id']
+
+                if team is None:
+                    item_errors['team_id'].append(self.Messages.INVALID_TEAM.value)
+                elif not is_id(slot) or slot < 1 or slot > team.max_slots:
+                    item_errors['slot'].append(self.Messages.INVALID_SLOT.value)
+                elif (team.id, slot) in seen_slots:
+                    item_errors['slot'].append(self.Messages.DUPLICATE_SLOT.value)
+                else:
+                    seen_slots.add((team.id, slot))
+
+                if attendee_id is None:
+                    pass
+                elif not is_id(attendee_id) or attendee_id not in valid_attendee_ids:
+                    item_errors['attendee_id'].append(self.Messages.INVALID_ATTENDEE.value)
+                elif attendee_id in seen_attendees:
+                    item_errors['attendee_id'].append(self.Messages.DUPLICATE_ATTENDEE.value)
+                else:
+                    seen_attendees.add(attendee_id)
+
+                if not item_errors:
+                    assignments.append((team.id, slot, attendee_id))
+
+            errors.append(dict(item_errors))
+
+        if any(errors):
+            raise ValidationError({'slots': errors})
+
+        with atomic():
+            cleared = WarTeamSlot.bulk_assign(assignments)
+            # bulk_assign sends no signals
+            War.bump_version(id=war_pk)
+
+            filled = {(team_id, slot) for team_id, slot, _ in assignments}
+            events = [slot_event(team_id, slot, None) for team_id, slot in cleared if (team_id, slot) not in filled]
+            events += [slot_event(*assignment) for assignment in assignments]
+            publish_roster_events(int(war_pk), events)
+
+        return Response(status=HTTP_204_NO_CONTENT)
+
 
 class WarCallSignViewSet(NestedWarViewSet):
     queryset = WarCallSign.objects.all()
@@ -213,6 +420,8 @@ class WarCallSignViewSet(NestedWarViewSet):
         MISSING_FIELD = u"This field is required."
         INVALID_SLOT = u"Invalid slot."
         INVALID_ATTENDEE = u"Invalid attendee_id"
+        INVALID_CALL_SIGN = u"Invalid call sign id"
+        NOT_A_MAPPING = u"Expected a mapping of call sign ids to lists of attendee ids."
 
     def get_queryset(self):
         return super(WarCallSignViewSet, self).get_queryset().prefetch_related('members')
@@ -256,6 +465,65 @@ class WarCallSignViewSet(NestedWarViewSet):
 
         return Response(status=HTTP_204_NO_CONTENT)
 
+    @list_route(methods=['post'])
+    def set_members(self, request, *args, **kwargs):
+        """
+        Replace the members of the call signs in a {call_sign_id: [attendee_ids]} mapping.
+        """
+        data = request.data.get('members')
+
+        if not isinstance(data, dict) or not all(isinstance(ids, list) for ids in data.values()):
+            raise ValidationError({'members': self.Messages.NOT_A_MAPPING.value})
+
+        war_pk = self.kwargs['war_pk']
+        call_sign_ids = set(WarCallSign.objects.filter(war=war_pk, war__guild=self.kwargs['guild_pk'])
+                                               .values_list('id', flat=True))
+        attendee_ids = set(WarAttendance.objects.filter(war=war_pk).values_list('id', flat=True))
+        members = {}
+        errors = defaultdict(list)
+
+        for key, ids in data.items():
+            try:
+                call_sign_id = int(key)
+            except (TypeError, ValueError):
+                call_sign_id = None
+
+            if call_sign_id not in call_sign_ids:
+                errors[key].append(self.Messages.INVALID_CALL_SIGN.value)
+                continue
+
+            invalid_ids = [id for id in ids if not is_id(id) or id not in attendee_ids]
+
+            if invalid_ids:
+                errors[key].append(u"{0}: {1}".format(self.Messages.INVALID_ATTENDEE.value, invalid_ids))
+                continue
+
+            members[call_sign_id] = set(ids)
+
+        if errors:
+            raise ValidationError({'members': errors})
+
+        with atomic():
+            added, removed = WarCallSign.bulk_set_members(members)
+
+            if added or removed:
+                # bulk_set_members sends no signals
+                War.bump_version(id=war_pk)
+
+            changes = defaultdict(lambda: ([], []))
+
+            for call_sign_id, attendee_id in added:
+                changes[call_sign_id][0].append(attendee_id)
+            for call_sign_id, attendee_id in removed:
+                changes[call_sign_id][1].append(attendee_id)
+
+            publish_roster_events(int(war_pk), [
+                call_sign_event(call_sign_id, added=call_sign_added, removed=call_sign_removed)
+                for call_sign_id, (call_sign_added, call_sign_removed) in changes.items()
+            ])
+
+        return Response({'added': len(added), 'removed': len(removed)})
+
 
 class WarStatViewSet(ReadOnlyModelViewSet):
     queryset = WarStat.objects.all()
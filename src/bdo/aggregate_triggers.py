@@ -0,0 +1,296 @@
+"""
+Optional PostgreSQL triggers maintaining the aggregated war stat tables.
+
+Triggers on WarStat, WarAttendance and War apply every change to the guild,
+guild member and user aggregates and to the weekly and monthly rollups in the
+database, so bulk_create and queryset updates keep them consistent as well.
+
+Install them with ``manage.py aggregate-triggers install`` and set
+AGGREGATE_TRIGGERS = True to switch off the Python signal path.
+
+The SQL is generated from the model columns at install time, the triggers
+must be re-installed after migrations changing the aggregate or war tables.
+"""
+from django.db import connections
+
+from bdo.aggregates import (ATTENDANCE_CONDITIONS,
+                            ATTENDANCE_FIELDS,
+                            KEY_FIELDS,
+                            get_attendance_rate_sql,
+                            get_bucket_sql,
+                            get_recent_wars_sql,
+                            get_rollup_upsert_sql)
+from bdo.models.stats import (ROLLUP_MODELS,
+                              AggregatedGuildMemberWarStats,
+                              AggregatedGuildWarStats,
+                              AggregatedUserWarStats)
+from bdo.models.war import War, WarAttendance, WarStat
+
+TRIGGERS = (
+    ('bdo_warstat_aggregates', WarStat, 'AFTER INSERT OR UPDATE OR DELETE'),
+    ('bdo_warattendance_aggregates', WarAttendance, 'AFTER INSERT OR UPDATE OR DELETE'),
+    ('bdo_war_aggregates', War, 'AFTER UPDATE OF outcome'),
+)
+FUNCTIONS = (
+    'bdo_warstat_aggregates()',
+    'bdo_warattendance_aggregates()',
+    'bdo_war_aggregates()',
+    'bdo_add_war_stat({0}, integer)'.format(WarStat._meta.db_table),
+    'bdo_add_attendance(integer, integer, integer, integer)',
+    'bdo_finished_war_guild(integer)',
+    'bdo_ensure_aggregates(integer, integer)',
+)
+KEY_CONDITIONS = {
+    AggregatedGuildWarStats: 'guild_id = v_guild_id',
+    AggregatedGuildMemberWarStats: 'guild_id = v_guild_id AND user_profile_id = v_profile_id',
+    AggregatedUserWarStats: 'user_profile_id = v_profile_id',
+}
+KEY_VALUES = {
+    'guild_id': 'v_guild_id',
+    'user_profile_id': 'v_profile_id',
+}
+
+
+def get_ensure_row_sql(model):
+    """
+    INSERT creating a zeroed aggregate row if it is missing.
+    """
+    keys = KEY_FIELDS[model]
+    columns = [
+        field.column
+        for field in model._meta.concrete_fields
+        if not field.primary_key and field.column not in keys
+    ]
+
+    return (
+        'INSERT INTO {table} ({keys}, {columns}) VALUES ({key_values}, {zeros})'
+        ' ON CONFLICT ({keys}) DO NOTHING;'
+    ).format(table=model._meta.db_table,
+             keys=', '.join(keys),
+             columns=', '.join(columns),
+             key_values=', '.join(KEY_VALUES[key] for key in keys),
+             zeros=', '.join(['0'] * len(columns)))
+
+
+def get_stat_update_sql(model):
+    def new_value(field):
+        return '({0} + p_sign * p_stat.{0})'.format(field)
+
+    total_kills = ' + '.join(new_value(field) for field in model.KILL_FIELDS)
+    updates = ['{0} = {1}'.format(field, new_value(field)) for field in WarStat.STAT_FIELDS]
+    updates += [
+        'total_kills = {0}'.format(total_kills),
+        'kdr = CASE WHEN {death} = 0 THEN 0.0 ELSE ({total_kills}) * 1.0 / {death} END'.format(
+            death=new_value('death'),
+            total_kills=total_kills),
+    ]
+
+    return 'UPDATE {0} SET {1} WHERE {2};'.format(model._meta.db_table,
+                                                  ', '.join(updates),
+                                                  KEY_CONDITIONS[model])
+
+
+def get_rollup_update_sql(model):
+    values = ['v_guild_id', 'v_profile_id', get_bucket_sql(model, 'v_war_date')]
+    values += ['p_sign * p_stat.{0}'.format(field) for field in WarStat.STAT_FIELDS]
+    values.append('p_sign * ({0})'.format(' + '.join('p_stat.{0}'.format(field) for field in model.KILL_FIELDS)))
+
+    return get_rollup_upsert_sql(model, 'VALUES ({0})'.format(', '.join(values))) + ';'
+
+
+def get_attendance_update_sql(model):
+    def new_value(field):
+        return '({0} + p_sign * (CASE WHEN p_is_attending {1} THEN 1 ELSE 0 END))'.format(field,
+                                                                                          ATTENDANCE_CONDITIONS[field])
+
+    updates = ['{0} = {1}'.format(field, new_value(field)) for field in ATTENDANCE_FIELDS]
+    updates.append('attendance_rate = {0}'.format(get_attendance_rate_sql(new_value('wars_attended'),
+                                                                          new_value('wars_unavailable'),
+                                                                          new_value('wars_missed'))))
+
+    return 'UPDATE {0} SET {1} WHERE {2};'.format(model._meta.db_table,
+                                                  ', '.join(updates),
+                                                  KEY_CONDITIONS[model])
+
+
+def get_recent_wars_update_sql():
+    return (
+        'UPDATE {0} SET (recent_wars, recent_reneges) ='
+        ' (SELECT recent.recent_wars, recent.recent_reneges FROM {1} recent)'
+        ' WHERE user_profile_id = v_profile_id;'
+    ).format(AggregatedUserWarStats._meta.db_table, get_recent_wars_sql('v_profile_id'))
+
+
+def get_install_sql():
+    tables = {
+        'war': War._meta.db_table,
+        'attendance': WarAttendance._meta.db_table,
+        'stat': WarStat._meta.db_table,
+    }
+    delta_assignments = '\n'.join(
+        '        delta.{0} := NEW.{0} - OLD.{0};'.format(field)
+        for field in WarStat.STAT_FIELDS
+    )
+    statements = [
+        """
+CREATE OR REPLACE FUNCTION bdo_ensure_aggregates(v_guild_id integer, v_profile_id integer) RETURNS void AS $$
+BEGIN
+    {ensure_guild}
+    IF v_profile_id IS NOT NULL THEN
+        {ensure_member}
+        {ensure_user}
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+""".format(ensure_guild=get_ensure_row_sql(AggregatedGuildWarStats),
+           ensure_member=get_ensure_row_sql(AggregatedGuildMemberWarStats),
+           ensure_user=get_ensure_row_sql(AggregatedUserWarStats)),
+        """
+CREATE OR REPLACE FUNCTION bdo_add_war_stat(p_stat {stat}, p_sign integer) RETURNS void AS $$
+DECLARE
+    v_guild_id integer;
+    v_profile_id integer;
+    v_war_date timestamp with time zone;
+BEGIN
+    SELECT war.guild_id, attendance.user_profile_id, war.date INTO v_guild_id, v_profile_id, v_war_date
+    FROM {attendance} attendance JOIN {war} war ON war.id = attendance.war_id
+    WHERE attendance.id = p_stat.attendance_id;
+
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    PERFORM bdo_ensure_aggregates(v_guild_id, v_profile_id);
+    {update_guild}
+    IF v_profile_id IS NOT NULL THEN
+        {update_member}
+        {update_user}
+        {update_rollups}
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+""".format(update_guild=get_stat_update_sql(AggregatedGuildWarStats),
+           update_member=get_stat_update_sql(AggregatedGuildMemberWarStats),
+           update_user=get_stat_update_sql(AggregatedUserWarStats),
+           update_rollups='\n        '.join(get_rollup_update_sql(model) for model in ROLLUP_MODELS),
+           **tables),
+        """
+CREATE OR REPLACE FUNCTION bdo_finished_war_guild(p_war_id integer) RETURNS integer AS $$
+    -- Attendance only counts once the war is finished
+    SELECT guild_id FROM {war} WHERE id = p_war_id AND outcome IS NOT NULL;
+$$ LANGUAGE sql STABLE;
+""".format(**tables),
+        """
+CREATE OR REPLACE FUNCTION bdo_add_attendance(v_guild_id integer, v_profile_id integer, p_is_attending integer,
+                                              p_sign integer) RETURNS void AS $$
+BEGIN
+    IF v_guild_id IS NULL OR v_profile_id IS NULL THEN
+        RETURN;
+    END IF;
+
+    PERFORM bdo_ensure_aggregates(v_guild_id, v_profile_id);
+    {update_member}
+    {update_user}
+    {update_recent_wars}
+END;
+$$ LANGUAGE plpgsql;
+""".format(update_member=get_attendance_update_sql(AggregatedGuildMemberWarStats),
+           update_user=get_attendance_update_sql(AggregatedUserWarStats),
+           update_recent_wars=get_recent_wars_update_sql()),
+        """
+CREATE OR REPLACE FUNCTION bdo_warstat_aggregates() RETURNS trigger AS $$
+DECLARE
+    delta {stat};
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bdo_add_war_stat(NEW, 1);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM bdo_add_war_stat(OLD, -1);
+    ELSIF NEW.attendance_id = OLD.attendance_id THEN
+        delta := NEW;
+{delta_assignments}
+        PERFORM bdo_add_war_stat(delta, 1);
+    ELSE
+        PERFORM bdo_add_war_stat(OLD, -1);
+        PERFORM bdo_add_war_stat(NEW, 1);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""".format(delta_assignments=delta_assignments, **tables),
+        """
+CREATE OR REPLACE FUNCTION bdo_warattendance_aggregates() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.is_attending = OLD.is_attending
+                AND NEW.war_id = OLD.war_id
+                AND NEW.user_profile_id IS NOT DISTINCT FROM OLD.user_profile_id THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bdo_add_attendance(bdo_finished_war_guild(OLD.war_id), OLD.user_profile_id, OLD.is_attending, -1);
+    END IF;
+    IF TG_OP IN ('UPDATE', 'INSERT') THEN
+        PERFORM bdo_add_attendance(bdo_finished_war_guild(NEW.war_id), NEW.user_profile_id, NEW.is_attending, 1);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""",
+        """
+CREATE OR REPLACE FUNCTION bdo_war_aggregates() RETURNS trigger AS $$
+DECLARE
+    v_attendance record;
+BEGIN
+    IF (OLD.outcome IS NULL) = (NEW.outcome IS NULL) THEN
+        RETURN NULL;
+    END IF;
+
+    -- Finishing a war counts its attendance, re-opening it removes it again
+    FOR v_attendance IN SELECT user_profile_id, is_attending FROM {attendance} WHERE war_id = NEW.id LOOP
+        PERFORM bdo_add_attendance(NEW.guild_id,
+                                   v_attendance.user_profile_id,
+                                   v_attendance.is_attending,
+                                   CASE WHEN NEW.outcome IS NULL THEN -1 ELSE 1 END);
+    END LOOP;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""".format(**tables),
+    ]
+
+    for name, model, events in TRIGGERS:
+        statements.append('DROP TRIGGER IF EXISTS {0} ON {1};'.format(name, model._meta.db_table))
+        statements.append(
+            'CREATE TRIGGER {0} {1} ON {2} FOR EACH ROW EXECUTE PROCEDURE {0}();'.format(name,
+                                                                                       events,
+                                                                                       model._meta.db_table))
+
+    return statements
+
+
+def get_uninstall_sql():
+    statements = [
+        'DROP TRIGGER IF EXISTS {0} ON {1};'.format(name, model._meta.db_table)
+        for name, model, _ in TRIGGERS
+    ]
+    statements += ['DROP FUNCTION IF EXISTS {0};'.format(function) for function in FUNCTIONS]
+
+    return statements
+
+
+def install_triggers(using='default'):
+    with connections[using].cursor() as cursor:
+        for statement in get_install_sql():
+            cursor.execute(statement)
+
+
+def uninstall_triggers(using='default'):
+    with connections[using].cursor() as cursor:
+        for statement in get_uninstall_sql():
+            cursor.execute(statement)
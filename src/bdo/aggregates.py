@@ -0,0 +1,678 @@
+"""
+Deferred maintenance of the aggregated war stat tables.
+
+Signal handlers only mark which aggregate rows are affected by a change. Each
+affected row is then updated exactly once when the transaction commits.
+"""
+import threading
+from collections import Counter, defaultdict
+from logging import getLogger
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from bdo.models.character import Profile
+from bdo.models.guild import Guild, GuildMember
+from bdo.models.stats import (ROLLUP_MODELS,
+                              AggregatedGuildMemberWarStats,
+                              AggregatedGuildWarStats,
+                              AggregatedUserWarStats)
+from bdo.models.war import War, WarAttendance, WarStat
+
+logger = getLogger('bdo')
+_state = threading.local()
+
+
+class DirtyAggregates(object):
+    """
+    Registry of the aggregate rows changed in a transaction.
+
+    Stat deltas are summed per row and applied with a single ``increment``.
+    Rows marked for re-calculation are re-calculated once instead.
+    The weekly and monthly rollups of a guild member are tracked the same way.
+    """
+
+    def __init__(self):
+        self.deltas = defaultdict(Counter)
+        self.recalculate = set()
+        self.rollup_deltas = defaultdict(Counter)
+        self.rollup_recalculate = set()
+
+    def get_keys(self, guild_id=None, profile_id=None):
+        keys = []
+
+        if guild_id is not None:
+            keys.append((AggregatedGuildWarStats, (('guild_id', guild_id),)))
+        if guild_id is not None and profile_id is not None:
+            keys.append((AggregatedGuildMemberWarStats, (('guild_id', guild_id), ('user_profile_id', profile_id))))
+        if profile_id is not None:
+            keys.append((AggregatedUserWarStats, (('user_profile_id', profile_id),)))
+
+        return keys
+
+    def mark(self, keys, deltas=None):
+        for key in keys:
+            if deltas is None:
+                self.recalculate.add(key)
+            else:
+                self.deltas[key].update(deltas)
+
+    def mark_stats_changed(self, guild_id, profile_id, deltas=None, war_date=None):
+        """
+        Mark the guild, guild member and user aggregates of a WarStat change.
+
+        Without deltas the rows are fully re-calculated. The war date selects
+        the rollup buckets the deltas apply to.
+        """
+        self.mark(self.get_keys(guild_id, profile_id), deltas)
+
+        if guild_id is None or profile_id is None:
+            return
+
+        if deltas is None or war_date is None:
+            self.rollup_recalculate.add((guild_id, profile_id))
+        else:
+            self.rollup_deltas[(guild_id, profile_id, war_date)].update(deltas)
+
+    def mark_attendance_changed(self, guild_id, profile_id):
+        """
+        Attendance counters only exist on the guild member and user aggregates.
+        """
+        self.mark([
+            key
+            for key in self.get_keys(guild_id, profile_id)
+            if key[0] is not AggregatedGuildWarStats
+        ])
+
+    def is_scheduled(self, connection):
+        return any(callback == self.flush for _, callback in connection.run_on_commit)
+
+    def flush_rollups(self):
+        guild_ids = {guild_id for guild_id, _ in self.rollup_recalculate}
+        profile_ids = {profile_id for _, profile_id in self.rollup_recalculate}
+
+        for model in ROLLUP_MODELS:
+            if self.rollup_recalculate:
+                rebuild_rollups(model, guild_ids=guild_ids, profile_ids=profile_ids)
+
+            increments = defaultdict(Counter)
+
+            for (guild_id, profile_id, war_date), deltas in self.rollup_deltas.items():
+                if guild_id in guild_ids and profile_id in profile_ids:
+                    # Already rebuilt
+                    continue
+
+                increments[(guild_id, profile_id, model.get_bucket(war_date))].update(deltas)
+
+            increment_rollups(model, increments)
+
+        self.rollup_deltas.clear()
+        self.rollup_recalculate.clear()
+
+    def flush(self):
+        logger.debug("Updating {0} aggregated stats".format(len(self.recalculate | set(self.deltas.keys()))))
+
+        self.flush_rollups()
+
+        for model, key in self.recalculate:
+            model.objects.get_or_create(**dict(key))[0].recalculate()
+
+        for (model, key), deltas in self.deltas.items():
+            if (model, key) in self.recalculate or not any(deltas.values()):
+                continue
+
+            if not model.increment(deltas, **dict(key)):
+                model.objects.get_or_create(**dict(key))[0].recalculate()
+
+        self.deltas.clear()
+        self.recalculate.clear()
+
+
+class AggregateBatch(object):
+    """
+    Collect aggregate changes until the end of the block.
+
+    Usage:
+        with AggregateBatch():
+            ...
+
+    Affected aggregates are updated once when the block exits, or when the
+    surrounding transaction commits. Nested batches join the outer batch.
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.registry = None
+        self.outer = None
+
+    @staticmethod
+    def current():
+        return getattr(_state, 'batch', None)
+
+    def __enter__(self):
+        self.outer = self.current()
+
+        if self.outer is None:
+            self.registry = DirtyAggregates()
+            _state.batch = self
+        else:
+            self.registry = self.outer.registry
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.outer is not None:
+            return
+
+        _state.batch = None
+
+        # Changes made before an error are kept in autocommit mode and a
+        # rolled back transaction discards the flush anyway.
+        transaction.on_commit(self.registry.flush, using=self.using)
+
+
+def get_dirty_aggregates(using=None):
+    """
+    Return the registry of the current batch or transaction.
+
+    Returns None in autocommit mode, changes should be applied immediately.
+    """
+    batch = AggregateBatch.current()
+
+    if batch is not None:
+        return batch.registry
+
+    connection = transaction.get_connection(using)
+
+    if not connection.in_atomic_block:
+        return None
+
+    registry = getattr(connection, 'dirty_aggregates', None)
+
+    # A rollback discards the pending flush along with the registry
+    if registry is None or not registry.is_scheduled(connection):
+        registry = DirtyAggregates()
+        connection.dirty_aggregates = registry
+        transaction.on_commit(registry.flush, using=using)
+
+    return registry
+
+
+def triggers_enabled():
+    """
+    Aggregates are maintained by the database triggers in bdo.aggregate_triggers.
+    """
+    return getattr(settings, 'AGGREGATE_TRIGGERS', False)
+
+
+def _mark(method, *args, **kwargs):
+    if triggers_enabled():
+        return
+
+    registry = get_dirty_aggregates()
+
+    if registry is None:
+        registry = DirtyAggregates()
+        getattr(registry, method)(*args, **kwargs)
+        registry.flush()
+    else:
+        getattr(registry, method)(*args, **kwargs)
+
+
+def mark_stats_changed(guild_id, profile_id, deltas=None, war_date=None):
+    if deltas is not None and any(transaction.get_connection().savepoint_ids):
+        # Deltas recorded inside a savepoint can't be undone if it is rolled back
+        deltas = None
+
+    _mark('mark_stats_changed', guild_id, profile_id, deltas, war_date)
+
+
+def mark_attendance_changed(guild_id, profile_id):
+    _mark('mark_attendance_changed', guild_id, profile_id)
+
+
+# Set-based rebuilds
+ATTENDANCE_FIELDS = ('wars_attended', 'wars_unavailable', 'wars_missed', 'wars_reneged')
+# WarAttendance.is_attending values counted by each attendance field
+ATTENDANCE_CONDITIONS = {
+    'wars_attended': 'IN (0, 4)',
+    'wars_unavailable': '= 1',
+    'wars_missed': 'IN (3, 5)',
+    'wars_reneged': '= 5',
+}
+KEY_FIELDS = {
+    AggregatedGuildWarStats: ('guild_id',),
+    AggregatedGuildMemberWarStats: ('guild_id', 'user_profile_id'),
+    AggregatedUserWarStats: ('user_profile_id',),
+}
+KEY_EXPRESSIONS = {
+    'guild_id': 'war.guild_id',
+    'user_profile_id': 'attendance.user_profile_id',
+}
+
+
+def get_scope_sql(columns, guild_ids=None, profile_ids=None):
+    """
+    WHERE clause restricting the guild and profile columns to the given ids.
+    """
+    conditions = ['TRUE']
+    params = []
+
+    for column, ids in [(columns.get('guild_id'), guild_ids), (columns.get('user_profile_id'), profile_ids)]:
+        if column is not None and ids is not None:
+            conditions.append('{0} = ANY(%s)'.format(column))
+            params.append(list(ids))
+
+    return ' AND '.join(conditions), params
+
+
+def get_recent_wars_sql(profile_column):
+    """
+    Subquery of the recent_wars and recent_reneges window of a profile.
+
+    Matches AggregatedUserWarStats.recalculate_recent_wars.
+    """
+    return (
+        '(SELECT COUNT(*) AS recent_wars,'
+        ' COALESCE(SUM(CASE WHEN recent_attendance.is_attending = 5'
+        ' THEN 1 << (recent_attendance.position - 1)::integer ELSE 0 END), 0) AS recent_reneges'
+        ' FROM (SELECT attendance.is_attending,'
+        ' ROW_NUMBER() OVER (ORDER BY war.date DESC, war.id DESC) AS position'
+        ' FROM {attendance} attendance'
+        ' JOIN {war} war ON war.id = attendance.war_id'
+        ' WHERE attendance.user_profile_id = {profile} AND war.outcome IS NOT NULL'
+        ' AND attendance.is_attending IN (0, 4, 5)'
+        ' ORDER BY war.date DESC, war.id DESC LIMIT {size}) recent_attendance)'
+    ).format(attendance=WarAttendance._meta.db_table,
+             war=War._meta.db_table,
+             profile=profile_column,
+             size=AggregatedUserWarStats.RECENT_WARS)
+
+
+def get_attendance_rate_sql(attended, unavailable, missed):
+    """
+    attendance_rate expression, matching BaseUserAggregatedWarStats.recalculate_attendance_rate.
+    """
+    return 'CASE WHEN {0} + {1} + {2} = 0 THEN 0.0 ELSE ({0} + {1} * 0.5) / ({0} + {1} + {2}) END'.format(attended,
+                                                                                                         unavailable,
+                                                                                                         missed)
+
+
+def get_attendance_counts_sql(alias):
+    return ', '.join(
+        'SUM(CASE WHEN {0}.is_attending {1} THEN 1 ELSE 0 END) AS {2}'.format(alias, ATTENDANCE_CONDITIONS[field], field)
+        for field in ATTENDANCE_FIELDS
+    )
+
+
+def expected_aggregates_sql(model, guild_ids=None, profile_ids=None):
+    """
+    SELECT computing the expected rows of an aggregate table from WarStat and WarAttendance.
+
+    Every aggregate in the scope is computed with one GROUP BY per source table.
+    """
+    keys = KEY_FIELDS[model]
+    key_columns = {key: KEY_EXPRESSIONS[key] for key in keys}
+    has_attendance = model is not AggregatedGuildWarStats
+    tables = {
+        'war': War._meta.db_table,
+        'attendance': WarAttendance._meta.db_table,
+        'stat': WarStat._meta.db_table,
+    }
+    key_select = ', '.join('{0} AS {1}'.format(KEY_EXPRESSIONS[key], key) for key in keys)
+    group_by = ', '.join(KEY_EXPRESSIONS[key] for key in keys)
+    params = []
+
+    # Stat totals
+    where, where_params = get_scope_sql(key_columns, guild_ids, profile_ids)
+
+    if 'user_profile_id' in keys:
+        where = 'attendance.user_profile_id IS NOT NULL AND ' + where
+
+    sums = ', '.join('SUM(stat.{0}) AS {0}'.format(field) for field in WarStat.STAT_FIELDS)
+    sql = (
+        'WITH stats AS ('
+        ' SELECT {key_select}, {sums},'
+        ' SUM(stat.guild_master + stat.officer + stat.member + stat.siege_weapons) AS total_kills'
+        ' FROM {stat} stat'
+        ' JOIN {attendance} attendance ON attendance.id = stat.attendance_id'
+        ' JOIN {war} war ON war.id = attendance.war_id'
+        ' WHERE {where}'
+        ' GROUP BY {group_by})'
+    ).format(key_select=key_select, sums=sums, where=where, group_by=group_by, **tables)
+    params.extend(where_params)
+
+    # Attendance counters, only finished wars are counted
+    if has_attendance:
+        sql += (
+            ', attendance_counts AS ('
+            ' SELECT {key_select}, {counts}'
+            ' FROM {attendance} attendance'
+            ' JOIN {war} war ON war.id = attendance.war_id'
+            ' WHERE war.outcome IS NOT NULL AND {where}'
+            ' GROUP BY {group_by})'
+        ).format(key_select=key_select, counts=get_attendance_counts_sql('attendance'), where=where,
+                 group_by=group_by, **tables)
+        params.extend(where_params)
+
+    # Every existing row in scope is included so rows without history are reset
+    if model is AggregatedGuildWarStats:
+        where, where_params = get_scope_sql({'guild_id': 'id'}, guild_ids)
+        keys_sql = 'SELECT id AS guild_id FROM {0} WHERE {1}'.format(Guild._meta.db_table, where)
+    elif model is AggregatedUserWarStats:
+        where, where_params = get_scope_sql({'user_profile_id': 'id'}, profile_ids=profile_ids)
+        keys_sql = 'SELECT id AS user_profile_id FROM {0} WHERE {1}'.format(Profile._meta.db_table, where)
+    else:
+        where, where_params = get_scope_sql({'guild_id': 'guild_id', 'user_profile_id': 'user_profile_id'},
+                                            guild_ids,
+                                            profile_ids)
+        member_where, member_params = get_scope_sql({'guild_id': 'guild_id', 'user_profile_id': 'user_id'},
+                                                    guild_ids,
+                                                    profile_ids)
+        keys_sql = (
+            'SELECT guild_id, user_profile_id FROM {0} WHERE {1}'
+            ' UNION SELECT guild_id, user_id FROM {2} WHERE {3}'
+            ' UNION SELECT guild_id, user_profile_id FROM stats'
+            ' UNION SELECT guild_id, user_profile_id FROM attendance_counts'
+        ).format(model._meta.db_table, where, GuildMember._meta.db_table, member_where)
+        where_params = where_params + member_params
+    params.extend(where_params)
+
+    columns = ['aggregate_keys.{0}'.format(key) for key in keys]
+    columns += ['COALESCE(stats.{0}, 0) AS {0}'.format(field) for field in WarStat.STAT_FIELDS]
+    columns += [
+        'COALESCE(stats.total_kills, 0) AS total_kills',
+        'CASE WHEN COALESCE(stats.death, 0) = 0 THEN 0.0'
+        ' ELSE stats.total_kills * 1.0 / stats.death END AS kdr',
+    ]
+    joins = ' LEFT JOIN stats USING ({0})'.format(', '.join(keys))
+
+    if has_attendance:
+        columns += ['COALESCE(attendance_counts.{0}, 0) AS {0}'.format(field) for field in ATTENDANCE_FIELDS]
+        columns.append('{0} AS attendance_rate'.format(
+            get_attendance_rate_sql(*['COALESCE(attendance_counts.{0}, 0)'.format(field)
+                                      for field in ('wars_attended', 'wars_unavailable', 'wars_missed')])))
+        joins += ' LEFT JOIN attendance_counts USING ({0})'.format(', '.join(keys))
+
+    if model is AggregatedUserWarStats:
+        columns += ['recent.recent_wars', 'recent.recent_reneges']
+        joins += ' CROSS JOIN LATERAL {0} recent'.format(get_recent_wars_sql('aggregate_keys.user_profile_id'))
+
+    sql += ' SELECT {0} FROM ({1}) aggregate_keys{2}'.format(', '.join(columns), keys_sql, joins)
+
+    return sql, params
+
+
+def get_aggregate_columns(model):
+    columns = list(KEY_FIELDS[model]) + list(WarStat.STAT_FIELDS) + ['total_kills', 'kdr']
+
+    if model is not AggregatedGuildWarStats:
+        columns += list(ATTENDANCE_FIELDS) + ['attendance_rate']
+    if model is AggregatedUserWarStats:
+        columns += ['recent_wars', 'recent_reneges']
+
+    return columns
+
+
+def rebuild_aggregates(model, guild_ids=None, profile_ids=None, using='default'):
+    """
+    Re-calculate an aggregate table with a single INSERT ... ON CONFLICT DO UPDATE.
+
+    Missing rows are created and existing rows keep their primary key.
+    Returns the number of rows written.
+    """
+    expected_sql, params = expected_aggregates_sql(model, guild_ids, profile_ids)
+    keys = KEY_FIELDS[model]
+    columns = get_aggregate_columns(model)
+    sql = (
+        'INSERT INTO {table} ({columns}) SELECT {columns} FROM ({expected}) expected'
+        ' ON CONFLICT ({keys}) DO UPDATE SET {updates}'
+    ).format(
+        table=model._meta.db_table,
+        columns=', '.join(columns),
+        expected=expected_sql,
+        keys=', '.join(keys),
+        updates=', '.join('{0} = EXCLUDED.{0}'.format(column) for column in columns if column not in keys),
+    )
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+
+        return cursor.rowcount
+
+
+# Columns compared with a tolerance, SQL and Python may round them differently
+APPROXIMATE_COLUMNS = ('kdr', 'attendance_rate')
+
+
+def audit_aggregates(model, guild_ids=None, profile_ids=None, repair=False, using='default'):
+    """
+    Find the rows of an aggregate table that don't match WarStat and WarAttendance.
+
+    The expected rows are computed in one set-based pass and compared with the
+    stored rows. With ``repair`` only the missing and drifted rows are written
+    back, in the same statement. Returns a list of (keys, missing) tuples.
+    """
+    expected_sql, params = expected_aggregates_sql(model, guild_ids, profile_ids)
+    keys = KEY_FIELDS[model]
+    columns = get_aggregate_columns(model)
+    differences = [
+        'abs(expected.{0} - stored.{0}) > 1e-9'.format(column)
+        if column in APPROXIMATE_COLUMNS else
+        'expected.{0} IS DISTINCT FROM stored.{0}'.format(column)
+        for column in columns
+        if column not in keys
+    ]
+    sql = (
+        'WITH drifted AS ('
+        ' SELECT expected.*, stored.id IS NULL AS missing'
+        ' FROM ({expected}) expected'
+        ' LEFT JOIN {table} stored USING ({keys})'
+        ' WHERE stored.id IS NULL OR {differences})'
+    ).format(expected=expected_sql,
+             table=model._meta.db_table,
+             keys=', '.join(keys),
+             differences=' OR '.join(differences))
+
+    if repair:
+        sql += (
+            ', repaired AS ('
+            ' INSERT INTO {table} ({columns}) SELECT {columns} FROM drifted'
+            ' ON CONFLICT ({keys}) DO UPDATE SET {updates})'
+        ).format(table=model._meta.db_table,
+                 columns=', '.join(columns),
+                 keys=', '.join(keys),
+                 updates=', '.join('{0} = EXCLUDED.{0}'.format(column) for column in columns if column not in keys))
+
+    sql += ' SELECT {0}, missing FROM drifted'.format(', '.join(keys))
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+
+        return [(tuple(row[:-1]), row[-1]) for row in cursor.fetchall()]
+
+
+def get_attendance_increments(is_attending):
+    """
+    Attendance counters a single war adds, matching BaseUserAggregatedWarStats.recalculate.
+    """
+    return {
+        'wars_attended': int(is_attending in [0, 4]),
+        'wars_unavailable': int(is_attending == 1),
+        'wars_missed': int(is_attending in [3, 5]),
+        'wars_reneged': int(is_attending == 5),
+    }
+
+
+def refresh_recent_wars(profile_ids, using='default'):
+    """
+    Re-calculate the recent war window of the users with a single UPDATE.
+    """
+    if not profile_ids:
+        return 0
+
+    sql = (
+        'UPDATE {table} AS aggregate SET (recent_wars, recent_reneges) ='
+        ' (SELECT recent.recent_wars, recent.recent_reneges FROM {recent} recent)'
+        ' WHERE aggregate.user_profile_id = ANY(%s)'
+    ).format(table=AggregatedUserWarStats._meta.db_table,
+             recent=get_recent_wars_sql('aggregate.user_profile_id'))
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, [list(profile_ids)])
+
+        return cursor.rowcount
+
+
+def increment_aggregates(model, increments, guild_id=None, using='default'):
+    """
+    Add per-profile increments to an aggregate table with a single UPDATE ... FROM (VALUES ...).
+
+    ``increments`` maps a profile id to the stat and attendance values to add.
+    Rows are updated in place and total_kills/kdr are derived from the new values.
+    Returns the number of rows updated.
+    """
+    if not increments:
+        return 0
+
+    fields = list(WarStat.STAT_FIELDS) + list(ATTENDANCE_FIELDS)
+    values = []
+    params = []
+
+    for profile_id, increment in increments.items():
+        values.append('({0})'.format(', '.join(['%s'] * (len(fields) + 1))))
+        params.append(profile_id)
+        params.extend(increment.get(field, 0) for field in fields)
+
+    def new_value(field):
+        return '(aggregate.{0} + submitted.{0})'.format(field)
+
+    total_kills = ' + '.join(new_value(field) for field in model.KILL_FIELDS)
+    updates = ['{0} = {1}'.format(field, new_value(field)) for field in fields]
+    updates += [
+        'total_kills = {0}'.format(total_kills),
+        'kdr = CASE WHEN {death} = 0 THEN 0.0 ELSE ({total_kills}) * 1.0 / {death} END'.format(
+            death=new_value('death'),
+            total_kills=total_kills),
+        'attendance_rate = {0}'.format(get_attendance_rate_sql(new_value('wars_attended'),
+                                                               new_value('wars_unavailable'),
+                                                               new_value('wars_missed'))),
+    ]
+    sql = (
+        'UPDATE {table} AS aggregate SET {updates}'
+        ' FROM (VALUES {values}) AS submitted (user_profile_id, {fields})'
+        ' WHERE aggregate.user_profile_id = submitted.user_profile_id'
+    ).format(table=model._meta.db_table,
+             updates=', '.join(updates),
+             values=', '.join(values),
+             fields=', '.join(fields))
+
+    if guild_id is not None:
+        sql += ' AND aggregate.guild_id = %s'
+        params.append(guild_id)
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+
+        return cursor.rowcount
+
+
+# Weekly and monthly rollups
+ROLLUP_KEY_FIELDS = ('guild_id', 'user_profile_id', 'bucket')
+
+
+def get_rollup_columns():
+    return list(ROLLUP_KEY_FIELDS) + list(WarStat.STAT_FIELDS) + ['total_kills']
+
+
+def get_bucket_sql(model, column):
+    """
+    SQL expression of the rollup bucket of a timestamp, matching ``model.get_bucket``.
+    """
+    return "date_trunc('{0}', {1} AT TIME ZONE 'UTC')::date".format(model.BUCKET_UNIT, column)
+
+
+def get_rollup_upsert_sql(model, rows_sql):
+    """
+    INSERT adding rows to the rollup buckets, creating missing buckets.
+    """
+    columns = get_rollup_columns()
+
+    return (
+        'INSERT INTO {table} AS rollup ({columns}) {rows}'
+        ' ON CONFLICT ({keys}) DO UPDATE SET {updates}'
+    ).format(table=model._meta.db_table,
+             columns=', '.join(columns),
+             rows=rows_sql,
+             keys=', '.join(ROLLUP_KEY_FIELDS),
+             updates=', '.join('{0} = rollup.{0} + EXCLUDED.{0}'.format(column)
+                               for column in columns if column not in ROLLUP_KEY_FIELDS))
+
+
+def increment_rollups(model, increments, using='default'):
+    """
+    Add stat increments to rollup buckets with a single INSERT ... ON CONFLICT DO UPDATE.
+
+    ``increments`` maps a (guild id, profile id, bucket) tuple to the stat values to add.
+    Returns the number of buckets written.
+    """
+    values = []
+    params = []
+
+    for (guild_id, profile_id, bucket), increment in increments.items():
+        stats = [increment.get(field, 0) for field in WarStat.STAT_FIELDS]
+
+        if not any(stats):
+            continue
+
+        values.append('({0})'.format(', '.join(['%s'] * (len(stats) + 4))))
+        params.extend([guild_id, profile_id, bucket])
+        params.extend(stats)
+        params.append(sum(increment.get(field, 0) for field in model.KILL_FIELDS))
+
+    if not values:
+        return 0
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(get_rollup_upsert_sql(model, 'VALUES {0}'.format(', '.join(values))), params)
+
+        return cursor.rowcount
+
+
+def rebuild_rollups(model, guild_ids=None, profile_ids=None, using='default'):
+    """
+    Re-calculate the rollup buckets of the guilds and profiles from WarStat.
+
+    Returns the number of buckets written.
+    """
+    delete_where, delete_params = get_scope_sql({'guild_id': 'guild_id', 'user_profile_id': 'user_profile_id'},
+                                                guild_ids,
+                                                profile_ids)
+    where, params = get_scope_sql({'guild_id': 'war.guild_id', 'user_profile_id': 'attendance.user_profile_id'},
+                                  guild_ids,
+                                  profile_ids)
+    columns = get_rollup_columns()
+    sums = ', '.join('SUM(stat.{0})'.format(field) for field in WarStat.STAT_FIELDS)
+    sql = (
+        'INSERT INTO {table} ({columns})'
+        ' SELECT war.guild_id, attendance.user_profile_id, {bucket}, {sums},'
+        ' SUM(stat.guild_master + stat.officer + stat.member + stat.siege_weapons)'
+        ' FROM {stat} stat'
+        ' JOIN {attendance} attendance ON attendance.id = stat.attendance_id'
+        ' JOIN {war} war ON war.id = attendance.war_id'
+        ' WHERE attendance.user_profile_id IS NOT NULL AND {where}'
+        ' GROUP BY 1, 2, 3'
+    ).format(table=model._meta.db_table,
+             columns=', '.join(columns),
+             bucket=get_bucket_sql(model, 'war.date'),
+             sums=sums,
+             stat=WarStat._meta.db_table,
+             attendance=WarAttendance._meta.db_table,
+             war=War._meta.db_table,
+             where=where)
+
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM {0} WHERE {1}'.format(model._meta.db_table, delete_where), delete_params)
+        cursor.execute(sql, params)
+
+        return cursor.rowcount
@@ -0,0 +1,133 @@
+"""
+Incremental maintenance of the GuildSummary table.
+
+Every guild member with a main character contributes its level, gearscore
+and class to the guild's summary. The signal handlers compute a member's
+contribution before and after a change and apply the difference to the
+summaries of their guilds.
+"""
+from collections import Counter
+
+from django.db import connections
+
+from bdo.models.character import Character, Profile
+from bdo.models.content import CharacterClass
+from bdo.models.guild import Guild, GuildMember, GuildSummary
+
+
+def get_contributions(**filters):
+    """
+    Summary totals contributed by the main characters matching the filters, and their profile ids.
+
+    Class counts are keyed by ('class', name).
+    """
+    contribution = Counter()
+    profile_ids = set()
+
+    for profile_id, level, ap, aap, dp, npc_renown, class_name in (
+            Character.objects.filter(is_main=True, **filters)
+                             .values_list('profile_id', 'level', 'ap', 'aap', 'dp',
+                                          'profile__npc_renown', 'character_class__name')):
+        profile_ids.add(profile_id)
+        contribution.update({
+            'main_count': 1,
+            'level_total': level,
+            'gearscore_total': Character.get_gearscore(ap, aap, dp, npc_renown),
+            ('class', class_name.lower()): 1,
+        })
+
+    return contribution, profile_ids
+
+
+def get_changes(old, new):
+    # Counter arithmetic would drop the negative totals
+    changes = Counter()
+    changes.update(new)
+    changes.subtract(old)
+
+    return changes
+
+
+def get_guild_ids(profile_id):
+    if profile_id is None:
+        return []
+
+    return list(GuildMember.objects.filter(user=profile_id).values_list('guild_id', flat=True))
+
+
+def apply_summary_changes(guild_ids, changes, using='default'):
+    """
+    Add the changes to the summaries of the guilds with one UPDATE.
+    """
+    totals = [changes.get(field, 0) for field in GuildSummary.SUMMARY_FIELDS]
+    classes = [(key[1], value) for key, value in changes.items() if isinstance(key, tuple) and value]
+
+    if not guild_ids or not (any(totals) or classes):
+        return
+
+    sql = (
+        'UPDATE {table} SET {totals},'
+        ' class_distribution = class_distribution || COALESCE(('
+        '  SELECT jsonb_object_agg(change.name, COALESCE((class_distribution->>change.name)::integer, 0) + change.delta)'
+        '  FROM unnest(%s::text[], %s::integer[]) AS change(name, delta)'
+        ' ), \'{{}}\'::jsonb)'
+        ' WHERE guild_id = ANY(%s)'
+    ).format(table=GuildSummary._meta.db_table,
+             totals=', '.join('{0} = {0} + %s'.format(field) for field in GuildSummary.SUMMARY_FIELDS))
+    params = totals + [[name for name, _ in classes], [value for _, value in classes], list(guild_ids)]
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def rebuild_guild_summaries(guild_ids=None, using='default'):
+    """
+    Re-write the summaries of the guilds, all guilds if None, with one set-based upsert.
+
+    Returns the number of rows written.
+    """
+    tables = {
+        'summary': GuildSummary._meta.db_table,
+        'guild': Guild._meta.db_table,
+        'member': GuildMember._meta.db_table,
+        'character': Character._meta.db_table,
+        'profile': Profile._meta.db_table,
+        'class': CharacterClass._meta.db_table,
+    }
+    mains = (
+        'SELECT member.guild_id, main.level, main.ap, main.aap, main.dp,'
+        ' profile.npc_renown, LOWER(character_class.name) AS class_name'
+        ' FROM {member} member'
+        ' JOIN {character} main ON main.profile_id = member.user_id AND main.is_main'
+        ' JOIN {profile} profile ON profile.id = member.user_id'
+        ' JOIN {class} character_class ON character_class.id = main.character_class_id'
+    ).format(**tables)
+    sql = (
+        'INSERT INTO {summary} (guild_id, member_count, main_count, level_total, gearscore_total, class_distribution)'
+        ' SELECT guild.id, COALESCE(members.total, 0), COALESCE(totals.main_count, 0),'
+        ' COALESCE(totals.level_total, 0), COALESCE(totals.gearscore_total, 0),'
+        ' COALESCE(classes.class_distribution, \'{{}}\'::jsonb)'
+        ' FROM {guild} guild'
+        ' LEFT JOIN (SELECT guild_id, COUNT(*) AS total FROM {member} GROUP BY guild_id) members'
+        '  ON members.guild_id = guild.id'
+        ' LEFT JOIN (SELECT guild_id, COUNT(*) AS main_count, SUM(level) AS level_total,'
+        '  SUM({gearscore}) AS gearscore_total FROM ({mains}) mains GROUP BY guild_id) totals'
+        '  ON totals.guild_id = guild.id'
+        ' LEFT JOIN (SELECT guild_id, jsonb_object_agg(class_name, total) AS class_distribution'
+        '  FROM (SELECT guild_id, class_name, COUNT(*) AS total FROM ({mains}) mains GROUP BY guild_id, class_name) counts'
+        '  GROUP BY guild_id) classes'
+        '  ON classes.guild_id = guild.id'
+        ' WHERE {scope}'
+        ' ON CONFLICT (guild_id) DO UPDATE SET'
+        ' member_count = EXCLUDED.member_count, main_count = EXCLUDED.main_count,'
+        ' level_total = EXCLUDED.level_total, gearscore_total = EXCLUDED.gearscore_total,'
+        ' class_distribution = EXCLUDED.class_distribution'
+    ).format(mains=mains,
+             gearscore=Character.get_gearscore_sql(),
+             scope='TRUE' if guild_ids is None else 'guild.id = ANY(%s)',
+             **tables)
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, [] if guild_ids is None else [list(guild_ids)])
+
+        return cursor.rowcount
@@ -0,0 +1,164 @@
+"""
+Append-only ledger of guild member stat and attendance changes.
+
+Every change to the totals of AggregatedGuildMemberWarStats is also written as
+a WarStatLedgerEntry. Checkpoints hold the running totals after every
+CHECKPOINT_INTERVAL entries, so the totals as of any timestamp fold a bounded
+number of entries.
+
+Checkpoints are written by the checkpoint-stat-ledger command. They follow the
+entry ids and only go up to the highest committed id, so an entry of a slow
+transaction is never skipped.
+"""
+from collections import Counter
+
+from django.db import connections, transaction
+from django.db.models import Sum
+
+from bdo.aggregates import get_attendance_increments
+from bdo.models.stats import AggregatedGuildMemberWarStats, WarStatLedgerCheckpoint, WarStatLedgerEntry
+
+# Number of entries folded into each checkpoint
+CHECKPOINT_INTERVAL = 50
+
+
+def get_ledger_entry(guild_id, profile_id, deltas, war_id=None, sign=1):
+    """
+    Unsaved ledger entry of the deltas, None if there is nothing to record.
+    """
+    if guild_id is None or profile_id is None:
+        return None
+
+    values = {
+        field: sign * deltas.get(field, 0)
+        for field in WarStatLedgerEntry.LEDGER_FIELDS
+        if field != 'total_kills'
+    }
+    values['total_kills'] = sum(values[field] for field in WarStatLedgerEntry.KILL_FIELDS)
+
+    if not any(values.values()):
+        return None
+
+    return WarStatLedgerEntry(guild_id=guild_id, user_profile_id=profile_id, war_id=war_id, **values)
+
+
+def get_attendance_deltas(war, previous_status, status):
+    """
+    Attendance counter changes of a status change, only finished wars are counted.
+    """
+    deltas = Counter()
+
+    if war.outcome is None:
+        return deltas
+
+    if previous_status is not None:
+        deltas.subtract(get_attendance_increments(previous_status))
+    if status is not None:
+        deltas.update(get_attendance_increments(status))
+
+    return deltas
+
+
+def record_ledger_entries(entries):
+    """
+    Save the entries.
+
+    Entries are written in the current transaction so they are rolled back along with the change.
+    """
+    entries = [entry for entry in entries if entry is not None]
+
+    if entries:
+        WarStatLedgerEntry.objects.bulk_create(entries)
+
+
+def get_committed_entry_id(using='default'):
+    """
+    Highest ledger entry id below which every entry is committed or rolled back.
+
+    The SHARE lock waits for the transactions writing entries to finish, later
+    entries get higher ids. Call it outside of a transaction, the lock blocks
+    writers until the transaction ends.
+    """
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute('LOCK TABLE {0} IN SHARE MODE'.format(WarStatLedgerEntry._meta.db_table))
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM {0}'.format(WarStatLedgerEntry._meta.db_table))
+
+        return cursor.fetchone()[0]
+
+
+def checkpoint_ledger(up_to_id, keys=None, using='default'):
+    """
+    Write a checkpoint after every CHECKPOINT_INTERVAL entries of a guild member.
+
+    Only entries with an id up to ``up_to_id`` are folded, see get_committed_entry_id.
+    ``keys`` is a collection of (guild id, profile id) tuples, all guild members if None.
+    Returns the number of checkpoints written.
+    """
+    fields = WarStatLedgerEntry.LEDGER_FIELDS
+    params = []
+
+    if keys is None:
+        scope = 'TRUE'
+    else:
+        keys = list(keys)
+        scope = '(guild_id, user_profile_id) IN (SELECT * FROM unnest(%s::integer[], %s::integer[]))'
+        params.extend([[guild_id for guild_id, _ in keys], [profile_id for _, profile_id in keys]])
+
+    # A checkpoint is dated at the latest entry it folds, so it can be used
+    # for any timestamp after that
+    sql = (
+        'WITH latest AS ('
+        ' SELECT DISTINCT ON (guild_id, user_profile_id) * FROM {checkpoint}'
+        ' WHERE {scope} ORDER BY guild_id, user_profile_id, last_entry_id DESC),'
+        ' pending AS ('
+        ' SELECT entry.guild_id, entry.user_profile_id, entry.id, MAX(entry.created) OVER running AS created,'
+        ' ROW_NUMBER() OVER running AS position, {sums}'
+        ' FROM {entry} entry'
+        ' LEFT JOIN latest ON latest.guild_id = entry.guild_id AND latest.user_profile_id = entry.user_profile_id'
+        ' WHERE {entry_scope} AND entry.id <= %s AND entry.id > COALESCE(latest.last_entry_id, 0)'
+        ' WINDOW running AS (PARTITION BY entry.guild_id, entry.user_profile_id ORDER BY entry.id))'
+        ' INSERT INTO {checkpoint} (guild_id, user_profile_id, last_entry_id, created, {columns})'
+        ' SELECT pending.guild_id, pending.user_profile_id, pending.id, GREATEST(pending.created, latest.created),'
+        ' {totals}'
+        ' FROM pending'
+        ' LEFT JOIN latest ON latest.guild_id = pending.guild_id AND latest.user_profile_id = pending.user_profile_id'
+        ' WHERE pending.position %% %s = 0'
+        ' ON CONFLICT DO NOTHING'
+    ).format(checkpoint=WarStatLedgerCheckpoint._meta.db_table,
+             entry=WarStatLedgerEntry._meta.db_table,
+             scope=scope,
+             entry_scope=scope.replace('(guild_id, user_profile_id)', '(entry.guild_id, entry.user_profile_id)'),
+             sums=', '.join('SUM(entry.{0}) OVER running AS {0}'.format(field) for field in fields),
+             columns=', '.join(fields),
+             totals=', '.join('pending.{0} + COALESCE(latest.{0}, 0)'.format(field) for field in fields))
+    params = params + params + [up_to_id, CHECKPOINT_INTERVAL]
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+
+        return cursor.rowcount
+
+
+def get_member_stats_as_of(guild_id, profile_id, timestamp):
+    """
+    Unsaved AggregatedGuildMemberWarStats with the member's totals as of the timestamp.
+    """
+    checkpoint = (WarStatLedgerCheckpoint.objects.filter(guild_id=guild_id,
+                                                          user_profile_id=profile_id,
+                                                          created__lte=timestamp)
+                                                  .order_by('-last_entry_id')
+                                                  .first())
+    entries = WarStatLedgerEntry.objects.filter(guild_id=guild_id, user_profile_id=profile_id, created__lte=timestamp)
+
+    if checkpoint is not None:
+        entries = entries.filter(id__gt=checkpoint.last_entry_id)
+
+    totals = entries.aggregate(**{field: Sum(field) for field in WarStatLedgerEntry.LEDGER_FIELDS})
+    stats = AggregatedGuildMemberWarStats(guild_id=guild_id, user_profile_id=profile_id)
+
+    for field in WarStatLedgerEntry.LEDGER_FIELDS:
+        setattr(stats, field, (totals[field] or 0) + (getattr(checkpoint, field) if checkpoint else 0))
+
+    stats.recalculate_kdr()
+
+    return stats
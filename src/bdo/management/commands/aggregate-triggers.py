@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand
+from django.db.transaction import atomic
+
+from bdo.aggregate_triggers import install_triggers, uninstall_triggers
+
+
+class Command(BaseCommand):
+    help = ('Install or remove the database triggers maintaining the aggregate tables. The trigger SQL is '
+            'generated from the model columns, re-install after migrations changing them (e.g. 0023).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['install', 'uninstall'])
+
+    def handle(self, *args, **options):
+        with atomic():
+            if options['action'] == 'install':
+                install_triggers()
+            else:
+                uninstall_triggers()
+
+        if options['action'] == 'install':
+            # The trigger SQL is generated from the model columns at install time
+            print("Installed aggregate triggers. Run recalculate-aggregates to sync existing rows "
+                  "and set AGGREGATE_TRIGGERS = True. Re-run install after migrations changing the "
+                  "aggregate or war tables.")
+        else:
+            print("Removed aggregate triggers. Set AGGREGATE_TRIGGERS = False.")
@@ -0,0 +1,62 @@
+import time
+from collections import Counter
+
+from django.core.management import BaseCommand
+from django.db.transaction import atomic
+
+from bdo.aggregates import audit_aggregates
+from bdo.models.guild import Guild
+from bdo.models.stats import (AggregatedGuildMemberWarStats,
+                              AggregatedGuildWarStats,
+                              AggregatedUserWarStats)
+
+
+class Command(BaseCommand):
+    help = 'Compare the aggregate tables with the war stats and attendance, optionally repairing drifted rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--guild', type=int, action='append', dest='guilds',
+                            help='Only audit aggregates of this guild id. Can be repeated.')
+        parser.add_argument('--profile', type=int, action='append', dest='profiles',
+                            help='Only audit aggregates of this profile id. Can be repeated.')
+        parser.add_argument('--repair', action='store_true',
+                            help='Re-write the missing and drifted rows.')
+
+    def handle(self, *args, **options):
+        start = time.time()
+        guild_ids = options['guilds']
+        profile_ids = options['profiles']
+        models = [AggregatedGuildMemberWarStats, AggregatedUserWarStats]
+
+        if profile_ids is None:
+            # Guild totals can only be checked when every member is in scope
+            models.insert(0, AggregatedGuildWarStats)
+
+        drift = {}
+
+        with atomic():
+            for model in models:
+                drift[model] = audit_aggregates(model,
+                                                guild_ids=guild_ids,
+                                                profile_ids=profile_ids,
+                                                repair=options['repair'])
+
+        guild_names = dict(Guild.objects.values_list('id', 'name'))
+
+        for model, rows in drift.items():
+            missing = sum(1 for _, is_missing in rows if is_missing)
+            print("{0}: {1} missing, {2} drifted".format(model.__name__, missing, len(rows) - missing))
+
+            if model is AggregatedUserWarStats:
+                continue
+
+            # Keys start with the guild id
+            per_guild = Counter(keys[0] for keys, _ in rows)
+
+            for guild_id, count in per_guild.most_common():
+                print("  [{0}] {1}: {2} rows".format(guild_id, guild_names.get(guild_id, 'Deleted guild'), count))
+
+        total = sum(len(rows) for rows in drift.values())
+        action = "Repaired" if options['repair'] else "Found"
+
+        print("{0} {1} rows out of sync in {2:.2f}s".format(action, total, time.time() - start))
@@ -0,0 +1,38 @@
+import numpy
+from django.core.management import BaseCommand
+
+from bdo.sample_data import create_sample_guild, create_sample_war, format_timings, measure, rolled_back
+from bdo.team_composer import compose_teams, solve_assignment
+
+# Longest a compose request may take for a full node war
+TARGET_MS = 100
+
+
+class Command(BaseCommand):
+    help = 'Time compose_teams and solve_assignment on a synthetic war. Nothing is kept.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attendees', type=int, default=100,
+                            help='Number of attending members.')
+        parser.add_argument('--platoons', type=int, default=5,
+                            help='Number of empty platoons, 20 slots each.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of timed runs.')
+
+    def handle(self, *args, **options):
+        attendees, platoons = options['attendees'], options['platoons']
+        cost = numpy.random.RandomState(attendees).rand(attendees, platoons * 20)
+
+        with rolled_back():
+            guild = create_sample_guild(attendees, seed=attendees)
+            war = create_sample_war(guild, attendee_count=attendees, platoons=platoons)
+            timings = measure(lambda: compose_teams(war), options['repeat'])
+
+        solver_timings = measure(lambda: solve_assignment(cost), options['repeat'])
+
+        print("{0} attendees, {1} platoons".format(attendees, platoons))
+        print("  compose_teams: {0}".format(format_timings(timings)))
+        print("  solve_assignment: {0}".format(format_timings(solver_timings)))
+
+        if sorted(timings)[len(timings) // 2] > TARGET_MS:
+            print("  compose_teams median is over the {0} ms target".format(TARGET_MS))
@@ -0,0 +1,33 @@
+from django.core.management import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from bdo.models.war import War
+from bdo.sample_data import create_sample_guild, create_sample_war, format_timings, measure, rolled_back
+
+
+class Command(BaseCommand):
+    help = 'Time War.generate_attendance on synthetic guilds. Nothing is kept.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, action='append', dest='members',
+                            help='Number of guild members. Can be repeated, defaults to 50, 200 and 1000.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of timed runs per size.')
+
+    def handle(self, *args, **options):
+        for members in options['members'] or [50, 200, 1000]:
+            with rolled_back():
+                guild = create_sample_guild(members, seed=members)
+                war = create_sample_war(guild)
+
+                def generate():
+                    War.objects.get(id=war.id).generate_attendance()
+
+                with rolled_back(), CaptureQueriesContext(connection) as queries:
+                    generate()
+
+                print("{0} members".format(members))
+                print("  generate_attendance: {0}, {1} queries".format(format_timings(measure(generate,
+                                                                                                  options['repeat'])),
+                                                                       len(queries)))
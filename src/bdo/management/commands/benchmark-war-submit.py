@@ -0,0 +1,50 @@
+from django.core.management import BaseCommand
+
+from api.serializers.war import WarSubmitSerializer
+from bdo.aggregates import increment_aggregates
+from bdo.models.character import Profile
+from bdo.models.stats import AggregatedGuildMemberWarStats
+from bdo.models.war import War, WarStat
+from bdo.sample_data import create_sample_guild, create_sample_war, format_timings, measure, rolled_back
+
+
+class Command(BaseCommand):
+    help = 'Time war submissions and their aggregate updates on synthetic guilds. Nothing is kept.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attendees', type=int, action='append', dest='attendees',
+                            help='Number of attendees in the submission. Can be repeated, defaults to 30, 100 and 200.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of timed runs per size.')
+
+    def get_stats(self, war):
+        # Every tenth attendee did not show up
+        return [
+            dict({field: index % 7 for field in WarStat.STAT_FIELDS},
+                 attended=index % 10 != 0,
+                 user_profile=profile,
+                 attendance=None)
+            for index, profile in enumerate(Profile.objects.filter(attendance_set__war=war))
+        ]
+
+    def handle(self, *args, **options):
+        for attendees in options['attendees'] or [30, 100, 200]:
+            with rolled_back():
+                guild = create_sample_guild(attendees, seed=attendees)
+                war = create_sample_war(guild, attendee_count=attendees)
+                stats = self.get_stats(war)
+
+                def submit():
+                    # create() pops fields from the stats
+                    serializer = WarSubmitSerializer(context={'war': War.objects.get(id=war.id)})
+                    serializer.create({'outcome': War.Outcome.WIN.value, 'stats': [dict(stat) for stat in stats]})
+
+                def increment():
+                    increment_aggregates(AggregatedGuildMemberWarStats, {
+                        profile_id: {field: 1 for field in WarStat.STAT_FIELDS}
+                        for profile_id in war.attendance_set.values_list('user_profile_id', flat=True)
+                    }, guild_id=guild.id)
+
+                print("{0} attendees".format(attendees))
+                print("  submission: {0}".format(format_timings(measure(submit, options['repeat']))))
+                print("  increment_aggregates: {0}".format(format_timings(measure(increment, options['repeat']))))
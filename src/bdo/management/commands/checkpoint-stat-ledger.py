@@ -0,0 +1,29 @@
+from django.core.management import BaseCommand
+from django.db.transaction import atomic
+
+from bdo.ledger import checkpoint_ledger, get_committed_entry_id
+from bdo.models.stats import WarStatLedgerEntry
+
+
+class Command(BaseCommand):
+    help = 'Write stat ledger checkpoints for every guild member. Run it periodically, entries are not ' \
+           'checkpointed when they are written.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of guild members checkpointed per transaction.')
+
+    def handle(self, *args, **options):
+        up_to_id = get_committed_entry_id()
+        keys = list(WarStatLedgerEntry.objects.filter(id__lte=up_to_id)
+                                              .order_by('guild_id', 'user_profile_id')
+                                              .values_list('guild_id', 'user_profile_id')
+                                              .distinct())
+        batch_size = options['batch_size']
+        checkpoints = 0
+
+        for start in range(0, len(keys), batch_size):
+            with atomic():
+                checkpoints += checkpoint_ledger(up_to_id, keys[start:start + batch_size])
+
+        print("Wrote {0} ledger checkpoints".format(checkpoints))
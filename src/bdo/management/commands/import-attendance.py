@@ -6,6 +6,8 @@ from pytz import timezone
 from django.core.management import BaseCommand, CommandError
 from django.db.transaction import atomic
 
+from bdo.aggregates import AggregateBatch, mark_attendance_changed
+from bdo.ledger import get_attendance_deltas, get_ledger_entry, record_ledger_entries
 from bdo.models.character import Profile
 from bdo.models.guild import Guild
 from bdo.models.war import War, WarAttendance, WarStat
@@ -97,6 +99,19 @@ class Command(BaseCommand):
 
                 attendance.extend(self.parse_row(row, wars))
 
-        WarAttendance.objects.bulk_create(attendance)
+        with atomic(), AggregateBatch():
+            WarAttendance.objects.bulk_create(attendance)
+
+            # bulk_create skips the signal handlers
+            for profile_id in set(entry.user_profile_id for entry in attendance):
+                mark_attendance_changed(guild.id, profile_id)
+
+            record_ledger_entries([
+                get_ledger_entry(guild.id,
+                                 entry.user_profile_id,
+                                 get_attendance_deltas(entry.war, None, entry.is_attending),
+                                 war_id=entry.war_id)
+                for entry in attendance
+            ])
 
         print("Created {0} attendance entries".format(len(attendance)))
@@ -6,6 +6,8 @@ from pytz import timezone
 from django.core.management import BaseCommand, CommandError
 from django.db.transaction import atomic
 
+from bdo.aggregates import AggregateBatch, mark_stats_changed
+from bdo.ledger import get_ledger_entry, record_ledger_entries
 from bdo.models.character import Profile
 from bdo.models.guild import Guild
 from bdo.models.war import War, WarAttendance, WarStat
@@ -79,7 +81,7 @@ class Command(BaseCommand):
         for csv_file in options.get('stats_csv'):
             stats = []
 
-            with open(csv_file) as f, atomic():
+            with open(csv_file) as f, atomic(), AggregateBatch():
                 reader = csv.reader(f)
                 # Skip header
                 next(reader, None)
@@ -98,6 +100,18 @@ class Command(BaseCommand):
                         continue
                     stats.append(self.parse_row(*row, war=war_obj))
 
+                # bulk_create skips the signal handlers
+                ledger_entries = []
+
+                for stat in stats:
+                    deltas = stat.get_stat_deltas()
+                    mark_stats_changed(guild.id, stat.attendance.user_profile_id, deltas, war_obj.date)
+                    ledger_entries.append(get_ledger_entry(guild.id,
+                                                           stat.attendance.user_profile_id,
+                                                           deltas,
+                                                           war_id=war_obj.id))
+
                 WarStat.objects.bulk_create(stats)
+                record_ledger_entries(ledger_entries)
 
                 print("Recorded {0} stats for war on {1}".format(len(stats), self.get_date_from_file(csv_file)))
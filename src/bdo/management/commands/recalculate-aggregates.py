@@ -1,19 +1,113 @@
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.management import BaseCommand
+from django.db import connections
+from django.db.transaction import atomic
 
-from bdo.models.stats import (AggregatedGuildMemberWarStats,
+from bdo.aggregates import rebuild_aggregates, rebuild_rollups
+from bdo.guild_summary import rebuild_guild_summaries
+from bdo.models.character import Profile
+from bdo.models.guild import Guild, GuildMember, GuildSummary
+from bdo.models.stats import (ROLLUP_MODELS,
+                              AggregatedGuildMemberWarStats,
                               AggregatedGuildWarStats,
                               AggregatedUserWarStats)
+from bdo.models.war import WarAttendance
 
 
 class Command(BaseCommand):
     help = 'Re-calculate aggregate tables'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--guild', type=int, action='append', dest='guilds',
+                            help='Only re-calculate aggregates of this guild id. Can be repeated.')
+        parser.add_argument('--profile', type=int, action='append', dest='profiles',
+                            help='Only re-calculate aggregates of this profile id. Can be repeated.')
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help='Number of guilds or profiles re-calculated per transaction.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of chunks re-calculated in parallel.')
+
+    def get_chunks(self, ids, chunk_size):
+        if ids is None:
+            return [None]
+
+        return [ids[index:index + chunk_size] for index in range(0, len(ids), chunk_size)]
+
+    def get_jobs(self, guild_ids, profile_ids, chunk_size):
+        jobs = []
+
+        if profile_ids is None:
+            if guild_ids is None:
+                guild_ids = list(Guild.objects.order_by('id').values_list('id', flat=True))
+                user_profile_ids = list(Profile.objects.order_by('id').values_list('id', flat=True))
+            else:
+                # User totals span guilds, every profile seen in the guilds is re-calculated
+                user_profile_ids = sorted(
+                    set(GuildMember.objects.filter(guild_id__in=guild_ids).values_list('user_id', flat=True)) |
+                    set(WarAttendance.objects.filter(war__guild_id__in=guild_ids, user_profile__isnull=False)
+                                             .values_list('user_profile_id', flat=True))
+                )
+
+            # Guild totals are only re-calculated when every member is in scope
+            for chunk in self.get_chunks(guild_ids, chunk_size):
+                jobs.append((AggregatedGuildWarStats, chunk, None))
+                jobs.append((GuildSummary, chunk, None))
+        else:
+            user_profile_ids = profile_ids
+
+        for chunk in self.get_chunks(guild_ids, chunk_size):
+            jobs.append((AggregatedGuildMemberWarStats, chunk, profile_ids))
+
+            for model in ROLLUP_MODELS:
+                jobs.append((model, chunk, profile_ids))
+        for chunk in self.get_chunks(user_profile_ids, chunk_size):
+            jobs.append((AggregatedUserWarStats, None, chunk))
+
+        return jobs
+
+    def run_job(self, job):
+        model, guild_ids, profile_ids = job
+        rebuild = rebuild_rollups if model in ROLLUP_MODELS else rebuild_aggregates
+        start = time.time()
+
+        try:
+            with atomic():
+                if model is GuildSummary:
+                    rows = rebuild_guild_summaries(guild_ids=guild_ids)
+                else:
+                    rows = rebuild(model, guild_ids=guild_ids, profile_ids=profile_ids)
+        finally:
+            if self.workers > 1:
+                # Worker threads open their own connections
+                connections.close_all()
+
+        return model, rows, time.time() - start
+
     def handle(self, *args, **options):
-        for stat in AggregatedGuildMemberWarStats.objects.all():
-            stat.recalculate()
-        for stat in AggregatedGuildWarStats.objects.all():
-            stat.recalculate()
-        for stat in AggregatedUserWarStats.objects.all():
-            stat.recalculate()
-
-        print("Re-calculated all aggregate tables")
+        self.workers = max(options['workers'], 1)
+        start = time.time()
+        jobs = self.get_jobs(options['guilds'], options['profiles'], max(options['chunk_size'], 1))
+
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(self.run_job, jobs))
+        else:
+            results = [self.run_job(job) for job in jobs]
+
+        report = defaultdict(lambda: {'chunks': 0, 'rows': 0, 'seconds': 0.0})
+
+        for model, rows, seconds in results:
+            report[model.__name__]['chunks'] += 1
+            report[model.__name__]['rows'] += rows
+            report[model.__name__]['seconds'] += seconds
+
+        for name, timing in sorted(report.items()):
+            print("{0}: {1} rows in {2} chunks, {3:.2f}s".format(name,
+                                                                 timing['rows'],
+                                                                 timing['chunks'],
+                                                                 timing['seconds']))
+
+        print("Re-calculated all aggregate tables in {0:.2f}s".format(time.time() - start))
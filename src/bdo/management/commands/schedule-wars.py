@@ -0,0 +1,38 @@
+import time
+
+from django.core.management import BaseCommand
+
+from bdo.models.guild import Guild
+from bdo.war_scheduler import schedule_wars
+
+
+class Command(BaseCommand):
+    help = 'Create the upcoming wars of every guild'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7,
+                            help='Number of days to schedule wars for.')
+        parser.add_argument('--guild', type=int, action='append', dest='guilds',
+                            help='Only schedule wars of this guild id. Can be repeated.')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of guilds scheduled per transaction.')
+        parser.add_argument('--no-setup', action='store_false', dest='use_last_setup',
+                            help="Don't copy the teams and call signs of each guild's last war.")
+
+    def handle(self, *args, **options):
+        start = time.time()
+        guilds = Guild.objects.select_related('region').order_by('id')
+        batch_size = max(options['batch_size'], 1)
+        created = 0
+
+        if options['guilds']:
+            guilds = guilds.filter(id__in=options['guilds'])
+
+        guilds = list(guilds)
+
+        for index in range(0, len(guilds), batch_size):
+            created += len(schedule_wars(guilds[index:index + batch_size],
+                                         options['days'],
+                                         use_last_setup=options['use_last_setup']))
+
+        print("Scheduled {0} wars for {1} guilds in {2:.2f}s".format(created, len(guilds), time.time() - start))
@@ -47,5 +47,6 @@ class Command(BaseCommand):
 
         old_profile.save()
         new_profile.save()
+        Profile.refresh_main([old_profile.id, new_profile.id])
 
         logger.info("Migrated {0} to {1}".format(old_family_name, new_family_name))
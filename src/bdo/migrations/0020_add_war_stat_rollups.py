@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2018-08-02 21:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+POPULATE_ROLLUP_SQL = """
+INSERT INTO {table} (guild_id, user_profile_id, bucket, command_post, fort, gate, help, mount, placed_objects,
+                     guild_master, officer, member, death, siege_weapons, total_kills)
+SELECT war.guild_id, attendance.user_profile_id, date_trunc('{unit}', war.date AT TIME ZONE 'UTC')::date,
+       SUM(stat.command_post), SUM(stat.fort), SUM(stat.gate), SUM(stat.help), SUM(stat.mount),
+       SUM(stat.placed_objects), SUM(stat.guild_master), SUM(stat.officer), SUM(stat.member), SUM(stat.death),
+       SUM(stat.siege_weapons), SUM(stat.guild_master + stat.officer + stat.member + stat.siege_weapons)
+FROM bdo_warstat stat
+JOIN bdo_warattendance attendance ON attendance.id = stat.attendance_id
+JOIN bdo_war war ON war.id = attendance.war_id
+WHERE attendance.user_profile_id IS NOT NULL
+GROUP BY 1, 2, 3
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bdo', '0019_add_customizable_war_reminder_field'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyWarStatRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command_post', models.IntegerField(default=0)),
+                ('fort', models.IntegerField(default=0)),
+                ('gate', models.IntegerField(default=0)),
+                ('help', models.IntegerField(default=0)),
+                ('mount', models.IntegerField(default=0)),
+                ('placed_objects', models.IntegerField(default=0)),
+                ('guild_master', models.IntegerField(default=0)),
+                ('officer', models.IntegerField(default=0)),
+                ('member', models.IntegerField(default=0)),
+                ('death', models.IntegerField(default=0)),
+                ('siege_weapons', models.IntegerField(default=0)),
+                ('total_kills', models.IntegerField(default=0)),
+                ('bucket', models.DateField()),
+                ('guild', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to='bdo.Guild')),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to='bdo.Profile')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlywarstatrollup',
+            unique_together=set([('guild', 'user_profile', 'bucket')]),
+        ),
+        migrations.CreateModel(
+            name='WeeklyWarStatRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command_post', models.IntegerField(default=0)),
+                ('fort', models.IntegerField(default=0)),
+                ('gate', models.IntegerField(default=0)),
+                ('help', models.IntegerField(default=0)),
+                ('mount', models.IntegerField(default=0)),
+                ('placed_objects', models.IntegerField(default=0)),
+                ('guild_master', models.IntegerField(default=0)),
+                ('officer', models.IntegerField(default=0)),
+                ('member', models.IntegerField(default=0)),
+                ('death', models.IntegerField(default=0)),
+                ('siege_weapons', models.IntegerField(default=0)),
+                ('total_kills', models.IntegerField(default=0)),
+                ('bucket', models.DateField()),
+                ('guild', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_stats', to='bdo.Guild')),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_stats', to='bdo.Profile')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='weeklywarstatrollup',
+            unique_together=set([('guild', 'user_profile', 'bucket')]),
+        ),
+        migrations.RunSQL(POPULATE_ROLLUP_SQL.format(table='bdo_weeklywarstatrollup', unit='week'),
+                          migrations.RunSQL.noop),
+        migrations.RunSQL(POPULATE_ROLLUP_SQL.format(table='bdo_monthlywarstatrollup', unit='month'),
+                          migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2018-08-05 16:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+# Seed the ledger with one entry per war and member, dated at the war
+POPULATE_LEDGER_SQL = """
+INSERT INTO bdo_warstatledgerentry (guild_id, user_profile_id, war_id, created, command_post, fort, gate, help,
+                                    mount, placed_objects, guild_master, officer, member, death, siege_weapons,
+                                    total_kills, wars_attended, wars_unavailable, wars_missed, wars_reneged)
+SELECT war.guild_id, attendance.user_profile_id, war.id, war.date,
+       COALESCE(stat.command_post, 0), COALESCE(stat.fort, 0), COALESCE(stat.gate, 0), COALESCE(stat.help, 0),
+       COALESCE(stat.mount, 0), COALESCE(stat.placed_objects, 0), COALESCE(stat.guild_master, 0),
+       COALESCE(stat.officer, 0), COALESCE(stat.member, 0), COALESCE(stat.death, 0),
+       COALESCE(stat.siege_weapons, 0),
+       COALESCE(stat.guild_master + stat.officer + stat.member + stat.siege_weapons, 0),
+       CASE WHEN war.outcome IS NOT NULL AND attendance.is_attending IN (0, 4) THEN 1 ELSE 0 END,
+       CASE WHEN war.outcome IS NOT NULL AND attendance.is_attending = 1 THEN 1 ELSE 0 END,
+       CASE WHEN war.outcome IS NOT NULL AND attendance.is_attending IN (3, 5) THEN 1 ELSE 0 END,
+       CASE WHEN war.outcome IS NOT NULL AND attendance.is_attending = 5 THEN 1 ELSE 0 END
+FROM bdo_warattendance attendance
+JOIN bdo_war war ON war.id = attendance.war_id
+LEFT JOIN bdo_warstat stat ON stat.attendance_id = attendance.id
+WHERE attendance.user_profile_id IS NOT NULL AND (war.outcome IS NOT NULL OR stat.id IS NOT NULL)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bdo', '0020_add_war_stat_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WarStatLedgerCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command_post', models.IntegerField(default=0)),
+                ('fort', models.IntegerField(default=0)),
+                ('gate', models.IntegerField(default=0)),
+                ('help', models.IntegerField(default=0)),
+                ('mount', models.IntegerField(default=0)),
+                ('placed_objects', models.IntegerField(default=0)),
+                ('guild_master', models.IntegerField(default=0)),
+                ('officer', models.IntegerField(default=0)),
+                ('member', models.IntegerField(default=0)),
+                ('death', models.IntegerField(default=0)),
+                ('siege_weapons', models.IntegerField(default=0)),
+                ('total_kills', models.IntegerField(default=0)),
+                ('wars_attended', models.IntegerField(default=0)),
+                ('wars_unavailable', models.IntegerField(default=0)),
+                ('wars_missed', models.IntegerField(default=0)),
+                ('wars_reneged', models.IntegerField(default=0)),
+                ('created', models.DateTimeField()),
+                ('guild', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bdo.Guild')),
+                ('user_profile', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bdo.Profile')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WarStatLedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command_post', models.IntegerField(default=0)),
+                ('fort', models.IntegerField(default=0)),
+                ('gate', models.IntegerField(default=0)),
+                ('help', models.IntegerField(default=0)),
+                ('mount', models.IntegerField(default=0)),
+                ('placed_objects', models.IntegerField(default=0)),
+                ('guild_master', models.IntegerField(default=0)),
+                ('officer', models.IntegerField(default=0)),
+                ('member', models.IntegerField(default=0)),
+                ('death', models.IntegerField(default=0)),
+                ('siege_weapons', models.IntegerField(default=0)),
+                ('total_kills', models.IntegerField(default=0)),
+                ('wars_attended', models.IntegerField(default=0)),
+                ('wars_unavailable', models.IntegerField(default=0)),
+                ('wars_missed', models.IntegerField(default=0)),
+                ('wars_reneged', models.IntegerField(default=0)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('guild', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bdo.Guild')),
+                ('user_profile', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bdo.Profile')),
+                ('war', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='bdo.War')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='warstatledgercheckpoint',
+            unique_together=set([('guild', 'user_profile', 'created')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='warstatledgerentry',
+            index_together=set([('guild', 'user_profile', 'created')]),
+        ),
+        migrations.RunSQL(POPULATE_LEDGER_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2018-08-09 20:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+POPULATE_RECENT_WARS_SQL = """
+UPDATE bdo_aggregateduserwarstats AS aggregate SET (recent_wars, recent_reneges) = (
+    SELECT COUNT(*), COALESCE(SUM(CASE WHEN recent.is_attending = 5 THEN 1 << (recent.position - 1)::integer ELSE 0 END), 0)
+    FROM (
+        SELECT attendance.is_attending, ROW_NUMBER() OVER (ORDER BY war.date DESC, war.id DESC) AS position
+        FROM bdo_warattendance attendance
+        JOIN bdo_war war ON war.id = attendance.war_id
+        WHERE attendance.user_profile_id = aggregate.user_profile_id
+          AND war.outcome IS NOT NULL
+          AND attendance.is_attending IN (0, 4, 5)
+        ORDER BY war.date DESC, war.id DESC
+        LIMIT 5
+    ) recent
+)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bdo', '0021_add_war_stat_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aggregateduserwarstats',
+            name='recent_reneges',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='aggregateduserwarstats',
+            name='recent_wars',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(POPULATE_RECENT_WARS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2018-08-12 15:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+POPULATE_ATTENDANCE_RATE_SQL = """
+UPDATE {table} SET attendance_rate = CASE
+    WHEN wars_attended + wars_unavailable + wars_missed = 0 THEN 0.0
+    ELSE (wars_attended + wars_unavailable * 0.5) / (wars_attended + wars_unavailable + wars_missed)
+END
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bdo', '0022_add_recent_war_window'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aggregatedguildmemberwarstats',
+            name='attendance_rate',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='aggregateduserwarstats',
+            name='attendance_rate',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunSQL(POPULATE_ATTENDANCE_RATE_SQL.format(table='bdo_aggregatedguildmemberwarstats'),
+                          migrations.RunSQL.noop),
+        migrations.RunSQL(POPULATE_ATTENDANCE_RATE_SQL.format(table='bdo_aggregateduserwarstats'),
+                          migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'command_post'], name='bdo_member_command_post_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'fort'], name='bdo_member_fort_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'gate'], name='bdo_member_gate_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'help'], name='bdo_member_help_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'mount'], name='bdo_member_mount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'placed_objects'], name='bdo_member_placed_objects_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'guild_master'], name='bdo_member_guild_master_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'officer'], name='bdo_member_officer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'member'], name='bdo_member_member_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'death'], name='bdo_member_death_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'siege_weapons'], name='bdo_member_siege_weapons_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'total_kills'], name='bdo_member_total_kills_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'kdr'], name='bdo_member_kdr_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedguildmemberwarstats',
+            index=models.Index(fields=['guild', 'attendance_rate'], name='bdo_member_attendance_rate_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2018-08-12 18:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bdo', '0023_store_attendance_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='war',
+            name='version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
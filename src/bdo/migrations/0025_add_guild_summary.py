@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2018-08-14 19:27
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+POPULATE_GUILD_SUMMARY_SQL = """
+INSERT INTO bdo_guildsummary (guild_id, member_count, main_count, level_total, gearscore_total, class_distribution)
+SELECT guild.id, COALESCE(members.total, 0), COALESCE(totals.main_count, 0), COALESCE(totals.level_total, 0),
+       COALESCE(totals.gearscore_total, 0), COALESCE(classes.class_distribution, '{}'::jsonb)
+FROM bdo_guild guild
+LEFT JOIN (
+    SELECT guild_id, COUNT(*) AS total FROM bdo_guildmember GROUP BY guild_id
+) members ON members.guild_id = guild.id
+LEFT JOIN (
+    SELECT member.guild_id, COUNT(*) AS main_count, SUM(main.level) AS level_total,
+           SUM((main.ap + main.aap) / 2.0 + main.dp + profile.npc_renown) AS gearscore_total
+    FROM bdo_guildmember member
+    JOIN bdo_character main ON main.profile_id = member.user_id AND main.is_main
+    JOIN bdo_profile profile ON profile.id = member.user_id
+    GROUP BY member.guild_id
+) totals ON totals.guild_id = guild.id
+LEFT JOIN (
+    SELECT guild_id, jsonb_object_agg(class_name, total) AS class_distribution
+    FROM (
+        SELECT member.guild_id, LOWER(character_class.name) AS class_name, COUNT(*) AS total
+        FROM bdo_guildmember member
+        JOIN bdo_character main ON main.profile_id = member.user_id AND main.is_main
+        JOIN bdo_characterclass character_class ON character_class.id = main.character_class_id
+        GROUP BY 1, 2
+    ) counts
+    GROUP BY guild_id
+) classes ON classes.guild_id = guild.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bdo', '0024_add_war_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GuildSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member_count', models.IntegerField(default=0)),
+                ('main_count', models.IntegerField(default=0)),
+                ('level_total', models.IntegerField(default=0)),
+                ('gearscore_total', models.FloatField(default=0)),
+                ('class_distribution', django.contrib.postgres.fields.jsonb.JSONField(default={})),
+                ('guild', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='bdo.Guild')),
+            ],
+        ),
+        migrations.RunSQL(POPULATE_GUILD_SUMMARY_SQL, migrations.RunSQL.noop),
+    ]
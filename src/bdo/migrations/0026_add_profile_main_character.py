@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2018-08-16 21:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+POPULATE_PROFILE_MAIN_SQL = """
+UPDATE bdo_profile profile
+SET main_character_id = main.id,
+    main_name = main.name,
+    main_level = main.level,
+    main_class_name = main.class_name,
+    main_gearscore = (main.ap + main.aap) / 2.0 + main.dp + profile.npc_renown
+FROM (
+    SELECT DISTINCT ON (main.profile_id) main.profile_id, main.id, main.name, main.level, main.ap, main.aap, main.dp,
+           character_class.name AS class_name
+    FROM bdo_character main
+    JOIN bdo_characterclass character_class ON character_class.id = main.character_class_id
+    WHERE main.is_main
+    ORDER BY main.profile_id, main.id
+) main
+WHERE main.profile_id = profile.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bdo', '0025_add_guild_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='main_character',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='bdo.Character'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='main_class_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='main_gearscore',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='main_level',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='main_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['main_level'], name='bdo_profile_main_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['main_class_name'], name='bdo_profile_main_class_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['main_gearscore'], name='bdo_profile_main_gs_idx'),
+        ),
+        migrations.RunSQL(POPULATE_PROFILE_MAIN_SQL, migrations.RunSQL.noop),
+    ]
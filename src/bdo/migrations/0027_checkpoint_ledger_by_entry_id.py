@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2018-08-18 14:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bdo', '0026_add_profile_main_character'),
+    ]
+
+    operations = [
+        # Checkpoints taken by creation time may have skipped late commits, the command writes them again
+        migrations.RunSQL('DELETE FROM bdo_warstatledgercheckpoint', migrations.RunSQL.noop),
+        migrations.AlterUniqueTogether(
+            name='warstatledgercheckpoint',
+            unique_together=set([]),
+        ),
+        migrations.AddField(
+            model_name='warstatledgercheckpoint',
+            name='last_entry_id',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AlterUniqueTogether(
+            name='warstatledgercheckpoint',
+            unique_together=set([('guild', 'user_profile', 'last_entry_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='warstatledgerentry',
+            index_together=set([('guild', 'user_profile', 'created'), ('guild', 'user_profile', 'id')]),
+        ),
+    ]
@@ -1,12 +1,10 @@
 from logging import getLogger
-from datetime import datetime
 
-import pytz
 from django.contrib.postgres.fields import JSONField
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connections, models
 from bdo.models.content import CharacterClass
 from bdo.models.mixins import UserPermissionMixin
 from bdo.models.stats import AggregatedGuildMemberWarStats
@@ -37,17 +35,71 @@ class Profile(models.Model, UserPermissionMixin):
     npc_renown = models.IntegerField(default=0, validators=(MinValueValidator(0), MaxValueValidator(5)))
     region = models.ForeignKey("Region", null=True)
 
+    # Copy of the main character, maintained by refresh_main
+    main_character = models.ForeignKey("Character", null=True, blank=True, on_delete=models.SET_NULL,
+                                       related_name='+')
+    main_name = models.CharField(max_length=255, default='', blank=True)
+    main_level = models.IntegerField(default=0)
+    main_class_name = models.CharField(max_length=255, default='', blank=True)
+    main_gearscore = models.FloatField(default=0)
+
+    MAIN_FIELDS = ('main_character', 'main_name', 'main_level', 'main_class_name', 'main_gearscore')
+
     class Meta:
         ordering = ('id',)
         unique_together = ('user', 'region')
+        indexes = [
+            models.Index(fields=['main_level'], name='bdo_profile_main_level_idx'),
+            models.Index(fields=['main_class_name'], name='bdo_profile_main_class_idx'),
+            models.Index(fields=['main_gearscore'], name='bdo_profile_main_gs_idx'),
+        ]
 
     def __str__(self):
-        main = self.get_main()
-
-        if main is None:
+        if self.main_character_id is None:
             return self.family_name
 
-        return u'{0} ({1})'.format(self.family_name, main.name)
+        return u'{0} ({1})'.format(self.family_name, self.main_name)
+
+    @staticmethod
+    def refresh_main(profile_ids, using='default'):
+        """
+        Copy the main character of the profiles to their main columns with one UPDATE.
+
+        The main is the first main character by id, same as get_main. The same statement bumps the
+        roster version of the unfinished wars the profiles attend, see War.bump_profile_versions.
+        """
+        from bdo.models.war import War, WarAttendance
+
+        tables = {
+            'profile': Profile._meta.db_table,
+            'character': Character._meta.db_table,
+            'class': CharacterClass._meta.db_table,
+            'war': War._meta.db_table,
+            'attendance': WarAttendance._meta.db_table,
+        }
+        sql = (
+            'WITH refreshed AS ('
+            ' UPDATE {profile} profile SET main_character_id = main.id, main_name = COALESCE(main.name, \'\'),'
+            ' main_level = COALESCE(main.level, 0), main_class_name = COALESCE(main.class_name, \'\'),'
+            ' main_gearscore = COALESCE({gearscore}, 0)'
+            ' FROM {profile} target LEFT JOIN LATERAL ('
+            '  SELECT main.id, main.name, main.level, main.ap, main.aap, main.dp, character_class.name AS class_name'
+            '  FROM {character} main JOIN {class} character_class ON character_class.id = main.character_class_id'
+            '  WHERE main.profile_id = target.id AND main.is_main'
+            '  ORDER BY main.id LIMIT 1'
+            ' ) main ON TRUE'
+            ' WHERE profile.id = target.id AND target.id = ANY(%s)'
+            ' RETURNING profile.id'
+            ')'
+            ' UPDATE {war} war SET version = war.version + 1'
+            ' WHERE war.outcome IS NULL AND war.id IN ('
+            '  SELECT attendance.war_id FROM {attendance} attendance'
+            '  JOIN refreshed ON refreshed.id = attendance.user_profile_id'
+            ' )'
+        ).format(gearscore=Character.get_gearscore_sql('main', 'profile'), **tables)
+
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, [list(profile_ids)])
 
     def user_can_edit(self, user):
         # Only the owner or a superuser can edit the profile
@@ -79,6 +131,14 @@ class Profile(models.Model, UserPermissionMixin):
     def save(self, *args, **kwargs):
         self.full_clean()
 
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Never write back stale main columns
+            kwargs['update_fields'] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MAIN_FIELDS
+            ]
+
         super(Profile, self).save(*args, **kwargs)
 
     def refresh_guilds(self):
@@ -130,43 +190,14 @@ class Profile(models.Model, UserPermissionMixin):
 
     @property
     def has_main(self):
-        return self.get_main() is not None
+        return self.main_character_id is not None
 
     @property
     def renege_rate(self):
         """
         Likelihood for user to flake out and not actually attend a war they signed up for.
-
-        Percentage is a combination of historical flake out rate and recent flake out rate
-        with a bigger skew towards recent flake outs.
         """
-        stats = self.user_stats
-        historical_wars_attended = stats.wars_attended + stats.wars_reneged
-
-        if historical_wars_attended == 0:
-            historical_renege_rate = 0.0
-        else:
-            historical_renege_rate = stats.wars_reneged * 1.0 / (stats.wars_attended + stats.wars_reneged)
-
-        # Use up to last 5 wars
-        if hasattr(self, '_prefetched_recent_wars'):
-            recent_wars = self._prefetched_recent_wars[:5]
-        else:
-            recent_wars = self.attendance_set.filter(is_attending__in=[0, 4, 5]).order_by('-war__date')[:5]
-        recent_attended = 0
-        recent_reneged = 0
-
-        for attendance in recent_wars:
-            if attendance.is_attending == 5:
-                recent_reneged += 1
-            recent_attended += 1
-
-        if recent_attended == 0:
-            recent_renege_rate = 0.0
-        else:
-            recent_renege_rate = recent_reneged * 1.0 / recent_attended
-
-        return (historical_renege_rate * 0.3) + (recent_renege_rate * 0.7)
+        return self.user_stats.renege_rate
 
     def guild_attendance_rate(self, guild):
         """
@@ -177,24 +208,10 @@ class Profile(models.Model, UserPermissionMixin):
         except AggregatedGuildMemberWarStats.DoesNotExist:
             return 0.0
 
-        total_wars = stats.wars_attended + stats.wars_unavailable + stats.wars_missed
-        attendance_score = stats.wars_attended + (stats.wars_unavailable * 0.5)
-
-        if total_wars == 0:
-            return 0.0
-
-        return attendance_score / total_wars
+        return stats.attendance_rate
 
     def get_availability(self, date):
-        # Convert the date to the correct timezone
-        timezone = pytz.timezone(self.region.timezone)
-
-        if date.tzinfo is None:
-            localized_date = timezone.localize(date)
-        else:
-            localized_date = date.astimezone(timezone)
-
-        day = datetime.strftime(localized_date, '%A')
+        day = self.region.get_weekday(date)
 
         if not self.has_main or not self.auto_sign_up:
             return self.DEFAULT_AVAILABILITY_STATUS
@@ -218,6 +235,21 @@ class Character(models.Model, UserPermissionMixin):
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def get_gearscore(ap, aap, dp, npc_renown):
+        # The profile's NPC renown counts towards the gearscore
+        return (ap + aap) / 2 + dp + npc_renown
+
+    @staticmethod
+    def get_gearscore_sql(character=None, profile=None):
+        """
+        get_gearscore as SQL, over the columns of the character and profile table aliases.
+        """
+        character = '{0}.'.format(character) if character else ''
+        profile = '{0}.'.format(profile) if profile else ''
+
+        return '({0}ap + {0}aap) / 2.0 + {0}dp + {1}npc_renown'.format(character, profile)
+
     def user_can_edit(self, user):
         # Only the owner or a superuser can edit the profile
         return user.is_superuser or user == self.profile.user
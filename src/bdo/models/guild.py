@@ -1,13 +1,20 @@
+from datetime import datetime, timezone
+
 from dirtyfields import DirtyFieldsMixin
 from django.contrib.auth.models import Group
 from django.contrib.postgres.fields import JSONField
 from django.db import models
-from django.db.models import Q, Avg, F, Case, Count, When
+from django.db.models import Q, Avg, F, Case, Count, Exists, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Now
 
-from bdo.models.character import Character
+from bdo.models.character import Character, Profile
+from bdo.models.stats import BaseWarStatRollup
 from bdo.models.war import War, WarRole
 
 
+# Gearscore of a main character, see GuildMember.main_character
+GEARSCORE_EXPRESSION = (F('aap') + F('ap'))/2 + F('dp') + F('profile__npc_renown')
+
 WAR_REMINDER_CHOICES = (
     (60, '60min before'),
     (30, '30min before'),
@@ -68,38 +75,107 @@ class Guild(DirtyFieldsMixin, models.Model):
     def __str__(self):
         return self.name
 
-    def pending_war(self):
-        war = War.objects.filter(guild=self).order_by('-date', '-id').first()
+    @staticmethod
+    def annotate_list(queryset, profile=None):
+        """
+        Annotate the fields of the guild list as subqueries, so a page of guilds is one query.
+
+        ``profile`` is the user the pending wars are shown to, they need the view_war permission.
+        Member counts and averages are read from the joined GuildSummary.
+        """
+        def subquery(qs):
+            return Subquery(qs[:1])
+
+        upcoming_war, unfinished_war = Guild.get_pending_war_candidates(OuterRef('pk'), Now())
+        guild_master = GuildMember.objects.filter(guild=OuterRef('pk'), role__name="Guild Master")
+        annotations = {
+            '_pending_war_id': Coalesce(subquery(upcoming_war.values('id')), subquery(unfinished_war.values('id'))),
+            '_guild_master_id': subquery(guild_master.values('user_id')),
+            '_guild_master_family_name': subquery(guild_master.values('user__family_name')),
+        }
 
-        if war is not None and war.outcome is None:
-            return war.id
+        if profile is not None:
+            annotations['_can_view_war'] = Exists(GuildMember.objects.filter(guild=OuterRef('pk'),
+                                                                             user=profile,
+                                                                             role__permissions__codename='view_war'))
         else:
+            annotations['_can_view_war'] = Value(False, output_field=models.BooleanField())
+
+        return queryset.select_related('summary').annotate(**annotations)
+
+    def get_summary(self):
+        try:
+            return self.summary
+        except GuildSummary.DoesNotExist:
             return None
 
+    @staticmethod
+    def get_pending_war_candidates(guild, now):
+        """
+        Earliest upcoming war without an outcome, and the latest war without an outcome as a fallback.
+
+        Wars can be scheduled ahead of time, an abandoned war is passed over once a newer one exists.
+        """
+        unfinished_wars = War.objects.filter(guild=guild, outcome__isnull=True)
+
+        return (unfinished_wars.filter(date__gte=now).order_by('date', 'id'),
+                unfinished_wars.order_by('-date', '-id'))
+
+    def pending_war(self):
+        if hasattr(self, '_pending_war_id'):
+            # Annotated by annotate_list
+            return self._pending_war_id
+
+        for wars in Guild.get_pending_war_candidates(self, datetime.now(tz=timezone.utc)):
+            war_id = wars.values_list('id', flat=True).first()
+
+            if war_id is not None:
+                return war_id
+
+        return None
+
     @property
     def war_roles(self):
         return WarRole.objects.filter(Q(custom_for__isnull=True) | Q(custom_for=self))
 
     @property
     def guild_master(self):
-            return self.membership.get(role__name="Guild Master").user
+        if hasattr(self, '_guild_master_id'):
+            # Annotated by annotate_list
+            return Profile(id=self._guild_master_id, family_name=self._guild_master_family_name)
+
+        return self.membership.get(role__name="Guild Master").user
 
     @property
     def average_level(self):
+        summary = self.get_summary()
+
+        if summary is not None:
+            return summary.average_level
+
         guild_characters = Character.objects.filter(is_main=True, profile__membership__guild=self)
 
         return guild_characters.aggregate(Avg('level'))['level__avg']
 
     @property
     def average_renown(self):
+        summary = self.get_summary()
+
+        if summary is not None:
+            return summary.average_renown
+
         guild_characters = Character.objects.filter(is_main=True, profile__membership__guild=self)
-        gearscore_expression = (F('aap') + F('ap'))/2 + F('dp') + F('profile__npc_renown')
 
-        return (guild_characters.annotate(gearscore=gearscore_expression)
+        return (guild_characters.annotate(gearscore=GEARSCORE_EXPRESSION)
                                 .aggregate(Avg('gearscore'))['gearscore__avg'])
 
     @property
     def class_distribution(self):
+        summary = self.get_summary()
+
+        if summary is not None:
+            return summary.get_class_distribution()
+
         guild_characters = Character.objects.filter(is_main=True, profile__membership__guild=self)
         distributions = (guild_characters.values('character_class__name')
                                          .annotate(total=Count('character_class__name'))
@@ -112,6 +188,11 @@ class Guild(DirtyFieldsMixin, models.Model):
 
     @property
     def member_count(self):
+        summary = self.get_summary()
+
+        if summary is not None:
+            return summary.member_count
+
         return self.members.count()
 
     def get_membership(self, profile):
@@ -127,6 +208,47 @@ class Guild(DirtyFieldsMixin, models.Model):
         return super(Guild, self).save(*args, **kwargs)
 
 
+class GuildSummary(models.Model):
+    """
+    Member totals of a guild, kept current by the handlers in bdo.guild_summary.
+
+    Every member with a main character adds its level, gearscore and class.
+    """
+    guild = models.OneToOneField(Guild, related_name='summary', on_delete=models.CASCADE)
+    member_count = models.IntegerField(default=0)
+    main_count = models.IntegerField(default=0)
+    level_total = models.IntegerField(default=0)
+    gearscore_total = models.FloatField(default=0)
+    # Number of main characters of each lower case class name
+    class_distribution = JSONField(default={})
+
+    SUMMARY_FIELDS = ('member_count', 'main_count', 'level_total', 'gearscore_total')
+
+    def __str__(self):
+        return "{0}'s summary".format(self.guild)
+
+    @property
+    def average_level(self):
+        if self.main_count == 0:
+            return None
+
+        return self.level_total * 1.0 / self.main_count
+
+    @property
+    def average_renown(self):
+        if self.main_count == 0:
+            return None
+
+        return self.gearscore_total / self.main_count
+
+    def get_class_distribution(self):
+        return {
+            name: total
+            for name, total in sorted(self.class_distribution.items(), key=lambda item: item[1])
+            if total > 0
+        }
+
+
 class GuildRole(Group):
     icon = models.ImageField(null=True, blank=True)
     custom_for = models.ForeignKey("Guild", null=True, blank=True, related_name='custom_guild_roles')
@@ -144,6 +266,9 @@ class GuildMember(models.Model):
     user = models.ForeignKey("Profile", related_name="membership")
     role = models.ForeignKey("GuildRole")
 
+    # Number of finished wars shown in the attendance history
+    RECENT_ATTENDANCE = 6
+
     class Meta:
         ordering = ('id',)
         unique_together = ('guild', 'user')
@@ -154,27 +279,28 @@ class GuildMember(models.Model):
     @property
     def attendance(self):
         if hasattr(self.user, '_prefetched_attendance'):
-            return self.user._prefetched_attendance[:6]
+            return self.user._prefetched_attendance[:self.RECENT_ATTENDANCE]
 
         return self.get_attendance()
 
-    def get_attendance(self, limit=6):
+    def get_attendance(self, limit=RECENT_ATTENDANCE):
         return (self.user.attendance_set.filter(war__guild=self.guild, war__outcome__isnull=False)
                                         .order_by('-war__date')
                                         .select_related('war')[:limit])
 
     @property
     def main_character(self):
-        main = self.user.get_main()
+        # Read from the main columns of the profile
+        profile = self.user
 
-        if main is None:
+        if profile.main_character_id is None:
             return {}
 
         return {
-            "level": main.level,
-            "gearscore": (main.ap + main.aap)/2 + main.dp + self.user.npc_renown,
-            "class": main.character_class.name,
-            "name": main.name
+            "level": profile.main_level,
+            "gearscore": profile.main_gearscore,
+            "class": profile.main_class_name,
+            "name": profile.main_name
         }
 
     def has_permission(self, permission):
@@ -191,9 +317,15 @@ class GuildMember(models.Model):
 
         return profile.aggregatedguildmemberwarstats.get(guild=self.guild_id)
 
+    @property
+    def window_stats(self):
+        # Stats summed over the rollup buckets prefetched for the requested window
+        return BaseWarStatRollup.get_totals(getattr(self.user, '_prefetched_window_stats', []))
+
     @property
     def attendance_rate(self):
-        if hasattr(self, '_prefetched_attendance_rate'):
-            return self._prefetched_attendance_rate
+        if hasattr(self.user, 'member_stats'):
+            # Use prefetched value
+            return self.stats.attendance_rate
 
         return self.user.guild_attendance_rate(self.guild_id)
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from django.db import models
 from pytz import timezone
 
@@ -15,3 +17,16 @@ class Region(models.Model):
 
     def get_timezone(self):
         return timezone(self.timezone)
+
+    def get_weekday(self, date):
+        """
+        Name of the day the date falls on in the region.
+        """
+        tz = self.get_timezone()
+
+        if date.tzinfo is None:
+            localized_date = tz.localize(date)
+        else:
+            localized_date = date.astimezone(tz)
+
+        return datetime.strftime(localized_date, '%A')
@@ -1,10 +1,14 @@
+import re
+from datetime import datetime, timedelta, timezone
+
 from django.db import models
-from django.db.models import Case, IntegerField, Sum, When
+from django.db.models import Case, F, FloatField, IntegerField, Sum, Value, When
+from django.utils import timezone as django_timezone
 
 from bdo.models.war import WarAttendance, WarStat
 
 
-class BaseAggregatedWarStats(models.Model):
+class WarStatTotals(models.Model):
     command_post = models.IntegerField(default=0)
     fort = models.IntegerField(default=0)
     gate = models.IntegerField(default=0)
@@ -17,6 +21,14 @@ class BaseAggregatedWarStats(models.Model):
     death = models.IntegerField(default=0)
     siege_weapons = models.IntegerField(default=0)
     total_kills = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    KILL_FIELDS = ('guild_master', 'officer', 'member', 'siege_weapons')
+
+
+class BaseAggregatedWarStats(WarStatTotals):
     kdr = models.FloatField(default=0.0)
 
     class Meta:
@@ -24,19 +36,32 @@ class BaseAggregatedWarStats(models.Model):
 
     @property
     def base_stat_fields(self):
-        return [
-            'command_post',
-            'fort',
-            'gate',
-            'help',
-            'mount',
-            'placed_objects',
-            'guild_master',
-            'officer',
-            'member',
-            'death',
-            'siege_weapons'
-        ]
+        return list(WarStat.STAT_FIELDS)
+
+    @classmethod
+    def increment(cls, deltas, **filters):
+        """
+        Apply WarStat deltas to the matching aggregate rows.
+
+        Everything is done in one UPDATE with F() expressions so concurrent edits
+        can't overwrite each other. total_kills and kdr are derived from the
+        post-update values. Returns the number of rows updated.
+        """
+        kills_delta = sum(deltas.get(field, 0) for field in cls.KILL_FIELDS)
+        death_delta = deltas.get('death', 0)
+        total_kills_expr = F('guild_master') + F('officer') + F('member') + F('siege_weapons') + kills_delta
+        updates = {
+            field: F(field) + value
+            for field, value in deltas.items()
+            if value
+        }
+        updates['total_kills'] = total_kills_expr
+        # death is compared against its pre-update value
+        updates['kdr'] = Case(When(death=-death_delta, then=Value(0.0)),
+                              default=(total_kills_expr * 1.0 / (F('death') + death_delta)),
+                              output_field=FloatField())
+
+        return cls.objects.filter(**filters).update(**updates)
 
     def recalculate_total_kills(self):
         self.total_kills = self.guild_master + self.officer + self.member + self.siege_weapons
@@ -76,34 +101,18 @@ class BaseUserAggregatedWarStats(BaseAggregatedWarStats):
     wars_missed = models.IntegerField(default=0)
     # Reneged is counted the same as a miss but called out separately
     wars_reneged = models.IntegerField(default=0)
+    attendance_rate = models.FloatField(default=0.0)
 
     class Meta:
         abstract = True
 
-    def clone_and_increment(self, war_stat, is_attending):
-        """
-        Helper method for bulk re-creating aggregated stats.
-        """
-        new_obj = self
-        new_obj.pk = None
-        new_obj.id = None
-
-        if war_stat is not None:
-            for field in self.base_stat_fields:
-                current = getattr(new_obj, field)
-                setattr(new_obj, field, current + getattr(war_stat, field))
-            # Re-calculate total kills and kdr
-            self.recalculate_total_kills()
-            self.recalculate_kdr()
+    def recalculate_attendance_rate(self):
+        total_wars = self.wars_attended + self.wars_unavailable + self.wars_missed
 
-        if is_attending in [0, 4]:
-            new_obj.wars_attended += 1
-        elif is_attending == 1:
-            new_obj.wars_unavailable += 1
+        if not total_wars:
+            self.attendance_rate = 0.0
         else:
-            new_obj.wars_missed += 1
-
-        return new_obj
+            self.attendance_rate = (self.wars_attended + self.wars_unavailable * 0.5) / total_wars
 
     def attendance_qs(self):
         """WarAttendance filters"""
@@ -118,14 +127,16 @@ class BaseUserAggregatedWarStats(BaseAggregatedWarStats):
             wars_unavailable=Sum(Case(When(is_attending=1, then=1), default=0), output_field=IntegerField()),
             wars_missed=Sum(Case(When(is_attending__in=[3, 5], then=1), default=0), output_field=IntegerField()),
             wars_reneged=Sum(Case(When(is_attending=5, then=1), default=0), output_field=IntegerField()),
-        ).values('wars_attended', 'wars_unavailable', 'wars_missed')
+        ).values('wars_attended', 'wars_unavailable', 'wars_missed', 'wars_reneged')
 
         if attendance:
             attendance = attendance[0]
             self.wars_attended = attendance['wars_attended']
             self.wars_unavailable = attendance['wars_unavailable']
             self.wars_missed = attendance['wars_missed']
+            self.wars_reneged = attendance['wars_reneged']
 
+        self.recalculate_attendance_rate()
         self.save()
 
 
@@ -135,44 +146,62 @@ class AggregatedGuildWarStats(BaseAggregatedWarStats):
     def __str__(self):
         return "[{0}] guild's stats".format(self.guild)
 
-    @staticmethod
-    def update(guild, stats):
-        if not stats:
-            return
+    def war_stat_qs(self):
+        return (WarStat.objects.values('attendance__war__guild')
+                               .order_by('attendance__war__guild')
+                               .filter(attendance__war__guild=self.guild))
 
-        stats["total_kills"] = stats["guild_master"] + stats["officer"] + stats["member"] + stats["siege_weapons"]
 
-        try:
-            aggregated_stat = AggregatedGuildWarStats.objects.get(guild=guild)
-        except AggregatedGuildWarStats.DoesNotExist():
-            if not stats["death"]:
-                stats["kdr"] = 0.0
-            else:
-                stats["kdr"] = stats["total_kills"] * 1.0 / stats["death"]
+class AggregatedUserWarStats(BaseUserAggregatedWarStats):
+    # Outcomes of the last RECENT_WARS finished wars the user attended or reneged on.
+    # Bit 0 of recent_reneges is the most recent war.
+    recent_wars = models.IntegerField(default=0)
+    recent_reneges = models.IntegerField(default=0)
 
-            AggregatedGuildWarStats.objects.create(guild=guild, *stats)
-            return
+    RECENT_WARS = 5
 
-        for stat_field, stat_value in stats.items():
-            current = getattr(aggregated_stat, stat_field)
-            setattr(aggregated_stat, stat_field, current + stat_value)
+    def __str__(self):
+        return "{0}'s stats".format(self.user_profile)
+
+    @property
+    def recent_reneged(self):
+        return bin(self.recent_reneges).count('1')
+
+    @property
+    def renege_rate(self):
+        """
+        Likelihood for user to flake out and not actually attend a war they signed up for.
 
-        if not aggregated_stat.death:
-            aggregated_stat.kdr = 0.0
+        Percentage is a combination of historical flake out rate and recent flake out rate
+        with a bigger skew towards recent flake outs.
+        """
+        historical_wars_attended = self.wars_attended + self.wars_reneged
+
+        if historical_wars_attended == 0:
+            historical_renege_rate = 0.0
         else:
-            aggregated_stat.kdr = aggregated_stat.total_kills * 1.0 / aggregated_stat.death
+            historical_renege_rate = self.wars_reneged * 1.0 / historical_wars_attended
 
-        aggregated_stat.save()
+        if self.recent_wars == 0:
+            recent_renege_rate = 0.0
+        else:
+            recent_renege_rate = self.recent_reneged * 1.0 / self.recent_wars
 
-    def war_stat_qs(self):
-        return (WarStat.objects.values('attendance__war__guild')
-                               .order_by('attendance__war__guild')
-                               .filter(attendance__war__guild=self.guild))
+        return (historical_renege_rate * 0.3) + (recent_renege_rate * 0.7)
 
+    def recalculate_recent_wars(self):
+        recent = (WarAttendance.objects.filter(user_profile=self.user_profile_id,
+                                               war__outcome__isnull=False,
+                                               is_attending__in=[0, 4, 5])
+                                       .order_by('-war__date', '-war_id')
+                                       .values_list('is_attending', flat=True)[:self.RECENT_WARS])
+        self.recent_wars = len(recent)
+        self.recent_reneges = sum(1 << position for position, status in enumerate(recent) if status == 5)
 
-class AggregatedUserWarStats(BaseUserAggregatedWarStats):
-    def __str__(self):
-        return "{0}'s stats".format(self.user_profile)
+    def recalculate(self, save=True):
+        self.recalculate_recent_wars()
+
+        super(AggregatedUserWarStats, self).recalculate(save=save)
 
     def war_stat_qs(self):
         return (WarStat.objects.values('attendance__user_profile')
@@ -195,6 +224,11 @@ class AggregatedGuildMemberWarStats(BaseUserAggregatedWarStats):
 
     class Meta:
         unique_together = ('guild', 'user_profile')
+        # Member lists of a guild are sorted on these
+        indexes = [
+            models.Index(fields=['guild', field], name='bdo_member_{0}_idx'.format(field))
+            for field in WarStat.STAT_FIELDS + ('total_kills', 'kdr', 'attendance_rate')
+        ]
 
     def __str__(self):
         return "[{0}] {1}'s stats".format(self.guild, self.user_profile)
@@ -211,3 +245,184 @@ class AggregatedGuildMemberWarStats(BaseUserAggregatedWarStats):
                                      .filter(war__guild=self.guild,
                                              war__outcome__isnull=False,
                                              user_profile=self.user_profile))
+
+
+class BaseWarStatRollup(WarStatTotals):
+    """
+    Stat totals of a guild member for the wars in one time bucket.
+
+    Windowed totals are the sum of the few buckets in the window.
+    """
+    bucket = models.DateField()
+
+    # date_trunc() unit of the buckets
+    BUCKET_UNIT = None
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def get_date(value):
+        if isinstance(value, datetime):
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc)
+
+            return value.date()
+
+        return value
+
+    @classmethod
+    def get_bucket(cls, value):
+        """First day of the bucket containing the date."""
+        raise NotImplementedError()
+
+    @classmethod
+    def get_window_start(cls, size, value):
+        """First bucket of a window of ``size`` buckets ending with the date."""
+        raise NotImplementedError()
+
+    @staticmethod
+    def get_totals(rollups):
+        totals = {field: 0 for field in list(WarStat.STAT_FIELDS) + ['total_kills']}
+
+        for rollup in rollups:
+            for field in totals:
+                totals[field] += getattr(rollup, field)
+
+        totals['kdr'] = totals['total_kills'] * 1.0 / totals['death'] if totals['death'] else 0.0
+
+        return totals
+
+
+class WeeklyWarStatRollup(BaseWarStatRollup):
+    guild = models.ForeignKey("Guild", related_name="weekly_stats")
+    user_profile = models.ForeignKey("Profile", related_name="weekly_stats")
+
+    BUCKET_UNIT = 'week'
+
+    class Meta:
+        unique_together = ('guild', 'user_profile', 'bucket')
+
+    def __str__(self):
+        return "[{0}] {1}'s stats for the week of {2}".format(self.guild, self.user_profile, self.bucket)
+
+    @classmethod
+    def get_bucket(cls, value):
+        # ISO weeks start on Monday
+        value = cls.get_date(value)
+
+        return value - timedelta(days=value.weekday())
+
+    @classmethod
+    def get_window_start(cls, size, value):
+        return cls.get_bucket(value) - timedelta(weeks=size - 1)
+
+
+class MonthlyWarStatRollup(BaseWarStatRollup):
+    guild = models.ForeignKey("Guild", related_name="monthly_stats")
+    user_profile = models.ForeignKey("Profile", related_name="monthly_stats")
+
+    BUCKET_UNIT = 'month'
+
+    class Meta:
+        unique_together = ('guild', 'user_profile', 'bucket')
+
+    def __str__(self):
+        return "[{0}] {1}'s stats for {2}".format(self.guild, self.user_profile, self.bucket.strftime("%b %Y"))
+
+    @classmethod
+    def get_bucket(cls, value):
+        return cls.get_date(value).replace(day=1)
+
+    @classmethod
+    def get_window_start(cls, size, value):
+        bucket = cls.get_bucket(value)
+        months = bucket.year * 12 + bucket.month - size
+
+        return bucket.replace(year=months // 12, month=months % 12 + 1)
+
+
+ROLLUP_MODELS = (WeeklyWarStatRollup, MonthlyWarStatRollup)
+STAT_WINDOW_ALIASES = {
+    'week': '1w',
+    'month': '1m',
+}
+STAT_WINDOW_REGEX = re.compile(r'^(\d+)([wm])$')
+
+
+def get_stat_window(value, today=None):
+    """
+    Parse a stat window such as ``week``, ``month``, ``4w`` or ``3m``.
+
+    Returns the rollup model and the first bucket of the window, None if the window is invalid.
+    """
+    if not value:
+        return None
+
+    match = STAT_WINDOW_REGEX.match(STAT_WINDOW_ALIASES.get(value, value))
+
+    if match is None or int(match.group(1)) < 1:
+        return None
+
+    model = WeeklyWarStatRollup if match.group(2) == 'w' else MonthlyWarStatRollup
+
+    if today is None:
+        today = datetime.now(tz=timezone.utc)
+
+    try:
+        return model, model.get_window_start(int(match.group(1)), today)
+    except (OverflowError, ValueError):
+        # Window reaches before year 1
+        return None
+
+
+class BaseLedgerTotals(WarStatTotals):
+    wars_attended = models.IntegerField(default=0)
+    wars_unavailable = models.IntegerField(default=0)
+    wars_missed = models.IntegerField(default=0)
+    wars_reneged = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    LEDGER_FIELDS = WarStat.STAT_FIELDS + ('total_kills',
+                                          'wars_attended',
+                                          'wars_unavailable',
+                                          'wars_missed',
+                                          'wars_reneged')
+
+
+class WarStatLedgerEntry(BaseLedgerTotals):
+    """
+    Append-only change to a guild member's stat and attendance totals.
+
+    Entries outlive the guilds, profiles and wars they refer to.
+    """
+    guild = models.ForeignKey("Guild", related_name="+", on_delete=models.DO_NOTHING, db_constraint=False)
+    user_profile = models.ForeignKey("Profile", related_name="+", on_delete=models.DO_NOTHING, db_constraint=False)
+    war = models.ForeignKey("War", related_name="+", on_delete=models.DO_NOTHING, db_constraint=False, null=True)
+    created = models.DateTimeField(default=django_timezone.now)
+
+    class Meta:
+        index_together = (('guild', 'user_profile', 'created'), ('guild', 'user_profile', 'id'))
+
+    def __str__(self):
+        return "[{0}] {1} ledger entry {2}".format(self.guild_id, self.user_profile_id, self.created)
+
+
+class WarStatLedgerCheckpoint(BaseLedgerTotals):
+    """
+    Totals of a guild member's ledger entries up to ``last_entry_id``.
+
+    ``created`` is the latest creation time of those entries.
+    """
+    guild = models.ForeignKey("Guild", related_name="+", on_delete=models.DO_NOTHING, db_constraint=False)
+    user_profile = models.ForeignKey("Profile", related_name="+", on_delete=models.DO_NOTHING, db_constraint=False)
+    last_entry_id = models.IntegerField()
+    created = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('guild', 'user_profile', 'last_entry_id')
+
+    def __str__(self):
+        return "[{0}] {1} ledger checkpoint {2}".format(self.guild_id, self.user_profile_id, self.last_entry_id)
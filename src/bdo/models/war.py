@@ -1,4 +1,5 @@
 import re
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 from logging import getLogger
 
@@ -7,12 +8,13 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.contrib.postgres.fields import JSONField
 from django.contrib.sites.models import Site
-from django.db import models
+from django.db import connection, models
 from django.db.models import Count, F, Sum
 from django.dispatch import Signal
 import pytz
 import requests
 
+from bdo.models.region import Region
 from bdo.utils import ChoicesEnum
 from bdo.bdo_stats import BDOStats
 
@@ -32,6 +34,8 @@ class War(DirtyFieldsMixin, models.Model):
     outcome = models.IntegerField(choices=Outcome.choices(), null=True, blank=True)
     attendees = models.ManyToManyField("Profile", through='WarAttendance')
     guild = models.ForeignKey("Guild")
+    # Bumped by every roster change, see bump_version
+    version = models.IntegerField(default=0)
 
     class Meta:
         ordering = ('-date', 'id')
@@ -52,69 +56,126 @@ class War(DirtyFieldsMixin, models.Model):
 
         return war_date
 
+    @staticmethod
+    def get_stats_annotations(prefix='attendance_set__stats__'):
+        """
+        Summary stat expressions, used to annotate a page of wars in one grouped query.
+        """
+        def field(name):
+            return F(prefix + name)
+
+        return {
+            'attendance_count': Count(prefix + 'id'),
+            'total_forts_destroyed': Sum(field('command_post') + field('fort')),
+            'total_kills': Sum(field('guild_master') + field('officer') + field('member') + field('siege_weapons')),
+            'total_deaths': Sum(prefix + 'death'),
+            'total_helps': Sum(prefix + 'help'),
+        }
+
+    @classmethod
+    def annotate_stats(cls, queryset):
+        return queryset.annotate(**{
+            '_stats_{0}'.format(name): expression
+            for name, expression in cls.get_stats_annotations().items()
+        })
+
     @property
     def stats(self):
         # Summary stats
-        stats = (
-            WarStat.objects.filter(attendance__war=self)
-                           .annotate(fort_kills=F('command_post') + F('fort'),
-                                     player_kills=F('guild_master') + F('officer') + F('member') + F('siege_weapons'))
-                           .aggregate(attendance_count=Count('id'),
-                                      total_forts_destroyed=Sum('fort_kills'),
-                                      total_kills=Sum('player_kills'),
-                                      total_deaths=Sum('death'),
-                                      total_helps=Sum('help'))
-        )
-
-        return stats
+        if hasattr(self, '_stats_attendance_count'):
+            # Annotated by annotate_stats
+            return {name: getattr(self, '_stats_{0}'.format(name)) for name in War.get_stats_annotations()}
+
+        return WarStat.objects.filter(attendance__war=self).aggregate(**War.get_stats_annotations(prefix=''))
 
     def generate_attendance(self):
         # Auto-generate attendance for existing members
-        members = self.guild.members.all().prefetch_related('character_set', 'region')
+        WarAttendance.objects.bulk_create(War.build_attendance([self]))
+
+    @staticmethod
+    def build_attendance(wars):
+        """
+        Unsaved attendance of the guild members for each war.
+
+        Matches Profile.get_availability, the war day is resolved once per region and war.
+        """
+        from bdo.models.character import Profile
+        from bdo.models.guild import GuildMember
+
+        members = (GuildMember.objects.filter(guild__in={war.guild_id for war in wars})
+                                      .values_list('guild_id',
+                                                   'user_id',
+                                                   'user__region_id',
+                                                   'user__auto_sign_up',
+                                                   'user__availability',
+                                                   'user__main_character_id'))
+        regions = Region.objects.in_bulk({member[2] for member in members})
+        guild_members = defaultdict(list)
         attendances = []
 
-        for member in members:
-            kwargs = {
-                "user_profile": member,
-                "war": self,
-                "is_attending": member.get_availability(self.date)
-            }
+        for guild_id, *member in members:
+            guild_members[guild_id].append(member)
 
-            if kwargs["is_attending"] == WarAttendance.AttendanceStatus.ATTENDING.value and member.has_main:
-                # Include the character information
-                kwargs['character'] = member.get_main()
+        for war in wars:
+            war_days = {}
 
-            attendances.append(WarAttendance(**kwargs))
+            for profile_id, region_id, auto_sign_up, availability, main_character_id in guild_members[war.guild_id]:
+                if main_character_id is None or not auto_sign_up:
+                    is_attending = Profile.DEFAULT_AVAILABILITY_STATUS
+                else:
+                    if region_id not in war_days:
+                        war_days[region_id] = regions[region_id].get_weekday(war.date)
 
-        WarAttendance.objects.bulk_create(attendances)
+                    is_attending = availability.get(war_days[region_id], Profile.DEFAULT_AVAILABILITY_STATUS)
 
-    def initialize_setup_from_previous(self):
-        last_war = (War.objects.filter(guild=self.guild)
-                               .order_by('-date', '-id')
-                               .exclude(id=self.id)
-                               .prefetch_related('warteam_set', 'warcallsign_set')
-                               .first())
+                attendances.append(WarAttendance(
+                    user_profile_id=profile_id,
+                    war=war,
+                    is_attending=is_attending,
+                    # Only include the character information when attending
+                    character_id=main_character_id if is_attending == WarAttendance.AttendanceStatus.ATTENDING.value else None
+                ))
 
-        if not last_war:
-            return
+        return attendances
 
+    @staticmethod
+    def build_setup(source, wars):
+        """
+        Unsaved copies of the source war's teams and call signs for each war.
+        """
         war_teams = [
             WarTeam(
-                war=self,
+                war=war,
                 name=team.name,
-                default_role=team.default_role,
+                default_role_id=team.default_role_id,
                 type=team.type,
                 slot_setup=team.slot_setup)
-            for team in last_war.warteam_set.all()
+            for war in wars
+            for team in source.warteam_set.all()
         ]
         war_callsigns = [
             WarCallSign(
-                war=self,
+                war=war,
                 name=callsign.name
             )
-            for callsign in last_war.warcallsign_set.all()
+            for war in wars
+            for callsign in source.warcallsign_set.all()
         ]
 
+        return war_teams, war_callsigns
+
+    def initialize_setup_from_previous(self):
+        last_war = (War.objects.filter(guild=self.guild)
+                               .order_by('-date', '-id')
+                               .exclude(id=self.id)
+                               .prefetch_related('warteam_set', 'warcallsign_set')
+                               .first())
+
+        if not last_war:
+            return
+
+        war_teams, war_callsigns = War.build_setup(last_war, [self])
+
         WarTeam.objects.bulk_create(war_teams)
         WarCallSign.objects.bulk_create(war_callsigns)
 
@@ -125,8 +186,32 @@ class War(DirtyFieldsMixin, models.Model):
     def save(self, *args, **kwargs):
         self.clean_date()
 
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Never write back a stale version
+            kwargs['update_fields'] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'version'
+            ]
+
         super(War, self).save(*args, **kwargs)
 
+    @staticmethod
+    def bump_version(**filters):
+        """
+        Increment the roster version of the wars matching the filters.
+        """
+        War.objects.filter(**filters).update(version=F('version') + 1)
+
+    @staticmethod
+    def bump_profile_versions(profile_ids):
+        """
+        Increment the roster version of the unfinished wars the profiles are attending.
+
+        Their names, characters and renege rates are part of those rosters.
+        """
+        War.bump_version(outcome__isnull=True, attendance_set__user_profile_id__in=list(profile_ids))
+
     def get_display_date(self):
         return self.date.astimezone(self.guild.region.get_timezone()).strftime('%a, %d %b %Y %H:%M:%S %Z')
 
@@ -167,6 +252,96 @@ class War(DirtyFieldsMixin, models.Model):
             }]
         })
 
+    def get_roster(self):
+        """
+        Attendance, teams, call signs and war roles of the war in one payload.
+
+        Built from a fixed number of values() queries regardless of the roster size.
+        """
+        from bdo.models.stats import AggregatedUserWarStats
+
+        stat_fields = ('wars_attended', 'wars_reneged', 'recent_wars', 'recent_reneges')
+        attendance = (WarAttendance.objects.filter(war=self)
+                                           .order_by('user_profile__family_name')
+                                           .values('id',
+                                                   'user_profile_id',
+                                                   'user_profile__family_name',
+                                                   'character_id',
+                                                   'character__name',
+                                                   'character__character_class_id',
+                                                   'is_attending',
+                                                   'note',
+                                                   'slot__team_id',
+                                                   'slot__slot',
+                                                   *['user_profile__user_stats__{0}'.format(field)
+                                                     for field in stat_fields]))
+        teams = WarTeam.objects.filter(war=self).values('id', 'name', 'type', 'default_role_id', 'slot_setup')
+        call_signs = WarCallSign.objects.filter(war=self).values('id', 'name')
+        call_sign_members = (WarCallSign.members.through.objects.filter(warcallsign__war=self)
+                                                                .order_by('warcallsign_id')
+                                                                .values_list('warattendance_id', 'warcallsign_id'))
+        roles = (WarRole.objects.filter(models.Q(custom_for__isnull=True) | models.Q(custom_for=self.guild_id))
+                                .values('id', 'name'))
+
+        call_sign_mapping = {}
+
+        for attendee_id, call_sign_id in call_sign_members:
+            # The first call sign, like WarAttendanceSerializer.get_call_sign
+            call_sign_mapping.setdefault(attendee_id, call_sign_id)
+        slot_mapping = defaultdict(dict)
+        attendees = []
+
+        for row in attendance:
+            if row['slot__team_id'] is not None:
+                slot_mapping[row['slot__team_id']][row['slot__slot']] = row['id']
+
+            stats = AggregatedUserWarStats(**{
+                field: row['user_profile__user_stats__{0}'.format(field)] or 0
+                for field in stat_fields
+            })
+
+            if row['is_attending'] != WarAttendance.AttendanceStatus.ATTENDING.value or not row['character_id']:
+                name = row['user_profile__family_name']
+            else:
+                name = u"{0} ({1})".format(row['user_profile__family_name'], row['character__name'])
+
+            attendees.append({
+                'id': row['id'],
+                'user_profile': row['user_profile_id'],
+                'name': name,
+                'character': row['character_id'],
+                'character_class': row['character__character_class_id'],
+                'is_attending': row['is_attending'],
+                'note': row['note'],
+                'team': row['slot__team_id'],
+                'slot': row['slot__slot'],
+                'call_sign': call_sign_mapping.get(row['id']),
+                'renege_rate': round(stats.renege_rate, 2),
+            })
+
+        war_teams = []
+
+        for team in teams:
+            max_slots = WarTeam.get_max_slots(team['type'])
+            slot_setup = team['slot_setup'] or {}
+
+            team['slots'] = [
+                {
+                    "id": index,
+                    "role_id": slot_setup.get(str(index), team['default_role_id']),
+                    "attendee_id": slot_mapping[team['id']].get(index),
+                }
+                for index in range(1, max_slots + 1)
+            ]
+            war_teams.append(team)
+
+        return {
+            'attendance': attendees,
+            'teams': war_teams,
+            'call_signs': list(call_signs),
+            'roles': list(roles),
+        }
+
     def notify_war_finished(self):
         if not self.guild.discord_webhook or not self.guild.discord_notifications['war_end']:
             return
@@ -223,7 +398,40 @@ class WarGroup(models.Model):
 
 
 class WarCallSign(WarGroup):
-    pass
+    @staticmethod
+    def bulk_set_members(members):
+        """
+        Replace the members of each call sign id in the mapping with the attendee ids.
+
+        Only the difference with the current membership is written, with one DELETE
+        and one INSERT on the through table. No m2m_changed signals are sent.
+        Returns the added and removed (call sign id, attendee id) memberships.
+        """
+        through = WarCallSign.members.through
+        current = {
+            (call_sign_id, attendee_id): id
+            for id, call_sign_id, attendee_id in (through.objects.filter(warcallsign__in=members.keys())
+                                                                 .values_list('id',
+                                                                              'warcallsign_id',
+                                                                              'warattendance_id'))
+        }
+        wanted = {
+            (call_sign_id, attendee_id)
+            for call_sign_id, attendee_ids in members.items()
+            for attendee_id in attendee_ids
+        }
+        removed = [key for key in current if key not in wanted]
+        added = [key for key in wanted if key not in current]
+
+        if removed:
+            through.objects.filter(id__in=[current[key] for key in removed]).delete()
+
+        through.objects.bulk_create([
+            through(warcallsign_id=call_sign_id, warattendance_id=attendee_id)
+            for call_sign_id, attendee_id in added
+        ])
+
+        return added, removed
 
 
 class WarTeam(WarGroup):
@@ -236,19 +444,53 @@ class WarTeam(WarGroup):
     slot_setup = JSONField(default={}, null=True, blank=True)
     members = models.ManyToManyField('WarAttendance', through='WarTeamSlot')
 
-    @property
-    def max_slots(self):
-        if self.type == self.Type.PLATOON.value:
+    @staticmethod
+    def get_max_slots(team_type):
+        if team_type == WarTeam.Type.PLATOON.value:
             return 20
 
         return 5
 
+    @property
+    def max_slots(self):
+        return WarTeam.get_max_slots(self.type)
+
 
 class WarTeamSlot(models.Model):
     team = models.ForeignKey('WarTeam', related_name='slots')
     attendee = models.OneToOneField('WarAttendance', related_name='slot')
     slot = models.IntegerField()
 
+    @staticmethod
+    def bulk_assign(assignments):
+        """
+        Apply (team id, slot, attendee id) assignments, a None attendee clears the slot.
+
+        Assigned attendees are moved out of their previous slots. The slots are cleared
+        with one DELETE and filled with one INSERT, so no signals are sent.
+        Returns the (team id, slot) of every cleared slot.
+        """
+        assignments = list(assignments)
+        attendee_ids = [attendee_id for _, _, attendee_id in assignments if attendee_id is not None]
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {0}'
+                ' WHERE (team_id, slot) IN (SELECT * FROM unnest(%s::integer[], %s::integer[]))'
+                ' OR attendee_id = ANY(%s::integer[])'
+                ' RETURNING team_id, slot'.format(WarTeamSlot._meta.db_table),
+                [[team_id for team_id, _, _ in assignments], [slot for _, slot, _ in assignments], attendee_ids]
+            )
+            cleared = cursor.fetchall()
+
+        WarTeamSlot.objects.bulk_create([
+            WarTeamSlot(team_id=team_id, slot=slot, attendee_id=attendee_id)
+            for team_id, slot, attendee_id in assignments
+            if attendee_id is not None
+        ])
+
+        return cleared
+
 
 class WarAttendance(DirtyFieldsMixin, models.Model):
     class AttendanceStatus(ChoicesEnum):
@@ -351,6 +593,20 @@ class WarTemplate(models.Model):
 
 
 class WarStat(DirtyFieldsMixin, models.Model):
+    STAT_FIELDS = (
+        'command_post',
+        'fort',
+        'gate',
+        'help',
+        'mount',
+        'placed_objects',
+        'guild_master',
+        'officer',
+        'member',
+        'death',
+        'siege_weapons',
+    )
+
     command_post = models.IntegerField(default=0)
     fort = models.IntegerField(default=0)
     gate = models.IntegerField(default=0)
@@ -380,6 +636,28 @@ class WarStat(DirtyFieldsMixin, models.Model):
         else:
             return round(float(self.total_kills) / float(self.death), 2)
 
+    def get_stat_deltas(self, deleted=False):
+        """
+        Difference between the values being saved and the values stored in the database.
+
+        New stats count in full and deleted stats count negatively.
+        """
+        dirty_fields = self.get_dirty_fields()
+
+        if deleted:
+            return {
+                field: -dirty_fields.get(field, getattr(self, field))
+                for field in self.STAT_FIELDS
+            }
+        if self._state.adding:
+            return {field: getattr(self, field) for field in self.STAT_FIELDS}
+
+        return {
+            field: getattr(self, field) - old_value
+            for field, old_value in dirty_fields.items()
+            if field in self.STAT_FIELDS
+        }
+
     def update_fields(self, **kwargs):
         for key, value in kwargs.items():
             if not hasattr(self, key):
@@ -0,0 +1,217 @@
+"""
+Live change events of war rosters.
+
+Attendance, team slot and call sign writes publish compact events once their
+transaction commits. Clients long-poll the war's changes endpoint with the
+cursor of the last event they applied and patch their local roster.
+
+The broker is in-process. Each worker only sees events of the writes it
+handled and a poll holds its worker until the timeout, so the change feed is
+off unless ROSTER_CHANGES is set, which only suits a single worker process.
+Cursors are tagged with the id of the broker that issued them and a poll with
+a cursor of another broker answers with reset. Clients re-fetch the roster
+whenever a poll answers with reset.
+"""
+import os
+import threading
+import uuid
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.db import transaction
+
+# Events kept per war for clients catching up
+BUFFER_SIZE = 500
+# Wars buffered at once, the least recently used are evicted
+MAX_WARS = 100
+
+
+def changes_enabled():
+    return getattr(settings, 'ROSTER_CHANGES', False)
+
+
+class WarEvents(object):
+    """
+    Buffered events of a war. Every event after ``floor`` up to ``latest`` is buffered.
+    """
+    def __init__(self, position, buffer_size):
+        self.floor = position
+        self.latest = position
+        self.events = deque(maxlen=buffer_size)
+
+    def append(self, position, event):
+        if len(self.events) == self.events.maxlen:
+            self.floor = self.events[0][0]
+
+        self.events.append((position, event))
+        self.latest = position
+
+
+class RosterBroker(object):
+    """
+    Buffers the events of each war, cursors are "<broker id>:<position>" strings.
+
+    Positions count the events of all wars, so the cursors of an evicted war never match its new buffer.
+    """
+    def __init__(self, buffer_size=BUFFER_SIZE, max_wars=MAX_WARS):
+        self.buffer_size = buffer_size
+        self.max_wars = max_wars
+        self.condition = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        # Forked workers start over with their own id
+        self.pid = os.getpid()
+        self.id = uuid.uuid4().hex[:12]
+        self.sequence = 0
+        self.wars = OrderedDict()
+
+    def check_process(self):
+        if self.pid != os.getpid():
+            self.reset()
+
+    def format_cursor(self, position):
+        return u"{0}:{1}".format(self.id, position)
+
+    def parse_cursor(self, cursor):
+        """
+        Position of a cursor issued by this broker, None otherwise.
+        """
+        broker_id, _, position = str(cursor).partition(':')
+
+        if broker_id != self.id or not position.isdigit():
+            return None
+
+        return int(position)
+
+    def get_war(self, war_id):
+        war = self.wars.get(war_id)
+
+        if war is None:
+            war = self.wars[war_id] = WarEvents(self.sequence, self.buffer_size)
+
+            while len(self.wars) > self.max_wars:
+                self.wars.popitem(last=False)
+        else:
+            self.wars.move_to_end(war_id)
+
+        return war
+
+    def get_cursor(self, war_id):
+        with self.condition:
+            self.check_process()
+
+            return self.format_cursor(self.get_war(war_id).latest)
+
+    def publish(self, war_id, events):
+        with self.condition:
+            self.check_process()
+            war = self.get_war(war_id)
+
+            for event in events:
+                self.sequence += 1
+                war.append(self.sequence, event)
+
+            self.condition.notify_all()
+
+    def get_events(self, war_id, position):
+        """
+        Events after the position, None if the client has to re-fetch the roster.
+        """
+        war = self.wars.get(war_id)
+
+        if war is None or position is None or not war.floor <= position <= war.latest:
+            # The cursor is from another worker or the events were dropped
+            return None
+
+        return [
+            dict(event, cursor=self.format_cursor(event_position))
+            for event_position, event in war.events
+            if event_position > position
+        ]
+
+    def wait(self, war_id, cursor, timeout):
+        """
+        Block until there are events after the cursor or the timeout expires.
+
+        Returns the latest cursor and the events, see get_events. Cursors of
+        other brokers return at once.
+        """
+        with self.condition:
+            self.check_process()
+            position = self.parse_cursor(cursor)
+            war = self.get_war(war_id)
+
+            if position is not None:
+                self.condition.wait_for(lambda: self.wars.get(war_id) is not war or war.latest != position, timeout)
+
+            return self.format_cursor(self.get_war(war_id).latest), self.get_events(war_id, position)
+
+    def forget(self, war_id):
+        with self.condition:
+            self.check_process()
+            self.wars.pop(war_id, None)
+            # Cursors issued before answer with reset, including the waiting polls
+            self.sequence += 1
+            self.condition.notify_all()
+
+
+broker = RosterBroker()
+
+
+def publish_roster_events(war_id, events):
+    """
+    Publish the events once the current transaction commits.
+    """
+    events = list(events)
+
+    if events and changes_enabled():
+        transaction.on_commit(lambda: broker.publish(war_id, events))
+
+
+def forget_war(war_id):
+    """
+    Drop the buffered events of a finished or deleted war once the current transaction commits.
+    """
+    if changes_enabled():
+        transaction.on_commit(lambda: broker.forget(war_id))
+
+
+def attendance_event(attendance):
+    return {
+        'type': 'attendance',
+        'id': attendance.id,
+        'user_profile': attendance.user_profile_id,
+        'character': attendance.character_id,
+        'is_attending': attendance.is_attending,
+        'note': attendance.note,
+    }
+
+
+def slot_event(team_id, slot, attendee_id):
+    # A null attendee_id clears the slot
+    return {
+        'type': 'slot',
+        'team_id': team_id,
+        'slot': slot,
+        'attendee_id': attendee_id,
+    }
+
+
+def call_sign_event(call_sign_id, added=(), removed=()):
+    return {
+        'type': 'call_sign_members',
+        'call_sign_id': call_sign_id,
+        'added': sorted(added),
+        'removed': sorted(removed),
+    }
+
+
+def group_event(type, group, deleted=False):
+    # Created, renamed or deleted teams and call signs
+    return {
+        'type': type,
+        'id': group.id,
+        'name': group.name,
+        'deleted': deleted,
+    }
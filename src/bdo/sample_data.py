@@ -0,0 +1,148 @@
+"""
+Synthetic guilds for the benchmark commands and the tests.
+
+Needs the content fixture (regions, classes, guild and war roles). Rows are
+bulk created and the aggregate, summary and main character rows are filled in
+the same way the rebuild helpers do.
+"""
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from django.db import transaction
+
+from bdo.guild_summary import rebuild_guild_summaries
+from bdo.models.character import Character, Profile
+from bdo.models.content import CharacterClass
+from bdo.models.guild import Guild, GuildMember, GuildRole
+from bdo.models.region import Region
+from bdo.models.stats import AggregatedGuildMemberWarStats, AggregatedUserWarStats
+from bdo.models.war import War, WarAttendance, WarRole, WarTeam
+
+
+def get_sample_name(prefix):
+    return '{0} {1}'.format(prefix, uuid.uuid4().hex[:10])
+
+
+def create_sample_guild(member_count, region=None, seed=None):
+    """
+    Guild with member_count members, every member has a main and an alt character.
+    """
+    sample = random.Random(seed)
+    region = region or Region.objects.order_by('id').first()
+    classes = list(CharacterClass.objects.all())
+    war_roles = list(WarRole.objects.filter(custom_for__isnull=True).exclude(id=-1))
+    guild = Guild.objects.create(name=get_sample_name('Guild'),
+                                 logo_url='https://example.com/logo.png',
+                                 discord_id='',
+                                 region=region)
+
+    profiles = Profile.objects.bulk_create([
+        Profile(family_name=get_sample_name('Family'),
+                region=region,
+                auto_sign_up=True,
+                npc_renown=sample.randint(0, 5),
+                availability={day: sample.choice([0, 0, 1, 2]) for day in Profile.DEFAULT_AVAILABILITY})
+        for _ in range(member_count)
+    ])
+    profile_ids = [profile.id for profile in profiles]
+
+    Character.objects.bulk_create([
+        Character(name=get_sample_name('Character'),
+                  character_class=sample.choice(classes),
+                  profile=profile,
+                  level=sample.randint(56, 62),
+                  ap=sample.randint(150, 260),
+                  aap=sample.randint(150, 270),
+                  dp=sample.randint(200, 330),
+                  is_main=is_main)
+        for profile in profiles
+        for is_main in (True, False)
+    ])
+    Profile.preferred_roles.through.objects.bulk_create([
+        Profile.preferred_roles.through(profile_id=profile_id, warrole_id=role.id)
+        for profile_id in profile_ids
+        for role in sample.sample(war_roles, 2)
+    ])
+
+    member_role = GuildRole.objects.get(name='Member')
+    GuildMember.objects.bulk_create([
+        GuildMember(guild=guild, user_id=profile_id, role=member_role)
+        for profile_id in profile_ids
+    ])
+    GuildMember.objects.filter(guild=guild, user_id=profile_ids[0]).update(role=GuildRole.guild_master())
+
+    AggregatedUserWarStats.objects.bulk_create([
+        AggregatedUserWarStats(user_profile_id=profile_id) for profile_id in profile_ids
+    ])
+    AggregatedGuildMemberWarStats.objects.bulk_create([
+        AggregatedGuildMemberWarStats(guild=guild, user_profile_id=profile_id) for profile_id in profile_ids
+    ])
+
+    Profile.refresh_main(profile_ids)
+    rebuild_guild_summaries([guild.id])
+
+    return guild
+
+
+def create_sample_war(guild, attendee_count=0, date=None, platoons=0, parties=0):
+    """
+    War of the guild with attendee_count of its members attending.
+    """
+    war = War.objects.create(guild=guild, date=date or datetime.now(tz=timezone.utc) + timedelta(days=1))
+    members = (GuildMember.objects.filter(guild=guild)
+                                  .order_by('user_id')
+                                  .values_list('user_id', 'user__main_character_id')[:attendee_count])
+
+    WarAttendance.objects.bulk_create([
+        WarAttendance(war=war,
+                      user_profile_id=profile_id,
+                      character_id=character_id,
+                      is_attending=WarAttendance.AttendanceStatus.ATTENDING.value)
+        for profile_id, character_id in members
+    ])
+    WarTeam.objects.bulk_create(
+        [WarTeam(war=war, name='Platoon {0}'.format(index), type=WarTeam.Type.PLATOON.value, default_role_id=-1)
+         for index in range(platoons)] +
+        [WarTeam(war=war, name='Party {0}'.format(index), type=WarTeam.Type.PARTY.value, default_role_id=-1)
+         for index in range(parties)]
+    )
+
+    return war
+
+
+@contextmanager
+def rolled_back():
+    """
+    Run the block in a transaction that is always rolled back.
+    """
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def measure(func, repeat=5):
+    """
+    Run func repeat times, each in its own rolled back savepoint.
+
+    Returns the timings in milliseconds. on_commit callbacks never run.
+    """
+    timings = []
+
+    for _ in range(repeat):
+        with rolled_back():
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+
+    return timings
+
+
+def format_timings(timings):
+    timings = sorted(timings)
+
+    return 'median {0:.1f} ms, min {1:.1f} ms, max {2:.1f} ms'.format(timings[len(timings) // 2],
+                                                                      timings[0],
+                                                                      timings[-1])
@@ -1,17 +1,28 @@
+from collections import Counter
 from logging import getLogger
 
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import pre_delete, post_save, post_delete
+from django.db import transaction
+from django.db.models.signals import m2m_changed, pre_delete, pre_save, post_save, post_delete
 from django.dispatch import receiver
 
+from bdo.aggregates import mark_attendance_changed, mark_stats_changed
 from bdo.context import UserContext
+from bdo.guild_summary import apply_summary_changes, get_changes, get_contributions, get_guild_ids
+from bdo.ledger import get_attendance_deltas, get_ledger_entry, record_ledger_entries
 from bdo.models.activity import Activity
-from bdo.models.character import Profile
-from bdo.models.guild import Guild, GuildMember, WarRole
+from bdo.models.character import Character, Profile
+from bdo.models.guild import Guild, GuildMember, GuildSummary, WarRole
 from bdo.models.stats import (AggregatedGuildMemberWarStats,
                               AggregatedGuildWarStats,
                               AggregatedUserWarStats)
-from bdo.models.war import War, WarAttendance, WarStat, war_finish
+from bdo.models.war import War, WarAttendance, WarCallSign, WarStat, WarTeam, WarTeamSlot, war_finish
+from bdo.roster_events import (attendance_event,
+                               call_sign_event,
+                               forget_war,
+                               group_event,
+                               publish_roster_events,
+                               slot_event)
 
 logger = getLogger('bdo')
 
@@ -22,6 +33,7 @@ def handle_guild_save(created, instance, update_fields, *args, **kwargs):
     if created:
         type = Activity.TYPES.GUILD_CREATE.value
         AggregatedGuildWarStats.objects.create(guild=instance)
+        GuildSummary.objects.create(guild=instance)
     else:
         type = Activity.TYPES.GUILD_UPDATE.value
     if not UserContext.has_current:
@@ -72,6 +84,7 @@ def handle_war_save(created, instance, *args, **kwargs):
 @receiver(pre_delete, sender=War)
 def handle_war_delete(instance, *args, **kwargs):
     instance.notify_war_cancelled()
+    forget_war(instance.id)
 
     if not UserContext.has_current:
         return
@@ -87,6 +100,7 @@ def handle_war_delete(instance, *args, **kwargs):
 @receiver(war_finish)
 def handle_war_finish(instance, *args, **kwargs):
     instance.notify_war_finished()
+    forget_war(instance.id)
 
     if not UserContext.has_current:
         return
@@ -98,26 +112,129 @@ def handle_war_finish(instance, *args, **kwargs):
                             target_description=str(instance))
 
 
+@receiver(pre_save, sender=WarAttendance)
+def handle_war_attendance_pre_save(instance, *args, **kwargs):
+    # Capture the previous status for the stat ledger
+    if instance._state.adding:
+        instance._previous_attendance = None
+    else:
+        dirty_fields = instance.get_dirty_fields(check_relationship=True)
+        instance._previous_attendance = (dirty_fields.get('user_profile', instance.user_profile_id),
+                                         dirty_fields.get('is_attending', instance.is_attending))
+
+
+@receiver(post_save, sender=WarAttendance)
+def handle_war_attendance_ledger(instance, *args, **kwargs):
+    previous_profile_id, previous_status = getattr(instance, '_previous_attendance', None) or (None, None)
+
+    if previous_profile_id == instance.user_profile_id and previous_status == instance.is_attending:
+        return
+
+    if previous_profile_id == instance.user_profile_id:
+        entries = [get_ledger_entry(instance.war.guild_id,
+                                    instance.user_profile_id,
+                                    get_attendance_deltas(instance.war, previous_status, instance.is_attending),
+                                    war_id=instance.war_id)]
+    else:
+        entries = [
+            get_ledger_entry(instance.war.guild_id,
+                             previous_profile_id,
+                             get_attendance_deltas(instance.war, previous_status, None),
+                             war_id=instance.war_id),
+            get_ledger_entry(instance.war.guild_id,
+                             instance.user_profile_id,
+                             get_attendance_deltas(instance.war, None, instance.is_attending),
+                             war_id=instance.war_id),
+        ]
+
+    record_ledger_entries(entries)
+
+
 @receiver(post_save, sender=WarAttendance)
 def handle_war_attendance_change(instance, update_fields, *args, **kwargs):
     if (update_fields is not None and 'is_attending' not in update_fields) or not UserContext.has_current:
         return
 
-    # Track attendance changes
-    type = Activity.TYPES.ATTENDANCE_UPDATE.value
+    # Track attendance changes, logged once the change is committed
+    actor_profile = UserContext.current.user.profile
+    is_attending = instance.is_attending
 
-    Activity.objects.create(type=type,
-                            actor_profile=UserContext.current.user.profile,
-                            guild=instance.war.guild,
-                            extras={'is_attending': instance.is_attending},
-                            target=instance,
-                            target_description=str(instance))
+    def log_attendance_change():
+        Activity.objects.create(type=Activity.TYPES.ATTENDANCE_UPDATE.value,
+                                actor_profile=actor_profile,
+                                guild_id=instance.war.guild_id,
+                                extras={'is_attending': is_attending},
+                                target=instance,
+                                target_description=str(instance))
+
+    transaction.on_commit(log_attendance_change)
+
+    # Update aggregates, attendance of pending wars isn't counted yet
+    if instance.war.outcome is not None:
+        mark_attendance_changed(instance.war.guild_id, instance.user_profile_id)
+
+
+# Roster version and change event signals
+@receiver(post_save, sender=WarAttendance)
+@receiver(post_delete, sender=WarAttendance)
+@receiver(post_save, sender=WarTeam)
+@receiver(post_delete, sender=WarTeam)
+@receiver(post_save, sender=WarCallSign)
+@receiver(post_delete, sender=WarCallSign)
+def handle_roster_change(sender, instance, signal, *args, **kwargs):
+    War.bump_version(id=instance.war_id)
+
+    deleted = signal is post_delete
+
+    if sender is WarAttendance:
+        if instance.war.outcome is not None:
+            # Finished wars count towards the renege rate on the user's other rosters
+            War.bump_profile_versions([instance.user_profile_id])
+
+        if deleted:
+            event = {'type': 'attendance', 'id': instance.id, 'deleted': True}
+        else:
+            event = attendance_event(instance)
+    else:
+        event = group_event('team' if sender is WarTeam else 'call_sign', instance, deleted=deleted)
+
+    publish_roster_events(instance.war_id, [event])
+
+
+@receiver(post_save, sender=WarTeamSlot)
+@receiver(post_delete, sender=WarTeamSlot)
+def handle_team_slot_change(instance, signal, *args, **kwargs):
+    War.bump_version(warteam=instance.team_id)
+
+    if signal is post_delete:
+        event = slot_event(instance.team_id, instance.slot, None)
+    else:
+        event = slot_event(instance.team_id, instance.slot, instance.attendee_id)
 
-    # Update aggregates
-    stat, created = AggregatedGuildMemberWarStats.objects.get_or_create(guild=instance.war.guild,
-                                                                        user_profile=instance.user_profile)
-    stat.recalculate()
-    AggregatedUserWarStats.objects.get(user_profile=instance.user_profile).recalculate()
+    publish_roster_events(instance.team.war_id, [event])
+
+
+@receiver(m2m_changed, sender=WarCallSign.members.through)
+def handle_call_sign_members_change(instance, action, reverse, pk_set, *args, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    # Either side of the relation belongs to the war
+    War.bump_version(id=instance.war_id)
+
+    if action == 'post_clear':
+        # Cleared members are unknown, clients re-fetch the call signs
+        events = [{'type': 'call_sign_members', 'reset': True}]
+    else:
+        change = 'added' if action == 'post_add' else 'removed'
+
+        if reverse:
+            # The attendee joined or left the call signs
+            events = [call_sign_event(call_sign_id, **{change: [instance.id]}) for call_sign_id in pk_set]
+        else:
+            events = [call_sign_event(instance.id, **{change: pk_set})]
+
+    publish_roster_events(instance.war_id, events)
 
 
 @receiver(post_save, sender=GuildMember)
@@ -129,6 +246,102 @@ def handle_guild_member_create(created, instance, *args, **kwargs):
     AggregatedGuildMemberWarStats.objects.get_or_create(guild_id=instance.guild_id, user_profile_id=instance.user_id)
 
 
+# Guild summary signals
+@receiver(post_save, sender=GuildMember)
+@receiver(post_delete, sender=GuildMember)
+def handle_guild_member_summary(instance, signal, created=False, *args, **kwargs):
+    if signal is post_save and not created:
+        return
+
+    # Read at post_delete, characters deleted in the same cascade are no longer counted
+    contribution, _ = get_contributions(profile=instance.user_id)
+    contribution['member_count'] = 1
+
+    if signal is post_delete:
+        contribution = get_changes(contribution, {})
+
+    apply_summary_changes([instance.guild_id], contribution)
+
+
+@receiver(pre_save, sender=Character)
+@receiver(pre_delete, sender=Character)
+def handle_character_summary_pre_change(instance, *args, **kwargs):
+    # Capture the contribution before the change
+    if instance.pk is None:
+        instance._previous_summary = (Counter(), set())
+    else:
+        instance._previous_summary = get_contributions(id=instance.pk)
+
+
+@receiver(post_save, sender=Character)
+@receiver(post_delete, sender=Character)
+def handle_character_summary(instance, signal, *args, **kwargs):
+    old, old_profile_ids = getattr(instance, '_previous_summary', (Counter(), set()))
+
+    if signal is post_delete:
+        new, new_profile_ids = Counter(), set()
+    else:
+        new, new_profile_ids = get_contributions(id=instance.pk)
+
+    # Guilds are read after the change, memberships deleted in the same cascade were already updated
+    for profile_id in old_profile_ids | new_profile_ids:
+        changes = get_changes(old if profile_id in old_profile_ids else {},
+                              new if profile_id in new_profile_ids else {})
+        apply_summary_changes(get_guild_ids(profile_id), changes)
+
+
+@receiver(post_save, sender=Character)
+@receiver(post_delete, sender=Character)
+def handle_character_main(instance, *args, **kwargs):
+    Profile.refresh_main([instance.profile_id])
+
+
+@receiver(pre_save, sender=Profile)
+def handle_profile_summary_pre_save(instance, update_fields, *args, **kwargs):
+    # Created profiles aren't in a guild yet and updates without npc_renown keep it
+    if instance._state.adding or (update_fields is not None and 'npc_renown' not in update_fields):
+        instance._previous_npc_renown = None
+        return
+
+    instance._previous_npc_renown = Profile.objects.filter(id=instance.pk).values_list('npc_renown', flat=True).first()
+
+
+@receiver(post_save, sender=Profile)
+def handle_profile_summary(instance, created, *args, **kwargs):
+    previous = getattr(instance, '_previous_npc_renown', None)
+
+    if created or previous is None or previous == instance.npc_renown:
+        return
+
+    # Renown is part of the main gearscore as well
+    Profile.refresh_main([instance.id])
+
+    # Renown is part of the gearscore of the profile's mains
+    mains = Character.objects.filter(profile=instance, is_main=True).count()
+
+    apply_summary_changes(get_guild_ids(instance.id), {'gearscore_total': mains * (instance.npc_renown - previous)})
+
+
+# Fields of the profile shown on war rosters, characters bump through Profile.refresh_main
+ROSTER_PROFILE_FIELDS = ('family_name', 'region', 'npc_renown')
+
+
+@receiver(post_save, sender=Profile)
+def handle_profile_roster_change(instance, created, update_fields, *args, **kwargs):
+    if created or (update_fields is not None and not set(ROSTER_PROFILE_FIELDS) & set(update_fields)):
+        return
+
+    War.bump_profile_versions([instance.id])
+
+
+@receiver(m2m_changed, sender=Profile.preferred_roles.through)
+def handle_preferred_roles_change(instance, action, reverse, pk_set, *args, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear') or reverse:
+        return
+
+    War.bump_profile_versions([instance.id])
+
+
 @receiver(post_save, sender=Profile)
 def handle_profile_created(created, instance, *args, **kwargs):
     if not created:
@@ -141,15 +354,52 @@ def handle_profile_created(created, instance, *args, **kwargs):
     instance.preferred_roles = WarRole.objects.filter(custom_for__isnull=True).exclude(id=-1)
 
 
+@receiver(pre_save, sender=WarStat)
+def handle_war_stat_pre_save(instance, *args, **kwargs):
+    # Capture the changes before the dirty state is reset
+    dirty_fields = instance.get_dirty_fields(check_relationship=True)
+
+    if not instance._state.adding and 'attendance' in dirty_fields:
+        instance._previous_attendance_id = dirty_fields['attendance']
+    else:
+        instance._previous_attendance_id = None
+
+    instance._stat_deltas = instance.get_stat_deltas()
+
+
 @receiver(post_save, sender=WarStat)
 def handle_war_stat_saved(created, instance, *args, **kwargs):
-    # Re-calculate everything
-    logger.debug("Re-calculating stats for {0}".format(instance))
+    guild_id = instance.attendance.war.guild_id
+    profile_id = instance.attendance.user_profile_id
+    previous_attendance_id = getattr(instance, '_previous_attendance_id', None)
+
+    if previous_attendance_id is not None:
+        # Stat moved to another player, deltas don't apply
+        logger.debug("Re-calculating stats for {0}".format(instance))
+
+        previous_attendance = WarAttendance.objects.select_related('war').get(id=previous_attendance_id)
+        mark_stats_changed(previous_attendance.war.guild_id, previous_attendance.user_profile_id)
+        mark_stats_changed(guild_id, profile_id)
+
+        current = {field: getattr(instance, field) for field in WarStat.STAT_FIELDS}
+        deltas = getattr(instance, '_stat_deltas', {})
+        previous = {field: value - deltas.get(field, 0) for field, value in current.items()}
+        record_ledger_entries([
+            get_ledger_entry(previous_attendance.war.guild_id,
+                             previous_attendance.user_profile_id,
+                             previous,
+                             war_id=previous_attendance.war_id,
+                             sign=-1),
+            get_ledger_entry(guild_id, profile_id, current, war_id=instance.attendance.war_id),
+        ])
+    else:
+        logger.debug("Updating aggregated stats for {0}".format(instance))
 
-    AggregatedGuildWarStats.objects.get(guild=instance.attendance.war.guild).recalculate()
-    AggregatedGuildMemberWarStats.objects.get(guild=instance.attendance.war.guild,
-                                              user_profile=instance.attendance.user_profile).recalculate()
-    AggregatedUserWarStats.objects.get(user_profile=instance.attendance.user_profile).recalculate()
+        deltas = getattr(instance, '_stat_deltas', None)
+        mark_stats_changed(guild_id, profile_id, deltas, instance.attendance.war.date)
+
+        if deltas is not None:
+            record_ledger_entries([get_ledger_entry(guild_id, profile_id, deltas, war_id=instance.attendance.war_id)])
 
     if not UserContext.has_current:
         return
@@ -168,13 +418,17 @@ def handle_war_stat_saved(created, instance, *args, **kwargs):
 
 @receiver(post_delete, sender=WarStat)
 def handle_war_stat_deleted(instance, *args, **kwargs):
-    # Re-calculate everything
-    logger.debug("Re-calculating stats for {0}".format(instance))
-
-    AggregatedGuildWarStats.objects.get(guild=instance.attendance.war.guild).recalculate()
-    AggregatedGuildMemberWarStats.objects.get(guild=instance.attendance.war.guild,
-                                              user_profile=instance.attendance.user_profile).recalculate()
-    AggregatedUserWarStats.objects.get(user_profile=instance.attendance.user_profile).recalculate()
+    logger.debug("Updating aggregated stats for {0}".format(instance))
+
+    deltas = instance.get_stat_deltas(deleted=True)
+    mark_stats_changed(instance.attendance.war.guild_id,
+                       instance.attendance.user_profile_id,
+                       deltas,
+                       instance.attendance.war.date)
+    record_ledger_entries([get_ledger_entry(instance.attendance.war.guild_id,
+                                            instance.attendance.user_profile_id,
+                                            deltas,
+                                            war_id=instance.attendance.war_id)])
 
     if not UserContext.has_current:
         return
@@ -0,0 +1,188 @@
+"""
+Automatic assignment of attending members to the empty WarTeam slots of a war.
+
+Each (attendee, slot) pair gets a score from the slot's role, the attendee's
+preferred roles, how often their character class prefers that role and
+their gearscore, then the best overall assignment is solved as a linear
+assignment problem.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Q
+import numpy
+
+from bdo.models.character import Character, Profile
+from bdo.models.war import WarAttendance, WarTeam, WarTeamSlot
+
+# Slots of this role can be filled by anyone
+ANY_ROLE_ID = -1
+
+PREFERRED_ROLE_WEIGHT = 3.0
+CLASS_ROLE_WEIGHT = 1.0
+GEARSCORE_WEIGHT = 1.0
+
+
+def solve_assignment(cost):
+    """
+    Minimum cost assignment of the rows to the columns of the cost matrix.
+
+    Hungarian algorithm with potentials, O(n^2 m) with the inner loop vectorized.
+    Returns a list of (row, column) pairs, one per row or column, whichever is fewer.
+    """
+    cost = numpy.asarray(cost, dtype=float)
+
+    if cost.shape[0] > cost.shape[1]:
+        return [(row, column) for column, row in solve_assignment(cost.T)]
+
+    rows, columns = cost.shape
+    # Index 0 is a virtual column holding the row being added
+    u = numpy.zeros(rows + 1)
+    v = numpy.zeros(columns + 1)
+    column_row = numpy.zeros(columns + 1, dtype=int)
+    way = numpy.zeros(columns + 1, dtype=int)
+
+    for row in range(1, rows + 1):
+        column_row[0] = row
+        current = 0
+        min_values = numpy.full(columns + 1, numpy.inf)
+        used = numpy.zeros(columns + 1, dtype=bool)
+
+        while True:
+            used[current] = True
+            current_row = column_row[current]
+            free = ~used[1:]
+            reduced = cost[current_row - 1] - u[current_row] - v[1:]
+
+            improved = free & (reduced < min_values[1:])
+            min_values[1:][improved] = reduced[improved]
+            way[1:][improved] = current
+
+            candidates = numpy.where(free, min_values[1:], numpy.inf)
+            next_column = int(numpy.argmin(candidates)) + 1
+            delta = candidates[next_column - 1]
+
+            used_columns = numpy.nonzero(used)[0]
+            u[column_row[used_columns]] += delta
+            v[used_columns] -= delta
+            min_values[1:][free] -= delta
+
+            current = next_column
+
+            if column_row[current] == 0:
+                break
+
+        # Flip the augmenting path
+        while current:
+            previous = way[current]
+            column_row[current] = column_row[previous]
+            current = previous
+
+    return [(column_row[column] - 1, column - 1) for column in range(1, columns + 1) if column_row[column]]
+
+
+def compose_teams(war):
+    """
+    Proposed {team_id, slot, attendee_id} assignments filling the war's empty slots.
+
+    Slots and attendees that are already assigned are kept as they are.
+    """
+    teams = list(WarTeam.objects.filter(war=war).order_by('type', 'id')
+                                .values('id', 'type', 'default_role_id', 'slot_setup'))
+    taken = set(WarTeamSlot.objects.filter(team__war=war).values_list('team_id', 'slot'))
+    attendees = list(WarAttendance.objects.filter(war=war,
+                                                  is_attending=WarAttendance.AttendanceStatus.ATTENDING.value,
+                                                  user_profile__isnull=False,
+                                                  slot__isnull=True)
+                                          .values_list('id', 'user_profile_id', 'character_id'))
+
+    # Earlier platoons and parties get the higher gearscores
+    team_priority = {}
+
+    for team_type in (WarTeam.Type.PLATOON.value, WarTeam.Type.PARTY.value):
+        team_ids = [team['id'] for team in teams if team['type'] == team_type]
+
+        for index, team_id in enumerate(team_ids):
+            team_priority[team_id] = 1.0 - index * 1.0 / len(team_ids)
+
+    slots = []
+
+    for team in teams:
+        max_slots = WarTeam.get_max_slots(team['type'])
+        slot_setup = team['slot_setup'] or {}
+
+        for index in range(1, max_slots + 1):
+            if (team['id'], index) not in taken:
+                slots.append((team['id'], index, int(slot_setup.get(str(index), team['default_role_id']))))
+
+    if not slots or not attendees:
+        return []
+
+    profile_ids = {profile_id for _, profile_id, _ in attendees}
+    character_ids = {character_id for _, _, character_id in attendees if character_id is not None}
+    characters = {}
+    main_characters = {}
+
+    for character_id, profile_id, is_main, class_id, ap, aap, dp, npc_renown in (
+            Character.objects.filter(Q(is_main=True) | Q(id__in=character_ids), profile__in=profile_ids)
+                             .values_list('id', 'profile_id', 'is_main', 'character_class_id',
+                                          'ap', 'aap', 'dp', 'profile__npc_renown')):
+        character = (class_id, Character.get_gearscore(ap, aap, dp, npc_renown))
+        characters[character_id] = character
+
+        if is_main:
+            main_characters[profile_id] = character
+
+    preferred_roles = defaultdict(set)
+
+    for profile_id, role_id in (Profile.preferred_roles.through.objects.filter(profile__in=profile_ids)
+                                                                       .values_list('profile_id', 'warrole_id')):
+        preferred_roles[profile_id].add(role_id)
+
+    # The character picked for the war, the main otherwise
+    attendee_characters = [
+        characters.get(character_id) or main_characters.get(profile_id) or (None, 0)
+        for _, profile_id, character_id in attendees
+    ]
+
+    # How often the attending members of each class prefer each role
+    class_members = Counter(class_id for class_id, _ in attendee_characters)
+    class_roles = Counter(
+        (class_id, role_id)
+        for (class_id, _), (_, profile_id, _) in zip(attendee_characters, attendees)
+        for role_id in preferred_roles[profile_id]
+    )
+
+    role_ids = sorted({role_id for _, _, role_id in slots})
+    slot_roles = numpy.array([role_ids.index(role_id) for _, _, role_id in slots])
+    open_slots = numpy.array([role_id == ANY_ROLE_ID for _, _, role_id in slots])
+
+    preference = numpy.array([
+        [role_id in preferred_roles[profile_id] for role_id in role_ids]
+        for _, profile_id, _ in attendees
+    ], dtype=float)
+    class_affinity = numpy.array([
+        [class_roles[(class_id, role_id)] * 1.0 / class_members[class_id] for role_id in role_ids]
+        for class_id, _ in attendee_characters
+    ])
+    gearscores = numpy.array([gearscore for _, gearscore in attendee_characters], dtype=float)
+
+    if gearscores.max() > gearscores.min():
+        gearscores = (gearscores - gearscores.min()) / (gearscores.max() - gearscores.min())
+    else:
+        gearscores = numpy.zeros(len(attendees))
+
+    priorities = numpy.array([team_priority[team_id] for team_id, _, _ in slots])
+
+    # Score of every (attendee, slot) pair, roles don't matter for slots open to anyone
+    role_score = PREFERRED_ROLE_WEIGHT * preference[:, slot_roles] + CLASS_ROLE_WEIGHT * class_affinity[:, slot_roles]
+    role_score[:, open_slots] = 0
+    score = role_score + GEARSCORE_WEIGHT * numpy.outer(gearscores, priorities)
+
+    return [
+        {
+            'team_id': slots[column][0],
+            'slot': slots[column][1],
+            'attendee_id': attendees[row][0],
+        }
+        for row, column in sorted(solve_assignment(score.max() - score), key=lambda pair: pair[1])
+    ]
@@ -0,0 +1,6 @@
+import os
+
+from django.conf import settings
+
+# Regions, character classes, guild and war roles
+CONTENT_FIXTURE = os.path.join(settings.BASE_DIR, 'fixtures', 'content.json')
@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta, timezone
+
+from django.test import TestCase, override_settings
+
+from api.serializers.war import WarSubmitSerializer
+from bdo.aggregate_triggers import install_triggers
+from bdo.aggregates import (APPROXIMATE_COLUMNS,
+                            KEY_FIELDS,
+                            ROLLUP_KEY_FIELDS,
+                            get_aggregate_columns,
+                            get_rollup_columns,
+                            rebuild_aggregates,
+                            rebuild_rollups)
+from bdo.models.character import Profile
+from bdo.models.stats import ROLLUP_MODELS
+from bdo.models.war import War, WarAttendance, WarStat
+from bdo.sample_data import create_sample_guild, create_sample_war
+from bdo.tests import CONTENT_FIXTURE
+
+
+@override_settings(AGGREGATE_TRIGGERS=True)
+class AggregateTriggerParityTests(TestCase):
+    """
+    Every change is applied by the triggers alone, then compared with a rebuild from scratch.
+    """
+    fixtures = [CONTENT_FIXTURE]
+
+    def setUp(self):
+        install_triggers()
+
+        self.guild = create_sample_guild(6, seed=1)
+        # War.save moves past dates to the next war day, which would change the rollup buckets
+        self.war = create_sample_war(self.guild,
+                                     attendee_count=5,
+                                     date=datetime.now(tz=timezone.utc) + timedelta(days=3))
+        self.attendance = list(self.war.attendance_set.select_related('user_profile').order_by('id'))
+
+    def get_stats(self, value):
+        return {field: value for field in WarStat.STAT_FIELDS}
+
+    def get_aggregate_rows(self, model):
+        columns = get_aggregate_columns(model)
+        key_count = len(KEY_FIELDS[model])
+        rows = {}
+
+        for row in model.objects.values_list(*columns):
+            rows[row[:key_count]] = tuple(
+                round(value, 6) if column in APPROXIMATE_COLUMNS else value
+                for column, value in zip(columns, row)
+            )
+
+        return rows
+
+    def get_rollup_rows(self, model):
+        # Buckets that went back to zero are kept by the triggers and dropped by a rebuild
+        return {
+            row[:len(ROLLUP_KEY_FIELDS)]: row
+            for row in model.objects.values_list(*get_rollup_columns())
+            if any(row[len(ROLLUP_KEY_FIELDS):])
+        }
+
+    def assertMatchesRebuild(self):
+        maintained = {model: self.get_aggregate_rows(model) for model in KEY_FIELDS}
+        maintained_rollups = {model: self.get_rollup_rows(model) for model in ROLLUP_MODELS}
+
+        for model in KEY_FIELDS:
+            rebuild_aggregates(model)
+        for model in ROLLUP_MODELS:
+            rebuild_rollups(model)
+
+        for model in KEY_FIELDS:
+            self.assertEqual(maintained[model], self.get_aggregate_rows(model), model.__name__)
+        for model in ROLLUP_MODELS:
+            self.assertEqual(maintained_rollups[model], self.get_rollup_rows(model), model.__name__)
+
+    def finish_war(self, outcome=War.Outcome.WIN.value):
+        self.war.refresh_from_db()
+        self.war.outcome = outcome
+        self.war.save()
+
+    def test_war_stat_create(self):
+        WarStat.objects.create(attendance=self.attendance[0], **self.get_stats(2))
+
+        self.assertMatchesRebuild()
+
+    def test_war_stat_edit(self):
+        stat = WarStat.objects.create(attendance=self.attendance[0], **self.get_stats(2))
+        stat.death = 0
+        stat.member = 9
+        stat.save()
+
+        self.assertMatchesRebuild()
+
+    def test_war_stat_move(self):
+        other_war = create_sample_war(self.guild, attendee_count=2, date=self.war.date + timedelta(days=40))
+        stat = WarStat.objects.create(attendance=self.attendance[0], **self.get_stats(3))
+
+        # To another member of the same war, then to another war
+        stat.attendance = self.attendance[1]
+        stat.save()
+        stat.attendance = other_war.attendance_set.order_by('id').last()
+        stat.save()
+
+        self.assertMatchesRebuild()
+
+    def test_war_stat_delete(self):
+        stat = WarStat.objects.create(attendance=self.attendance[0], **self.get_stats(4))
+        WarStat.objects.create(attendance=self.attendance[1], **self.get_stats(1))
+        stat.delete()
+
+        self.assertMatchesRebuild()
+
+    def test_attendance_status_change(self):
+        self.finish_war()
+
+        for attendance, status in zip(self.attendance, WarAttendance.AttendanceStatus):
+            attendance.is_attending = status.value
+            attendance.save()
+
+        # Moved to another profile and back to attending
+        self.attendance[0].user_profile = Profile.objects.exclude(attendance_set__war=self.war).first()
+        self.attendance[0].save()
+        self.attendance[-1].is_attending = WarAttendance.AttendanceStatus.ATTENDING.value
+        self.attendance[-1].save()
+
+        self.assertMatchesRebuild()
+
+    def test_outcome_change(self):
+        WarAttendance.objects.filter(id=self.attendance[0].id).update(
+            is_attending=WarAttendance.AttendanceStatus.RENEGED.value)
+        WarStat.objects.create(attendance=self.attendance[1], **self.get_stats(1))
+
+        self.finish_war()
+        self.assertMatchesRebuild()
+
+        # Re-opened, then finished with another outcome
+        self.finish_war(outcome=None)
+        self.assertMatchesRebuild()
+
+        self.finish_war(outcome=War.Outcome.LOSS.value)
+        self.assertMatchesRebuild()
+
+    def test_bulk_create(self):
+        self.finish_war()
+        WarStat.objects.bulk_create([
+            WarStat(attendance=attendance, **self.get_stats(index))
+            for index, attendance in enumerate(self.attendance)
+        ])
+        late_profile = Profile.objects.exclude(attendance_set__war=self.war).first()
+        WarAttendance.objects.bulk_create([
+            WarAttendance(war=self.war,
+                          user_profile=late_profile,
+                          is_attending=WarAttendance.AttendanceStatus.LATE.value),
+        ])
+        WarAttendance.objects.filter(war=self.war).update(is_attending=WarAttendance.AttendanceStatus.NO_SHOW.value)
+
+        self.assertMatchesRebuild()
+
+    def test_war_submission(self):
+        stats = [
+            dict(self.get_stats(index), attended=index != 0, user_profile=attendance.user_profile, attendance=None)
+            for index, attendance in enumerate(self.attendance)
+        ]
+
+        WarSubmitSerializer(context={'war': self.war}).create({'outcome': War.Outcome.WIN.value, 'stats': stats})
+
+        self.assertMatchesRebuild()
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone
+
+from django.test import TestCase
+
+from bdo.models.guild import Guild
+from bdo.models.war import War
+from bdo.sample_data import create_sample_guild
+from bdo.tests import CONTENT_FIXTURE
+
+
+class PendingWarTests(TestCase):
+    fixtures = [CONTENT_FIXTURE]
+
+    def setUp(self):
+        self.guild = create_sample_guild(1, seed=6)
+        self.now = datetime.now(tz=timezone.utc)
+
+    def create_war(self, days, outcome=None):
+        war = War.objects.create(guild=self.guild, date=self.now + timedelta(days=1))
+        # War.save moves past dates to the next war day
+        War.objects.filter(id=war.id).update(date=self.now + timedelta(days=days), outcome=outcome)
+
+        return war
+
+    def assertPendingWar(self, war):
+        war_id = getattr(war, 'id', None)
+
+        self.assertEqual(self.guild.pending_war(), war_id)
+        self.assertEqual(Guild.annotate_list(Guild.objects.filter(id=self.guild.id)).get().pending_war(), war_id)
+
+    def test_no_wars(self):
+        self.assertPendingWar(None)
+
+    def test_finished_wars(self):
+        self.create_war(-2, outcome=War.Outcome.WIN.value)
+
+        self.assertPendingWar(None)
+
+    def test_earliest_upcoming_war(self):
+        self.create_war(-2, outcome=War.Outcome.WIN.value)
+        upcoming_war = self.create_war(1)
+        self.create_war(2)
+
+        self.assertPendingWar(upcoming_war)
+
+    def test_abandoned_war_is_passed_over(self):
+        self.create_war(-7)
+        new_war = self.create_war(1)
+
+        self.assertPendingWar(new_war)
+
+    def test_latest_war_waiting_for_its_outcome(self):
+        self.create_war(-7)
+        started_war = self.create_war(-1)
+
+        self.assertPendingWar(started_war)
@@ -0,0 +1,37 @@
+from django.test import TestCase
+
+from bdo.models.character import Profile
+from bdo.models.guild import GuildMember
+from bdo.sample_data import create_sample_guild
+from bdo.signals import handle_profile_summary_pre_save
+from bdo.tests import CONTENT_FIXTURE
+
+
+class ProfileSummaryPreSaveTests(TestCase):
+    fixtures = [CONTENT_FIXTURE]
+
+    def setUp(self):
+        guild = create_sample_guild(1, seed=7)
+        self.profile = GuildMember.objects.get(guild=guild).user
+
+    def test_created_profile(self):
+        profile = Profile(family_name='Created')
+
+        with self.assertNumQueries(0):
+            handle_profile_summary_pre_save(instance=profile, update_fields=None)
+
+        self.assertIsNone(profile._previous_npc_renown)
+
+    def test_update_fields_without_renown(self):
+        with self.assertNumQueries(0):
+            handle_profile_summary_pre_save(instance=self.profile, update_fields=['family_name'])
+
+        self.assertIsNone(self.profile._previous_npc_renown)
+
+    def test_renown_change(self):
+        previous = self.profile.npc_renown
+
+        with self.assertNumQueries(1):
+            handle_profile_summary_pre_save(instance=self.profile, update_fields=['npc_renown'])
+
+        self.assertEqual(self.profile._previous_npc_renown, previous)
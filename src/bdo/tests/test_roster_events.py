@@ -0,0 +1,60 @@
+from django.test import SimpleTestCase
+
+from bdo.roster_events import RosterBroker
+
+
+class RosterBrokerTests(SimpleTestCase):
+    def setUp(self):
+        self.broker = RosterBroker(buffer_size=3, max_wars=2)
+
+    def event(self, index):
+        return {'type': 'attendance', 'id': index}
+
+    def test_events_after_cursor(self):
+        cursor = self.broker.get_cursor(1)
+        self.broker.publish(1, [self.event(1), self.event(2)])
+
+        latest, events = self.broker.wait(1, cursor, 0)
+
+        self.assertEqual([event['id'] for event in events], [1, 2])
+        self.assertEqual(events[-1]['cursor'], latest)
+        self.assertEqual(self.broker.wait(1, latest, 0), (latest, []))
+
+    def test_other_wars_events(self):
+        cursor = self.broker.get_cursor(1)
+        self.broker.publish(2, [self.event(1)])
+
+        self.assertEqual(self.broker.wait(1, cursor, 0), (cursor, []))
+
+    def test_foreign_cursor_resets(self):
+        other = RosterBroker()
+        cursor = other.get_cursor(1)
+
+        latest, events = self.broker.wait(1, cursor, 0)
+
+        self.assertIsNone(events)
+        self.assertEqual(latest, self.broker.get_cursor(1))
+
+    def test_dropped_events_reset(self):
+        cursor = self.broker.get_cursor(1)
+        self.broker.publish(1, [self.event(index) for index in range(4)])
+
+        self.assertIsNone(self.broker.wait(1, cursor, 0)[1])
+
+    def test_evicts_least_recent_war(self):
+        cursor = self.broker.get_cursor(1)
+        self.broker.publish(2, [self.event(1)])
+        self.broker.publish(3, [self.event(2)])
+
+        self.assertEqual(set(self.broker.wars), {2, 3})
+        # Re-created wars don't accept cursors of their evicted buffer
+        self.broker.publish(1, [self.event(3)])
+        self.assertIsNone(self.broker.wait(1, cursor, 0)[1])
+
+    def test_forget_resets(self):
+        cursor = self.broker.get_cursor(1)
+
+        self.broker.forget(1)
+
+        self.assertNotIn(1, self.broker.wars)
+        self.assertIsNone(self.broker.wait(1, cursor, 0)[1])
@@ -0,0 +1,46 @@
+import itertools
+import random
+
+from django.test import SimpleTestCase
+
+from bdo.team_composer import solve_assignment
+
+
+class SolveAssignmentTests(SimpleTestCase):
+    def get_brute_force_cost(self, cost):
+        rows, columns = len(cost), len(cost[0])
+
+        if rows <= columns:
+            return min(sum(cost[row][column] for row, column in enumerate(permutation))
+                       for permutation in itertools.permutations(range(columns), rows))
+
+        return min(sum(cost[row][column] for column, row in enumerate(permutation))
+                   for permutation in itertools.permutations(range(rows), columns))
+
+    def assertOptimal(self, cost):
+        pairs = solve_assignment(cost)
+        rows = [row for row, _ in pairs]
+        columns = [column for _, column in pairs]
+
+        # One pair per row or column, whichever is fewer, each used once
+        self.assertEqual(len(pairs), min(len(cost), len(cost[0])))
+        self.assertEqual(len(set(rows)), len(rows))
+        self.assertEqual(len(set(columns)), len(columns))
+        self.assertAlmostEqual(sum(cost[row][column] for row, column in pairs), self.get_brute_force_cost(cost))
+
+    def test_matches_brute_force(self):
+        sample = random.Random(0)
+
+        for _ in range(1000):
+            rows, columns = sample.randint(1, 6), sample.randint(1, 6)
+
+            if sample.random() < 0.5:
+                # Small integers, with many ties
+                cost = [[sample.randint(0, 3) for _ in range(columns)] for _ in range(rows)]
+            else:
+                cost = [[sample.uniform(-10, 100) for _ in range(columns)] for _ in range(rows)]
+
+            self.assertOptimal(cost)
+
+    def test_constant_matrix(self):
+        self.assertOptimal([[1.0] * 4 for _ in range(4)])
@@ -0,0 +1,49 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from bdo.models.war import WarCallSign, WarTeamSlot
+from bdo.sample_data import create_sample_guild, create_sample_war
+from bdo.tests import CONTENT_FIXTURE
+
+
+class WarRosterTests(TestCase):
+    fixtures = [CONTENT_FIXTURE]
+
+    def setUp(self):
+        self.guild = create_sample_guild(40, seed=2)
+
+    def create_war(self, attendee_count):
+        war = create_sample_war(self.guild, attendee_count=attendee_count, platoons=2, parties=1)
+        teams = list(war.warteam_set.order_by('id'))
+        call_signs = [WarCallSign.objects.create(war=war, name=name) for name in ('Alpha', 'Bravo')]
+
+        for index, attendance in enumerate(war.attendance_set.order_by('id')):
+            WarTeamSlot.objects.create(team=teams[index % 2], attendee=attendance, slot=index // 2 + 1)
+            call_signs[index % 2].members.add(attendance)
+
+        return war
+
+    def count_roster_queries(self, war):
+        with CaptureQueriesContext(connection) as queries:
+            war.get_roster()
+
+        return len(queries)
+
+    def test_query_count_is_independent_of_attendees(self):
+        small_war = self.create_war(1)
+        large_war = self.create_war(40)
+
+        self.assertEqual(self.count_roster_queries(small_war), self.count_roster_queries(large_war))
+
+    def test_call_sign_is_the_first_one(self):
+        war = self.create_war(1)
+        attendance = war.attendance_set.get()
+        first_call_sign = war.warcallsign_set.order_by('id').first()
+        # The attendee is in Alpha, adding it to a later call sign keeps Alpha
+        WarCallSign.objects.create(war=war, name='Charlie').members.add(attendance)
+
+        roster = war.get_roster()
+
+        self.assertEqual(roster['attendance'][0]['call_sign'], first_call_sign.id)
+        self.assertEqual(attendance.warcallsign_set.all()[0].id, first_call_sign.id)
@@ -1,7 +1,51 @@
 from enum import Enum
 
+from django.db.models import Prefetch
+from django.db.models.expressions import RawSQL
+
 
 class ChoicesEnum(Enum):
     @classmethod
     def choices(cls):
         return ((field.value, field.name) for field in cls)
+
+
+def get_top_prefetch(lookup, queryset, partition_by, order_by, limit, to_attr=None, partition_values=None):
+    """
+    Prefetch of the first `limit` rows of the queryset for each `partition_by` value.
+
+    Rows are ranked with ROW_NUMBER() in the database, so only the kept rows are fetched.
+    order_by takes the same field names as QuerySet.order_by, the primary key breaks ties.
+    The prefetch only filters the outer query by the instances, pass their `partition_values`
+    so only their rows are ranked.
+    """
+    order_fields = [field.lstrip('-') for field in order_by]
+    ranked = queryset.order_by().values_list('pk', partition_by, *order_fields)
+
+    if partition_values is not None:
+        partition_values = list(partition_values)
+
+        if not partition_values:
+            # An empty IN can't be compiled to SQL
+            return Prefetch(lookup, queryset.none(), to_attr)
+
+        ranked = ranked.filter(**{'{0}__in'.format(partition_by): partition_values})
+
+    sql, params = ranked.query.sql_with_params()
+    columns = ['row_order_{0}'.format(index) for index in range(len(order_by))]
+    ordering = [
+        '{0} {1}'.format(column, 'DESC' if field.startswith('-') else 'ASC')
+        for column, field in zip(columns, order_by)
+    ]
+    ranked_sql = (
+        'SELECT row_id FROM ('
+        ' SELECT row_id, ROW_NUMBER() OVER (PARTITION BY row_partition ORDER BY {ordering}) AS row_position'
+        ' FROM ({sql}) AS ranked ({columns})'
+        ') positions WHERE row_position <= %s'
+    ).format(ordering=', '.join(ordering + ['row_id']),
+             sql=sql,
+             columns=', '.join(['row_id', 'row_partition'] + columns))
+
+    queryset = queryset.filter(pk__in=RawSQL(ranked_sql, tuple(params) + (limit,))).order_by(*order_by)
+
+    return Prefetch(lookup, queryset, to_attr)
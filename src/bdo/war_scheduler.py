@@ -0,0 +1,104 @@
+"""
+Pre-scheduling of upcoming wars for many guilds at once.
+"""
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+
+from django.db import transaction
+
+from bdo.models.content import WarNode
+from bdo.models.guild import Guild
+from bdo.models.war import War, WarAttendance, WarCallSign, WarTeam
+
+logger = getLogger('bdo')
+
+
+def get_war_days():
+    """
+    Names of the days node wars are fought on.
+    """
+    day_names = dict(WarNode.DAY_CHOICES)
+
+    return {day_names[day] for day in WarNode.objects.values_list('war_day', flat=True).distinct()}
+
+
+def get_war_dates(region, days, war_days, now=None):
+    """
+    Start times of the wars in the next ``days`` days of the region, matching War.next_war.
+    """
+    if now is None:
+        now = datetime.now(tz=timezone.utc)
+
+    first_war = datetime(year=now.year, month=now.month, day=now.day,
+                         hour=region.node_war_start_time.hour, tzinfo=timezone.utc)
+
+    if first_war < now:
+        first_war += timedelta(days=1)
+
+    dates = [first_war + timedelta(days=offset) for offset in range(days)]
+
+    return [date for date in dates if region.get_weekday(date) in war_days]
+
+
+def schedule_wars(guilds, days, use_last_setup=True, now=None):
+    """
+    Create the missing wars of the guilds for the next ``days`` days.
+
+    Wars, attendance, teams and call signs are bulk inserted in one transaction.
+    Wars that already exist are skipped, so re-runs are cheap no-ops. The guild
+    rows are locked while checking, so concurrent runs never create a war twice.
+    Returns the created wars.
+    """
+    war_days = get_war_days()
+    planned = {}
+
+    for guild in guilds:
+        if guild.region is None:
+            logger.warning("Skipping {0}, it has no region".format(guild))
+            continue
+
+        for date in get_war_dates(guild.region, days, war_days, now):
+            planned[(guild.id, date)] = War(guild=guild, date=date)
+
+    if not planned:
+        return []
+
+    guild_ids = sorted({guild_id for guild_id, _ in planned})
+
+    with transaction.atomic():
+        # Concurrent runs wait for each other, so only one of them creates a war
+        list(Guild.objects.filter(id__in=guild_ids).order_by('id').select_for_update().values_list('id'))
+        existing = set(War.objects.filter(guild__in=guild_ids, date__in={date for _, date in planned})
+                                  .values_list('guild_id', 'date'))
+        wars = [war for key, war in planned.items() if key not in existing]
+
+        if not wars:
+            return []
+
+        # bulk_create sets the primary keys on PostgreSQL
+        War.objects.bulk_create(wars)
+        WarAttendance.objects.bulk_create(War.build_attendance(wars))
+
+        if use_last_setup:
+            new_war_ids = [war.id for war in wars]
+            last_wars = (War.objects.filter(guild__in={war.guild_id for war in wars})
+                                    .exclude(id__in=new_war_ids)
+                                    .order_by('guild_id', '-date', '-id')
+                                    .distinct('guild_id')
+                                    .prefetch_related('warteam_set', 'warcallsign_set'))
+            last_war_mapping = {war.guild_id: war for war in last_wars}
+            war_teams = []
+            war_callsigns = []
+
+            for war in wars:
+                if war.guild_id not in last_war_mapping:
+                    continue
+
+                teams, callsigns = War.build_setup(last_war_mapping[war.guild_id], [war])
+                war_teams.extend(teams)
+                war_callsigns.extend(callsigns)
+
+            WarTeam.objects.bulk_create(war_teams)
+            WarCallSign.objects.bulk_create(war_callsigns)
+
+    return wars
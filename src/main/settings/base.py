@@ -215,6 +215,12 @@ DISCORD_BOT_TOKEN = os.environ.get('BDO_GUILD_BOT_TOKEN', None)
 # App Settings
 ## Bump times by an hour if True
 DST_ADJUSTED = False
+## Maintain aggregated stats with database triggers instead of signal handlers.
+## Install them first with `manage.py aggregate-triggers install`
+AGGREGATE_TRIGGERS = False
+## Serve live roster changes from the in-process broker in bdo.roster_events.
+## Polls hold a worker and only see its own writes, so only enable with a single worker process
+ROSTER_CHANGES = False
 
 # Email
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -6,6 +6,8 @@ LOCAL_DEVELOPMENT = True
 DEBUG = True
 
 PAGE_CACHE_SECONDS = 1
+# runserver is a single process
+ROSTER_CHANGES = True
 ALLOWED_HOSTS = ['192.168.56.102', 'localhost', '127.0.0.1', '[::1]', '0.0.0.0', 'localhost:8000']
 
 DATABASES = {